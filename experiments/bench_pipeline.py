@@ -0,0 +1,328 @@
+"""
+Benchmark of the PD subgraph pipeline stages on synthetic UMLS releases (experiments/synthetic_umls.py).
+
+Every stage runs in a fresh process, in pipeline order, on the outputs of the previous stage:
+    bfs_node_only -> filter_rel_by_cuis -> filter_mrconso -> filter_mrsty -> build_triples -> build_mappings
+and is measured for wall / CPU time and peak RSS (of the stage process; n_workers > 1 scan workers are
+reported separately as children_peak_rss_mb). --trace-python adds the tracemalloc peak of Python / NumPy
+allocations, which slows the stage down, so its times are not comparable with untraced runs.
+
+The report (JSON) records the code version and environment next to the numbers; --compare OLD.json prints
+the change per (size, stage) and exits with 1 if a stage got slower / bigger by more than --threshold.
+
+Run from the project root:
+    python -m experiments.bench_pipeline --sizes 1M 10M --report data/benchmarks/pipeline.json
+    python -m experiments.bench_pipeline --sizes 1M --compare data/benchmarks/pipeline.json
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from experiments.synthetic_umls import parse_size, write_synthetic_release
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_DIR = os.path.join(BASE_DIR, "data", "benchmarks")
+
+REPORT_VERSION = 1
+MAX_HOPS = 2
+# Relative change of wall_s / peak_rss_mb counted as a regression by --compare
+THRESHOLD = 0.10
+
+STAGES = ["bfs_node_only", "filter_rel_by_cuis", "filter_mrconso", "filter_mrsty", "build_triples",
+          "build_mappings"]
+
+
+def _peak_rss_bytes(who="self"):
+    # Linux: VmHWM starts over at exec, ru_maxrss would still hold the parent's peak of before the spawn
+    if who == "self" and os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", "r", encoding="utf-8") as fin:
+            for line in fin:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+        # ru_maxrss is in KB on Linux, in bytes on macOS
+        return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    if sys.platform == "win32" and who == "self":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    return None
+
+
+def _mb(n_bytes):
+    return None if n_bytes is None else round(n_bytes / (1 << 20), 1)
+
+
+def _count_rows(csv_path):
+    # Data rows of a stage output (header excluded)
+    with open(csv_path, "rb") as fin:
+        return max(0, sum(block.count(b"\n") for block in iter(lambda: fin.read(1 << 20), b"")) - 1)
+
+
+#############################
+# Stages (run in the child process)
+#############################
+# Every stage reads release_dir / work_dir and returns {"input_bytes": ..., "rows_out": ...}
+
+def stage_bfs_node_only(release_dir, work_dir, n_workers, max_hops):
+    from scripts.kg_builder.pd_bfs_nhop import PD_CUI, bfs_node_only
+    from scripts.umls.cui_intern import save_cui_ids
+
+    mrrel_path = os.path.join(release_dir, "MRREL.RRF")
+    nodes = bfs_node_only(mrrel_path, PD_CUI, max_hops=max_hops, n_workers=n_workers)
+    save_cui_ids(os.path.join(work_dir, "cuis.txt"), nodes)
+    return {"input_bytes": os.path.getsize(mrrel_path) * max_hops, "rows_out": len(nodes)}
+
+
+def stage_filter_rel_by_cuis(release_dir, work_dir, n_workers, max_hops):
+    from scripts.kg_builder.pd_bfs_nhop import filter_rel_by_cuis
+    from scripts.umls.cui_intern import load_cui_ids
+
+    mrrel_path = os.path.join(release_dir, "MRREL.RRF")
+    out_path = os.path.join(work_dir, "rel.csv")
+    filter_rel_by_cuis(mrrel_path, load_cui_ids(os.path.join(work_dir, "cuis.txt")), out_path, n_workers=n_workers)
+    return {"input_bytes": os.path.getsize(mrrel_path), "rows_out": _count_rows(out_path)}
+
+
+def stage_filter_mrconso(release_dir, work_dir, n_workers, max_hops):
+    from scripts.umls.chunk_extract_example import filter_mrconso
+    from scripts.umls.cui_intern import load_cui_ids
+
+    mrconso_path = os.path.join(release_dir, "MRCONSO.RRF")
+    out_path = os.path.join(work_dir, "conso.csv")
+    filter_mrconso(mrconso_path, load_cui_ids(os.path.join(work_dir, "cuis.txt")), out_path, n_workers=n_workers)
+    return {"input_bytes": os.path.getsize(mrconso_path), "rows_out": _count_rows(out_path)}
+
+
+def stage_filter_mrsty(release_dir, work_dir, n_workers, max_hops):
+    from scripts.umls.chunk_extract_example import filter_mrsty
+    from scripts.umls.cui_intern import load_cui_ids
+
+    mrsty_path = os.path.join(release_dir, "MRSTY.RRF")
+    out_path = os.path.join(work_dir, "sty.csv")
+    filter_mrsty(mrsty_path, load_cui_ids(os.path.join(work_dir, "cuis.txt")), out_path, n_workers=n_workers)
+    return {"input_bytes": os.path.getsize(mrsty_path), "rows_out": _count_rows(out_path)}
+
+
+def stage_build_triples(release_dir, work_dir, n_workers, max_hops):
+    from scripts.kg_builder.build_triples import build_triples
+
+    rel_path = os.path.join(work_dir, "rel.csv")
+    triples = build_triples(rel_path)
+    return {"input_bytes": os.path.getsize(rel_path), "rows_out": len(triples)}
+
+
+def stage_build_mappings(release_dir, work_dir, n_workers, max_hops):
+    from scripts.kg_builder.concept_mapping import build_mappings
+
+    conso_path, sty_path = os.path.join(work_dir, "conso.csv"), os.path.join(work_dir, "sty.csv")
+    preferred_names, semantic_types = build_mappings(conso_path, sty_path)
+    return {"input_bytes": os.path.getsize(conso_path) + os.path.getsize(sty_path),
+            "rows_out": len(preferred_names) + len(semantic_types)}
+
+
+def _run_stage(stage, kwargs, trace_python, verbose, queue):
+    # Child process: baseline after imports, then the stage
+    fn = globals()[f"stage_{stage}"]
+    if not verbose:
+        from scripts.umls.stage_metrics import LOGGER_NAME
+        logging.getLogger(LOGGER_NAME).setLevel(logging.WARNING)
+    baseline = _peak_rss_bytes()
+    if trace_python:
+        tracemalloc.start()
+    start_t, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            summary = fn(**kwargs)
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+        return
+    result = {
+        "wall_s": round(time.perf_counter() - start_t, 3),
+        "cpu_s": round(time.process_time() - start_cpu, 3),
+        "peak_rss_mb": _mb(_peak_rss_bytes()),
+        "baseline_rss_mb": _mb(baseline),
+        "children_peak_rss_mb": _mb(_peak_rss_bytes("children")),
+    }
+    if trace_python:
+        result["python_peak_mb"] = _mb(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    result.update(summary)
+    queue.put(result)
+
+
+def run_stage(stage, release_dir, work_dir, n_workers=1, max_hops=MAX_HOPS, trace_python=False, verbose=False):
+    """
+    Run one stage in a fresh (spawned) process.
+    Return: measurements {"wall_s", "cpu_s", "peak_rss_mb", ..., "input_bytes", "rows_out", "mb_per_s"}
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    kwargs = {"release_dir": release_dir, "work_dir": work_dir, "n_workers": n_workers, "max_hops": max_hops}
+    process = context.Process(target=_run_stage, args=(stage, kwargs, trace_python, verbose, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"[run_stage] {stage} failed: {result['error']}")
+    result["mb_per_s"] = round(result["input_bytes"] / (1 << 20) / max(result["wall_s"], 1e-9), 1)
+    return result
+
+
+def environment():
+    """
+    Code version and machine of a report
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    try:
+        import pyarrow
+        pyarrow_version = pyarrow.__version__
+    except ImportError:
+        pyarrow_version = None
+    return {
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "pyarrow": pyarrow_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmark(sizes, data_dir=DATA_DIR, n_workers=1, max_hops=MAX_HOPS, repeat=1, seed=0,
+                  trace_python=False, verbose=False):
+    """
+    Generate (or reuse) a synthetic release per size and run all STAGES on it repeat times.
+    Per stage the fastest run is reported (with all wall times in "runs_wall_s").
+    Return: the report dict
+    """
+    report = {"version": REPORT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "environment": environment(),
+              "params": {"n_workers": n_workers, "max_hops": max_hops, "repeat": repeat, "seed": seed,
+                         "trace_python": trace_python},
+              "sizes": {}}
+    for size in sizes:
+        release_dir = os.path.join(data_dir, "synthetic", f"{size}_seed{seed}")
+        work_dir = os.path.join(data_dir, "work", size)
+        os.makedirs(work_dir, exist_ok=True)
+        release = write_synthetic_release(release_dir, parse_size(size), seed=seed)
+
+        stages = {}
+        for stage in STAGES:
+            runs = [run_stage(stage, release_dir, work_dir, n_workers, max_hops, trace_python, verbose)
+                    for _ in range(repeat)]
+            best = min(runs, key=lambda run: run["wall_s"])
+            best["runs_wall_s"] = [run["wall_s"] for run in runs]
+            stages[stage] = best
+            print(f"[bench_pipeline] {size} {stage:<20} wall={best['wall_s']:.2f}s cpu={best['cpu_s']:.2f}s "
+                  f"peak_rss={best['peak_rss_mb']}MB rows_out={best['rows_out']} {best['mb_per_s']} MB/s")
+        report["sizes"][size] = {"release": release, "stages": stages}
+    return report
+
+
+def compare_reports(old, new, threshold=THRESHOLD):
+    """
+    Print new / old of wall_s and peak_rss_mb per (size, stage) present in both reports.
+    Return: list of (size, stage, metric, ratio) that exceed 1 + threshold
+    """
+    regressions = []
+    print(f"[compare_reports] {old['environment'].get('git_commit')} -> {new['environment'].get('git_commit')}")
+    if old.get("params") != new.get("params"):
+        print(f"[compare_reports] Warning: the runs used different parameters {old.get('params')} / {new.get('params')}")
+    for size, entry in new["sizes"].items():
+        old_stages = old["sizes"].get(size, {}).get("stages", {})
+        for stage, result in entry["stages"].items():
+            if stage not in old_stages:
+                continue
+            cells = []
+            for metric in ("wall_s", "peak_rss_mb"):
+                before, after = old_stages[stage].get(metric), result.get(metric)
+                if not before or after is None:
+                    continue
+                ratio = after / before
+                flag = ""
+                if ratio > 1 + threshold:
+                    flag = " REGRESSION"
+                    regressions.append((size, stage, metric, round(ratio, 3)))
+                elif ratio < 1 - threshold:
+                    flag = " faster" if metric == "wall_s" else " smaller"
+                cells.append(f"{metric} {before} -> {after} ({ratio:.2f}x){flag}")
+            print(f"   {size} {stage:<20} " + ", ".join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic UMLS releases")
+    parser.add_argument("--sizes", nargs="+", default=["1M"], help="MRREL sizes: 1M, 10M, 100M or a row count")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="synthetic releases and stage outputs")
+    parser.add_argument("--workers", type=int, default=1, help="n_workers of the RRF scans")
+    parser.add_argument("--max-hops", type=int, default=MAX_HOPS)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-python", action="store_true", help="also record the tracemalloc peak")
+    parser.add_argument("--report", help="write the JSON report here (default: data/benchmarks/pipeline_<time>.json)")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the stages' own output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fin:
+            baseline = json.load(fin)
+
+    report = run_benchmark(args.sizes, data_dir=args.data_dir, n_workers=args.workers, max_hops=args.max_hops,
+                           repeat=args.repeat, seed=args.seed, trace_python=args.trace_python, verbose=args.verbose)
+    report_path = args.report or os.path.join(args.data_dir, f"pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as fout:
+        json.dump(report, fout, indent=2)
+    print(f"[bench_pipeline] report -> {report_path}")
+
+    if baseline is not None:
+        regressions = compare_reports(baseline, report, args.threshold)
+        if regressions:
+            print(f"[bench_pipeline] {len(regressions)} regressions above {args.threshold:.0%}: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: old pandas python-engine MRREL parsing vs the shared rrf_reader on a synthetic MRREL.
+Run from the project root: python -m experiments.bench_rrf_reader [n_rows]
+"""
+
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import pandas as pd
+
+from scripts.umls.rrf_reader import CHUNKSIZE, COL_REL, HAS_PYARROW, read_rrf
+
+
+def write_synthetic_mrrel(path, n_rows, n_cuis=None, seed=0):
+    """
+    Write n_rows MRREL-shaped lines (16 fields + trailing "|") with a skewed CUI distribution
+    """
+    rng = random.Random(seed)
+    n_cuis = n_cuis or max(100, n_rows // 10)
+    rels = ["RO", "SIB", "CHD", "PAR", "RB", "RN", "SY", "RQ"]
+    relas = ["", "isa", "inverse_isa", "may_treat", "may_be_treated_by", "has_finding_site"]
+    sabs = ["MSH", "SNOMEDCT_US", "NCI", "RXNORM", "MEDCIN"]
+    with open(path, "w", encoding="utf-8") as fout:
+        for i in range(n_rows):
+            c1 = int(rng.paretovariate(1.1)) % n_cuis
+            c2 = rng.randrange(n_cuis)
+            fout.write(f"C{c1:07d}|A{i:08d}|AUI|{rng.choice(rels)}|C{c2:07d}|A{i + 1:08d}|AUI|"
+                       f"{rng.choice(relas)}|R{i:08d}||{rng.choice(sabs)}|{rng.choice(sabs)}||N|N||\n")
+
+
+def legacy_scan(mrrel_path, frontier):
+    # The reader used by pd_bfs_nhop / chunk_extract_example before rrf_reader
+    matched = 0
+    with open(mrrel_path, "r", encoding="utf-8") as fin:
+        reader = pd.read_csv(fin,
+                             sep="|",
+                             names=COL_REL,
+                             dtype=str,
+                             chunksize=CHUNKSIZE,
+                             engine="python",
+                             quoting=csv.QUOTE_NONE,
+                             usecols=range(len(COL_REL)))
+        for chunk in reader:
+            chunk["CUI1"] = chunk["CUI1"].str.upper().fillna("")
+            chunk["CUI2"] = chunk["CUI2"].str.upper().fillna("")
+            matched += int((chunk["CUI1"].isin(frontier) | chunk["CUI2"].isin(frontier)).sum())
+    return matched
+
+
+def reader_scan(mrrel_path, frontier, engine):
+    matched = 0
+    for chunk in read_rrf(mrrel_path, COL_REL, usecols=["CUI1", "CUI2"], engine=engine):
+        matched += int((chunk["CUI1"].isin(frontier) | chunk["CUI2"].isin(frontier)).sum())
+    return matched
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    frontier = {f"C{i:07d}" for i in range(0, 1000, 7)}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mrrel_path = os.path.join(tmp_dir, "MRREL.RRF")
+        write_synthetic_mrrel(mrrel_path, n_rows)
+        size_mb = os.path.getsize(mrrel_path) / (1 << 20)
+        print(f"[bench_rrf_reader] synthetic MRREL: {n_rows} rows, {size_mb:.1f} MB")
+
+        runs = [("legacy python engine", lambda: legacy_scan(mrrel_path, frontier)),
+                ("rrf_reader c", lambda: reader_scan(mrrel_path, frontier, "c"))]
+        if HAS_PYARROW:
+            runs.append(("rrf_reader pyarrow", lambda: reader_scan(mrrel_path, frontier, "pyarrow")))
+
+        baseline = None
+        for name, run in runs:
+            start_t = time.time()
+            matched = run()
+            cost = time.time() - start_t
+            baseline = baseline or cost
+            print(f"   {name:<22} matched={matched}, cost={cost:.2f}s, "
+                  f"{size_mb / cost:.1f} MB/s, speedup={baseline / cost:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
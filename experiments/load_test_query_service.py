@@ -0,0 +1,147 @@
+"""
+Load test of the local query service (scripts/kg_builder/query_service.py) on localhost.
+
+--concurrency clients each keep one HTTP/1.1 connection open and send requests back to back for --duration
+seconds. Endpoints are drawn by --mix, the CUIs of a request from the node list of the graph export with a
+Zipf distribution (--zipf; a few hot CUIs get most requests, as when many consumers ask about the same
+drugs), so the neighborhood cache sees a realistic hit rate. Prints throughput and latency percentiles per
+endpoint, then the service's own counters (/stats).
+
+Start the service, then run from the project root:
+    python -m scripts.kg_builder.query_service --port 8765
+    python -m experiments.load_test_query_service --port 8765 --concurrency 32 --duration 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from scripts.kg_builder.graph_export import NODE_CUIS_FILE
+from scripts.kg_builder.query_service import DEFAULT_HOST, DEFAULT_PORT
+from scripts.umls.cui_intern import cui_strings
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+GRAPH_DIR = os.path.join(BASE_DIR, "data", "umls_output", "pd_nhop_graph")
+
+# Relative request rates per endpoint
+DEFAULT_MIX = "label=4,sty=2,neighbors=2,nhop=1"
+
+
+def parse_mix(mix):
+    """
+    "label=4,nhop=1" -> (["label", "nhop"], normalized weights)
+    """
+    names, weights = [], []
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        names.append(name.strip())
+        weights.append(float(weight or 1))
+    weights = np.array(weights)
+    return names, weights / weights.sum()
+
+
+async def open_connection(args):
+    if args.unix_socket:
+        return await asyncio.open_unix_connection(args.unix_socket)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def request(reader, writer, target):
+    """
+    One GET over an open keep-alive connection.
+    Return: (status, parsed JSON body)
+    """
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        header, _, value = line.decode("latin-1").partition(":")
+        if header.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(args, cuis, names, weights, deadline, seed, results):
+    # One connection, requests back to back until deadline; results[name] gets (latency_s, status) tuples
+    rng = np.random.default_rng(seed)
+    reader, writer = await open_connection(args)
+    try:
+        while time.perf_counter() < deadline:
+            name = names[rng.choice(len(names), p=weights)]
+            picked = (rng.zipf(args.zipf, args.batch) - 1) % len(cuis)
+            target = f"/{name}?cui={','.join(cuis[i] for i in picked)}"
+            if name == "nhop":
+                target += f"&hops={args.hops}&limit={args.limit}"
+            elif name == "neighbors":
+                target += f"&limit={args.limit}"
+            start_time = time.perf_counter()
+            status, _ = await request(reader, writer, target)
+            results.setdefault(name, []).append((time.perf_counter() - start_time, status))
+    finally:
+        writer.close()
+
+
+async def run(args):
+    node_cuis = np.load(os.path.join(args.graph_dir, NODE_CUIS_FILE))
+    # Hot CUIs spread over the graph instead of the lowest CUI numbers
+    cuis = cui_strings(np.random.default_rng(args.seed).permutation(node_cuis))
+    names, weights = parse_mix(args.mix)
+
+    results = {}
+    start_time = time.perf_counter()
+    deadline = start_time + args.duration
+    await asyncio.gather(*(client(args, cuis, names, weights, deadline, args.seed + i, results)
+                           for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    total = sum(len(samples) for samples in results.values())
+    print(f"[load_test] {total} requests in {elapsed:.1f}s = {total / elapsed:.0f} req/s "
+          f"(concurrency={args.concurrency}, batch={args.batch}, zipf={args.zipf})")
+    report = {"requests": total, "elapsed_s": elapsed, "requests_per_s": total / elapsed, "endpoints": {}}
+    for name, samples in sorted(results.items()):
+        ms = np.array([latency for latency, _ in samples]) * 1000
+        errors = sum(status != 200 for _, status in samples)
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99]).tolist()
+        report["endpoints"][name] = {"requests": len(samples), "errors": errors, "p50_ms": p50, "p90_ms": p90,
+                                     "p99_ms": p99, "max_ms": float(ms.max())}
+        print(f"   {name:<10} n={len(samples):<7} errors={errors:<4} p50={p50:.2f}ms p90={p90:.2f}ms "
+              f"p99={p99:.2f}ms max={ms.max():.2f}ms")
+
+    reader, writer = await open_connection(args)
+    _, report["service"] = await request(reader, writer, "/stats")
+    writer.close()
+    print(f"[load_test] service cache: {report['service']['cache']}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as fout:
+            json.dump(report, fout, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the local query service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--graph-dir", default=GRAPH_DIR, help="graph export the service was started on")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. label=4,nhop=1")
+    parser.add_argument("--batch", type=int, default=1, help="CUIs per request")
+    parser.add_argument("--hops", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=100, help="CUIs listed per /nhop and /neighbors result")
+    parser.add_argument("--zipf", type=float, default=1.2, help="Zipf exponent of the CUI popularity (> 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None, help="write the results as JSON to this path")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
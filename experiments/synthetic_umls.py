@@ -0,0 +1,300 @@
+"""
+Synthetic UMLS release (MRREL / MRCONSO / MRSTY / MRDOC .RRF) for benchmarks, following data/schema/umls_rrf_schema.md.
+
+Shape taken from a full release (2024AB: ~3.3M CUIs, ~63M MRREL, ~16M MRCONSO, ~3.4M MRSTY rows):
+    - concept degrees follow a power law (Chung-Lu graph: both ends of a relation are drawn with
+      weight rank^(-1 / (DEGREE_EXPONENT - 1))), so there are a few hubs with 10^4+ relations and a long tail
+    - every relation is written in both directions (CHD / PAR, isa / inverse_isa, ...), like MRREL
+    - MRCONSO / MRSTY are sorted by CUI, ~5 atoms (30% non-English) and ~1.05 semantic types per CUI
+    - MRDOC holds the rel_inverse / rela_inverse pairs of the relations used
+    - the seed CUIs of the pipeline (PD_CUI, SEED_CUIS) are always present and well connected
+Rows are generated in vectorized blocks, a 100M-row MRREL takes a few minutes.
+Run from the project root: python -m experiments.synthetic_umls out_dir [1M|10M|100M|n_rows] [seed]
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.kg_builder.pd_bfs_nhop import SEED_CUIS
+from scripts.umls.cui_intern import CUI_RANGE, cui_numbers
+
+# Named MRREL sizes (rows)
+SIZES = {"1M": 1_000_000, "10M": 10_000_000, "100M": 100_000_000}
+
+REL_ROWS_PER_CUI = 20
+CONSO_ROWS_PER_CUI = 5
+EXTRA_STY_SHARE = 0.05
+# P(degree = k) ~ k^-DEGREE_EXPONENT
+DEGREE_EXPONENT = 2.1
+# Rank of the seed CUIs in the degree order (0 = biggest hub)
+SEED_RANK = 25
+
+BLOCK_ROWS = 1_000_000
+RELEASE_FILE = "synthetic.json"
+
+# (REL, inverse REL, RELA, inverse RELA, weight)
+RELATIONS = [
+    ("RO", "RO", "", "", 20),
+    ("RO", "RO", "may_treat", "may_be_treated_by", 3),
+    ("RO", "RO", "has_finding_site", "finding_site_of", 3),
+    ("RO", "RO", "associated_with", "associated_with", 2),
+    ("CHD", "PAR", "", "", 12),
+    ("CHD", "PAR", "inverse_isa", "isa", 10),
+    ("RN", "RB", "", "", 8),
+    ("SIB", "SIB", "", "", 25),
+    ("SY", "SY", "", "", 5),
+    ("RQ", "RQ", "", "", 8),
+    ("AQ", "QB", "", "", 4),
+]
+SABS = (["SNOMEDCT_US", "MSH", "NCI", "MEDCIN", "RXNORM", "MDR", "LNC", "ICD10CM"],
+        [30, 15, 15, 12, 10, 8, 6, 4])
+LATS = (["ENG", "SPA", "FRE", "GER", "JPN", "DUT"], [70, 8, 6, 6, 6, 4])
+# (TUI, STN, STY, weight)
+SEMANTIC_TYPES = [
+    ("T047", "B2.2.1.2.1", "Disease or Syndrome", 15),
+    ("T121", "A1.4.1.1.1", "Pharmacologic Substance", 12),
+    ("T109", "A1.4.1.2.1", "Organic Chemical", 12),
+    ("T116", "A1.4.1.2.1.7", "Amino Acid, Peptide, or Protein", 10),
+    ("T023", "A1.2.3.1", "Body Part, Organ, or Organ Component", 8),
+    ("T033", "A2.2", "Finding", 10),
+    ("T184", "A2.2.2", "Sign or Symptom", 5),
+    ("T061", "B1.3.1.2", "Therapeutic or Preventive Procedure", 10),
+    ("T028", "A1.2.3.5", "Gene or Genome", 10),
+    ("T191", "B2.2.1.2.1.2", "Neoplastic Process", 8),
+]
+WORDS = np.array(["disease", "syndrome", "disorder", "tremor", "rigidity", "neuron", "dopamine", "receptor",
+                  "protein", "gene", "acute", "chronic", "primary", "secondary", "cerebral", "motor", "nerve",
+                  "cell", "kinase", "inhibitor", "therapy", "levodopa", "substantia", "nigra", "lewy", "body"],
+                 dtype=object)
+
+
+def _ids(prefix, numbers, width):
+    # Vectorized "prefix%0{width}d"
+    return prefix + pd.Series(numbers).astype(str).str.zfill(width).to_numpy(dtype=object)
+
+
+def _weighted(rng, choices, weights, size):
+    p = np.asarray(weights, dtype=np.float64)
+    return np.asarray(choices, dtype=object)[rng.choice(len(choices), size=size, p=p / p.sum())]
+
+
+def _write_rows(fout, columns):
+    # columns in file order (object arrays or a constant str); every field is followed by "|" like in RRF
+    size = max(len(values) for values in columns if not isinstance(values, str))
+    lines = np.full(size, "", dtype=object)
+    for values in columns:
+        lines = lines + values + "|"
+    fout.write("\n".join(lines) + "\n")
+
+
+def _both(forward, inverse):
+    # Forward and inverse row of every relation next to each other
+    out = np.empty(len(forward) * 2, dtype=object)
+    out[0::2], out[1::2] = forward, inverse
+    return out
+
+
+def concept_table(n_cuis, seed=0):
+    """
+    CUI numbers by degree rank (rank 0 = biggest hub), the seed CUIs at SEED_RANK and after,
+    and the number of MRCONSO atoms of each rank.
+    Return: dict with cui_numbers (int64 [n_cuis]), atom_counts, atom_starts (first AUI number of each rank)
+    """
+    rng = np.random.default_rng(seed)
+    seeds = np.unique(cui_numbers(SEED_CUIS))
+    numbers = rng.choice(CUI_RANGE, size=n_cuis + len(seeds), replace=False)
+    numbers = numbers[~np.isin(numbers, seeds)][:n_cuis - len(seeds)]
+    at = min(SEED_RANK, len(numbers))
+    numbers = np.concatenate([numbers[:at], seeds, numbers[at:]]).astype(np.int64)
+
+    atom_counts = rng.geometric(1.0 / CONSO_ROWS_PER_CUI, size=n_cuis).astype(np.int64)
+    atom_starts = np.zeros(n_cuis, dtype=np.int64)
+    np.cumsum(atom_counts[:-1], out=atom_starts[1:])
+    return {"cui_numbers": numbers, "atom_counts": atom_counts, "atom_starts": atom_starts}
+
+
+def write_synthetic_mrrel(path, n_rows, concepts, seed=0):
+    """
+    n_rows MRREL lines (n_rows // 2 relations, each written in both directions) between power-law
+    distributed concepts.
+    """
+    rng = np.random.default_rng(seed + 1)
+    numbers, atom_counts, atom_starts = concepts["cui_numbers"], concepts["atom_counts"], concepts["atom_starts"]
+    n_cuis = len(numbers)
+    weights = np.arange(1, n_cuis + 1, dtype=np.float64) ** (-1.0 / (DEGREE_EXPONENT - 1))
+    cdf = np.cumsum(weights)
+    cdf /= cdf[-1]
+
+    rel, inverse_rel, rela, inverse_rela, rel_weights = zip(*RELATIONS)
+    rel_p = np.asarray(rel_weights, dtype=np.float64) / sum(rel_weights)
+    tables = [np.asarray(values, dtype=object) for values in (rel, inverse_rel, rela, inverse_rela)]
+
+    n_pairs = n_rows // 2
+    with open(path, "w", encoding="utf-8", newline="") as fout:
+        for start in range(0, n_pairs, BLOCK_ROWS // 2):
+            size = min(BLOCK_ROWS // 2, n_pairs - start)
+            head = np.minimum(np.searchsorted(cdf, rng.random(size)), n_cuis - 1)
+            tail = np.minimum(np.searchsorted(cdf, rng.random(size)), n_cuis - 1)
+            tail = np.where(head == tail, (tail + 1) % n_cuis, tail)
+            kind = rng.choice(len(RELATIONS), size=size, p=rel_p)
+            by_atom = rng.random(size) < 0.7
+            head_atom = atom_starts[head] + (rng.random(size) * atom_counts[head]).astype(np.int64)
+            tail_atom = atom_starts[tail] + (rng.random(size) * atom_counts[tail]).astype(np.int64)
+            sab = _weighted(rng, *SABS, size)
+            suppress = np.where(rng.random(size) < 0.02, "O", "N").astype(object)
+            direction = _weighted(rng, ["", "Y", "N"], [6, 3, 1], size)
+            rui = start * 2 + np.arange(size, dtype=np.int64) * 2
+
+            head_cui, tail_cui = _ids("C", numbers[head], 7), _ids("C", numbers[tail], 7)
+            head_aui = np.where(by_atom, _ids("A", head_atom, 8), "").astype(object)
+            tail_aui = np.where(by_atom, _ids("A", tail_atom, 8), "").astype(object)
+            stype = np.where(by_atom, "AUI", "CUI").astype(object)
+
+            _write_rows(fout, [
+                _both(head_cui, tail_cui), _both(head_aui, tail_aui), _both(stype, stype),
+                _both(tables[0][kind], tables[1][kind]), _both(tail_cui, head_cui), _both(tail_aui, head_aui),
+                _both(stype, stype), _both(tables[2][kind], tables[3][kind]),
+                _both(_ids("R", rui + 1, 8), _ids("R", rui + 2, 8)), "", _both(sab, sab), _both(sab, sab), "",
+                _both(direction, direction), _both(suppress, suppress), "",
+            ])
+    return n_pairs * 2
+
+
+def write_synthetic_mrconso(path, concepts, seed=0):
+    """
+    MRCONSO atoms of every concept, sorted by CUI; the first atom of a CUI is its English preferred name
+    Return: number of rows
+    """
+    rng = np.random.default_rng(seed + 2)
+    numbers, atom_counts, atom_starts = concepts["cui_numbers"], concepts["atom_counts"], concepts["atom_starts"]
+    order = np.argsort(numbers)
+    rows = 0
+    block_cuis = max(1, BLOCK_ROWS // CONSO_ROWS_PER_CUI)
+    with open(path, "w", encoding="utf-8", newline="") as fout:
+        for start in range(0, len(order), block_cuis):
+            ranks = order[start:start + block_cuis]
+            counts = atom_counts[ranks]
+            rank = np.repeat(ranks, counts)
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            within = np.arange(len(rank)) - first
+            atom = atom_starts[rank] + within
+            size = len(rank)
+
+            preferred = within == 0
+            lat = np.where(preferred, "ENG", _weighted(rng, *LATS, size)).astype(object)
+            sab = _weighted(rng, *SABS, size)
+            name = (WORDS[rng.integers(len(WORDS), size=size)] + " " + WORDS[rng.integers(len(WORDS), size=size)]
+                    + " " + pd.Series(numbers[rank]).astype(str).to_numpy(dtype=object))
+            cui = _ids("C", numbers[rank], 7)
+            _write_rows(fout, [
+                cui, lat, np.where(preferred, "P", "S").astype(object), _ids("L", atom // 2, 7),
+                np.where(preferred, "PF", "VO").astype(object), _ids("S", atom, 7),
+                np.where(preferred, "Y", "N").astype(object), _ids("A", atom, 8), "", _ids("", atom, 7), "",
+                sab, np.where(preferred, "PT", "SY").astype(object), _ids("", numbers[rank], 7), name,
+                "0", np.where(rng.random(size) < 0.03, "O", "N").astype(object), "",
+            ])
+            rows += size
+    return rows
+
+
+def write_synthetic_mrsty(path, concepts, seed=0):
+    """
+    One semantic type per CUI, a second one for EXTRA_STY_SHARE of them; sorted by CUI
+    Return: number of rows
+    """
+    rng = np.random.default_rng(seed + 3)
+    numbers = np.sort(concepts["cui_numbers"])
+    extra = numbers[rng.random(len(numbers)) < EXTRA_STY_SHARE]
+    cuis = np.sort(np.concatenate([numbers, extra]), kind="stable")
+    tui, stn, sty, weights = zip(*SEMANTIC_TYPES)
+    p = np.asarray(weights, dtype=np.float64) / sum(weights)
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as fout:
+        for start in range(0, len(cuis), BLOCK_ROWS):
+            block = cuis[start:start + BLOCK_ROWS]
+            kind = rng.choice(len(SEMANTIC_TYPES), size=len(block), p=p)
+            _write_rows(fout, [
+                _ids("C", block, 7), np.asarray(tui, dtype=object)[kind], np.asarray(stn, dtype=object)[kind],
+                np.asarray(sty, dtype=object)[kind], _ids("AT", start + np.arange(len(block)), 8), "",
+            ])
+            rows += len(block)
+    return rows
+
+
+def write_synthetic_mrdoc(path):
+    """
+    rel_inverse / rela_inverse rows (both directions) of RELATIONS, like the MRDOC of a release
+    Return: number of rows
+    """
+    pairs = []
+    for rel, inverse_rel, rela, inverse_rela, _ in RELATIONS:
+        pairs += [("REL", rel, "rel_inverse", inverse_rel), ("REL", inverse_rel, "rel_inverse", rel)]
+        if rela:
+            pairs += [("RELA", rela, "rela_inverse", inverse_rela), ("RELA", inverse_rela, "rela_inverse", rela)]
+    pairs = sorted(set(pairs))
+    with open(path, "w", encoding="utf-8", newline="") as fout:
+        for row in pairs:
+            fout.write("|".join(row) + "|\n")
+    return len(pairs)
+
+
+def parse_size(size):
+    """
+    "1M" / "10M" / "100M" or a row count -> number of MRREL rows
+    """
+    return SIZES[size] if size in SIZES else int(float(size))
+
+
+def write_synthetic_release(out_dir, n_rel_rows, seed=0):
+    """
+    Write MRREL.RRF / MRCONSO.RRF / MRSTY.RRF / MRDOC.RRF to out_dir, plus synthetic.json (parameters and row counts).
+    An existing release with the same parameters is reused.
+    Return: the synthetic.json content
+    """
+    params = {"n_rel_rows": int(n_rel_rows), "seed": seed, "rel_rows_per_cui": REL_ROWS_PER_CUI,
+              "conso_rows_per_cui": CONSO_ROWS_PER_CUI, "degree_exponent": DEGREE_EXPONENT}
+    release_path = os.path.join(out_dir, RELEASE_FILE)
+    if os.path.exists(release_path):
+        with open(release_path, "r", encoding="utf-8") as fin:
+            release = json.load(fin)
+        if release.get("params") == params and "MRDOC.RRF" in release["files"] and all(
+                os.path.exists(os.path.join(out_dir, name))
+                and os.path.getsize(os.path.join(out_dir, name)) == info["bytes"]
+                for name, info in release["files"].items()):
+            print(f"[write_synthetic_release] Reusing {out_dir}")
+            return release
+
+    os.makedirs(out_dir, exist_ok=True)
+    start_t = time.time()
+    n_cuis = max(1000, n_rel_rows // REL_ROWS_PER_CUI)
+    concepts = concept_table(n_cuis, seed)
+    rows = {
+        "MRREL.RRF": write_synthetic_mrrel(os.path.join(out_dir, "MRREL.RRF"), n_rel_rows, concepts, seed),
+        "MRCONSO.RRF": write_synthetic_mrconso(os.path.join(out_dir, "MRCONSO.RRF"), concepts, seed),
+        "MRSTY.RRF": write_synthetic_mrsty(os.path.join(out_dir, "MRSTY.RRF"), concepts, seed),
+        "MRDOC.RRF": write_synthetic_mrdoc(os.path.join(out_dir, "MRDOC.RRF")),
+    }
+    release = {
+        "params": params,
+        "n_cuis": n_cuis,
+        "files": {name: {"rows": n, "bytes": os.path.getsize(os.path.join(out_dir, name))}
+                  for name, n in rows.items()},
+        "seconds": round(time.time() - start_t, 2),
+    }
+    with open(release_path, "w", encoding="utf-8") as fout:
+        json.dump(release, fout, indent=2)
+    print(f"[write_synthetic_release] {n_cuis} CUIs, "
+          + ", ".join(f"{name}: {info['rows']} rows / {info['bytes'] / (1 << 20):.1f} MB"
+                      for name, info in release["files"].items())
+          + f", cost={release['seconds']:.1f}s -> {out_dir}")
+    return release
+
+
+if __name__ == "__main__":
+    write_synthetic_release(sys.argv[1], parse_size(sys.argv[2] if len(sys.argv) > 2 else "1M"),
+                            seed=int(sys.argv[3]) if len(sys.argv) > 3 else 0)
@@ -1,20 +1,78 @@
 # This is a script for building triples
 
+import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-def build_triples(rel_csv_path):
-    rel_df = pd.read_csv(rel_csv_path,sep="|",dtype=str)
+from scripts.kg_builder.mrrel_index import encode_cuis
+
+CHUNKSIZE = 1_000_000
+
+# Only these columns of the REL csv are needed for triples
+TRIPLE_COLUMNS = ["CUI1", "REL", "CUI2", "RELA"]
+
+
+def read_rel_columns(rel_csv_path, chunksize=CHUNKSIZE):
+    """
+    Stream the REL csv (pd_rel.csv / pd_nhop_rel.csv) reading only TRIPLE_COLUMNS, as categoricals
+    """
+    return pd.read_csv(rel_csv_path, sep="|", usecols=TRIPLE_COLUMNS, dtype="category",
+                       chunksize=chunksize)
+
+
+def relation_labels(chunk):
+    # RELA if present, otherwise REL (vectorized)
+    return chunk["RELA"].astype(object).fillna(chunk["REL"].astype(object))
 
-    def extract_relation(row):
-        relation = row['RELA'] if pd.notnull(row['RELA']) else row['REL']
-        return (row['CUI1'], relation, row['CUI2'])
 
-    triples = rel_df.apply(extract_relation, axis=1).tolist()
+def build_triples(rel_csv_path):
+    triples = []
+    for chunk in read_rel_columns(rel_csv_path):
+        triples.extend(zip(chunk["CUI1"].astype(object), relation_labels(chunk), chunk["CUI2"].astype(object)))
     return triples
 
+
+def build_triples_encoded(rel_csv_path, out_dir=None, chunksize=CHUNKSIZE):
+    """
+    Vectorized, streaming triple builder with integer-coded output for KGE training.
+    Return: triples (int32 array [n, 3] = head_id, rel_id, tail_id), entities (list), relations (list)
+    If out_dir is given, also writes:
+        triples.npy    - the [n, 3] int32 array (np.load(..., mmap_mode="r") + torch.from_numpy)
+        entities.txt   - one CUI per line, line number = entity id
+        relations.txt  - one relation label per line, line number = relation id
+    """
+    entity_to_id = {}
+    relation_to_id = {}
+    parts = []
+    for chunk in read_rel_columns(rel_csv_path, chunksize=chunksize):
+        chunk = chunk.dropna(subset=["CUI1", "CUI2"])
+        heads = encode_cuis(chunk["CUI1"], entity_to_id)
+        tails = encode_cuis(chunk["CUI2"], entity_to_id)
+        rels = encode_cuis(relation_labels(chunk).fillna(""), relation_to_id)
+        parts.append(np.stack([heads, rels, tails], axis=1))
+
+    triples = np.concatenate(parts) if parts else np.empty((0, 3), dtype=np.int32)
+    entities = list(entity_to_id)
+    relations = list(relation_to_id)
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, "triples.npy"), triples)
+        for name, vocab in (("entities.txt", entities), ("relations.txt", relations)):
+            with open(os.path.join(out_dir, name), "w", encoding="utf-8") as fout:
+                for value in vocab:
+                    fout.write(value + "\n")
+        print(f"[build_triples_encoded] {len(triples)} triples, {len(entities)} entities, "
+              f"{len(relations)} relations -> {out_dir}")
+    return triples, entities, relations
+
+
 if __name__ == "__main__":
     data_dir = Path("../../data/umls_output")
     triples = build_triples(data_dir /"pd_rel.csv")
     print(f"Extracted {len(triples)} triples.")
     print(triples[:10])
+
+    encoded, entities, relations = build_triples_encoded(data_dir / "pd_nhop_rel.csv", data_dir / "kge")
+    print(f"Encoded {len(encoded)} triples, {len(entities)} entities, {len(relations)} relations.")
@@ -1,8 +1,14 @@
 # This is a script for creating a concept mapping
 
+import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+from scripts.umls.rrf_reader import cui_numbers
+
+CHUNKSIZE = 1_000_000
+
 def build_mappings(conso_csv_path, sty_csv_path):
     conso_df = pd.read_csv(conso_csv_path, sep="|", dtype=str)
     preferred_names = conso_df[conso_df['TS'] == 'P'][['CUI','STR']].drop_duplicates().set_index('CUI')['STR'].to_dict()
@@ -12,10 +18,146 @@ def build_mappings(conso_csv_path, sty_csv_path):
 
     return preferred_names, semantic_types
 
+
+#############################
+# Memory-mapped concept store
+#############################
+# store_dir layout (row i = i-th CUI in ascending order):
+#   cuis.npy          int64 CUI numbers, sorted ("C0030567" -> 30567)
+#   name_offsets.npy  int64 [n + 1], preferred name of row i = names.bin[off[i]:off[i + 1]] (utf-8)
+#   names.bin         all preferred names back to back
+#   sty_offsets.npy   int64 [n + 1], semantic types of row i = sty_codes[off[i]:off[i + 1]]
+#   sty_codes.npy     int16 codes into sty_vocab.tsv (a CUI can have several semantic types)
+#   sty_vocab.tsv     code <TAB> TUI <TAB> STY
+
+def preferred_name_rows(conso_csv_path, chunksize=CHUNKSIZE):
+    """
+    One (CUI, STR) row per CUI among TS=P rows; STT=PF + ISPREF=Y atoms first, then file order
+    """
+    parts = []
+    for chunk in pd.read_csv(conso_csv_path, sep="|", dtype=str, chunksize=chunksize,
+                             usecols=["CUI", "TS", "STT", "ISPREF", "STR"]):
+        chunk = chunk[chunk["TS"] == "P"]
+        rank = ~((chunk["STT"] == "PF") & (chunk["ISPREF"] == "Y"))
+        parts.append(pd.DataFrame({"CUI": chunk["CUI"], "rank": rank.astype("int8"), "STR": chunk["STR"].fillna("")}))
+    names = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["CUI", "rank", "STR"])
+    names = names.sort_values(["CUI", "rank"], kind="stable").drop_duplicates("CUI")
+    return names[["CUI", "STR"]]
+
+
+def _csr_offsets(row_of_item, n_rows):
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_of_item, minlength=n_rows), out=offsets[1:])
+    return offsets
+
+
+def build_concept_store(conso_csv_path, sty_csv_path, store_dir, chunksize=CHUNKSIZE):
+    """
+    Write the memory-mapped concept store for the CUIs of conso_csv / sty_csv to store_dir (layout above).
+    Return: number of CUIs
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    names = preferred_name_rows(conso_csv_path, chunksize)
+    sty = pd.read_csv(sty_csv_path, sep="|", dtype=str,
+                      usecols=["CUI", "TUI", "STY"]).dropna(subset=["CUI"]).drop_duplicates()
+
+    name_numbers = cui_numbers(names["CUI"])
+    sty_numbers = cui_numbers(sty["CUI"])
+    cuis = np.unique(np.concatenate([name_numbers, sty_numbers]))
+    cuis = cuis[cuis >= 0]
+
+    # Preferred names -> offset-indexed blob, empty for CUIs without a name
+    encoded = [""] * len(cuis)
+    for row, name in zip(np.searchsorted(cuis, name_numbers), names["STR"]):
+        encoded[row] = name
+    encoded = [name.encode("utf-8") for name in encoded]
+    name_offsets = np.zeros(len(cuis) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+    with open(os.path.join(store_dir, "names.bin"), "wb") as fout:
+        fout.write(b"".join(encoded))
+
+    # Semantic types -> small int codes, CSR over rows
+    sty = sty[sty_numbers >= 0].assign(row=np.searchsorted(cuis, sty_numbers[sty_numbers >= 0]))
+    sty = sty.sort_values(["row", "TUI"], kind="stable")
+    vocab = sty[["TUI", "STY"]].drop_duplicates("TUI").sort_values("TUI").reset_index(drop=True)
+    code_of_tui = {tui: code for code, tui in enumerate(vocab["TUI"])}
+    sty_codes = sty["TUI"].map(code_of_tui).to_numpy(dtype=np.int16)
+    sty_offsets = _csr_offsets(sty["row"].to_numpy(), len(cuis))
+
+    np.save(os.path.join(store_dir, "cuis.npy"), cuis)
+    np.save(os.path.join(store_dir, "name_offsets.npy"), name_offsets)
+    np.save(os.path.join(store_dir, "sty_offsets.npy"), sty_offsets)
+    np.save(os.path.join(store_dir, "sty_codes.npy"), sty_codes)
+    with open(os.path.join(store_dir, "sty_vocab.tsv"), "w", encoding="utf-8") as fout:
+        for code, (tui, sty_name) in enumerate(zip(vocab["TUI"], vocab["STY"].fillna(""))):
+            fout.write(f"{code}\t{tui}\t{sty_name}\n")
+
+    print(f"[build_concept_store] cuis={len(cuis)}, names={len(names)}, semantic_type_rows={len(sty_codes)} "
+          f"-> {store_dir}")
+    return len(cuis)
+
+
+def load_concept_store(store_dir):
+    """
+    Open a concept store; all arrays and the name blob are memory-mapped (opens in milliseconds,
+    pages are shared between worker processes).
+    Return: dict with cuis, name_offsets, names, sty_offsets, sty_codes, sty_vocab [(TUI, STY), ...]
+    """
+    with open(os.path.join(store_dir, "sty_vocab.tsv"), "r", encoding="utf-8") as fin:
+        sty_vocab = [tuple(line.rstrip("\n").split("\t")[1:3]) for line in fin]
+    names_path = os.path.join(store_dir, "names.bin")
+    names = (np.memmap(names_path, dtype=np.uint8, mode="r") if os.path.getsize(names_path)
+             else np.empty(0, dtype=np.uint8))
+    return {
+        "cuis": np.load(os.path.join(store_dir, "cuis.npy"), mmap_mode="r"),
+        "name_offsets": np.load(os.path.join(store_dir, "name_offsets.npy"), mmap_mode="r"),
+        "names": names,
+        "sty_offsets": np.load(os.path.join(store_dir, "sty_offsets.npy"), mmap_mode="r"),
+        "sty_codes": np.load(os.path.join(store_dir, "sty_codes.npy"), mmap_mode="r"),
+        "sty_vocab": sty_vocab,
+    }
+
+
+def concept_row(store, cui):
+    """
+    Row of cui in the store, or -1 if it is not there
+    """
+    number = cui_numbers([cui])[0]
+    cuis = store["cuis"]
+    row = int(np.searchsorted(cuis, number))
+    if number < 0 or row >= len(cuis) or cuis[row] != number:
+        return -1
+    return row
+
+
+def preferred_name(store, cui):
+    row = concept_row(store, cui)
+    if row < 0:
+        return None
+    start, end = store["name_offsets"][row], store["name_offsets"][row + 1]
+    return bytes(store["names"][start:end]).decode("utf-8")
+
+
+def semantic_types(store, cui):
+    """
+    All (TUI, STY) pairs of cui
+    """
+    row = concept_row(store, cui)
+    if row < 0:
+        return []
+    start, end = store["sty_offsets"][row], store["sty_offsets"][row + 1]
+    return [store["sty_vocab"][code] for code in store["sty_codes"][start:end]]
+
+
 if __name__ == "__main__":
     data_dir = Path("../../data/umls_output")
-    preferred_names, semantic_types = build_mappings(data_dir / "pd_conso.csv", data_dir / "pd_sty.csv")
+    preferred_names, semantic_types_map = build_mappings(data_dir / "pd_conso.csv", data_dir / "pd_sty.csv")
 
     pd_cui = 'C0030567'
     print("PD Preferred Name:", preferred_names.get(pd_cui))
-    print("PD Semantic Type:", semantic_types.get(pd_cui))
\ No newline at end of file
+    print("PD Semantic Type:", semantic_types_map.get(pd_cui))
+
+    build_concept_store(data_dir / "pd_nhop_conso.csv", data_dir / "pd_nhop_sty.csv", data_dir / "concept_store")
+    store = load_concept_store(data_dir / "concept_store")
+    print("PD Preferred Name (store):", preferred_name(store, pd_cui))
+    print("PD Semantic Types (store):", semantic_types(store, pd_cui))
@@ -0,0 +1,202 @@
+"""
+Streaming, bounded-memory de-duplication of n-hop edge output (e.g. pd_nhop_rel.csv).
+
+Every row is reduced to a 64-bit fingerprint (hash of its key columns). Fingerprints and row numbers
+are kept in memory up to memory_budget_mb; beyond that they are spilled to disk, partitioned by the
+high bits of the fingerprint, and every partition is sorted on its own (external bucket sort).
+The first occurrence of each fingerprint is kept, so the output keeps the input order.
+With collapse_inverse=True the pair (A REL B) / (B inverse(REL) A) counts as one edge; the REL / RELA
+inverses come from the release's MRDOC (load_inverses), e.g. may_treat <-> may_be_treated_by.
+
+64-bit fingerprints can collide in theory; at 10^9 rows the chance of any collision is ~3%,
+of a given row being dropped by mistake ~10^-10.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.umls.rrf_reader import CHUNKSIZE, COL_DOC, COL_REL, read_rrf
+
+# Spill partitions (top 8 bits of the fingerprint)
+N_PARTITIONS = 256
+
+# Bytes per buffered row: uint64 fingerprint + int64 row number
+_ENTRY_BYTES = 16
+
+# MRDOC rows that pair a REL / RELA value with its inverse (DOCKEY, TYPE)
+INVERSE_TYPES = {"REL": "rel_inverse", "RELA": "rela_inverse"}
+
+
+def load_inverses(mrdoc_path):
+    """
+    REL and RELA inverse pairs of a release from its MRDOC.RRF (DOCKEY=REL|RELA, TYPE=rel_inverse|rela_inverse),
+    e.g. {"REL": {"CHD": "PAR", "PAR": "CHD", "RO": "RO", ...}, "RELA": {"may_treat": "may_be_treated_by", ...}}
+    """
+    inverses = {"REL": {}, "RELA": {}}
+    for chunk in read_rrf(mrdoc_path, COL_DOC):
+        for dockey, doc_type in INVERSE_TYPES.items():
+            rows = chunk[(chunk["DOCKEY"] == dockey) & (chunk["TYPE"] == doc_type)]
+            for value, inverse in zip(rows["VALUE"].fillna(""), rows["EXPL"].fillna("")):
+                if value and inverse:
+                    inverses[dockey][value] = inverse
+                    inverses[dockey].setdefault(inverse, value)
+    return inverses
+
+
+def _canonical_edges(chunk, inverses):
+    """
+    Orient every edge so that CUI1 <= CUI2, inverting REL/RELA when the row is flipped,
+    so an edge and its inverse row get the same key.
+    Rows whose REL or RELA has no inverse in inverses are left as they are (a blank RELA needs none).
+    """
+    c1 = chunk["CUI1"].fillna("")
+    c2 = chunk["CUI2"].fillna("")
+    rel = chunk["REL"].fillna("").astype(str)
+    rela = chunk["RELA"].fillna("").astype(str)
+    inverse_rel = rel.map(inverses["REL"])
+    inverse_rela = rela.map(inverses["RELA"]).where(rela != "", "")
+    flip = (c1 > c2) & inverse_rel.notna() & inverse_rela.notna()
+    canonical = pd.DataFrame({
+        "CUI1": c1.where(~flip, c2),
+        "CUI2": c2.where(~flip, c1),
+        "REL": rel.where(~flip, inverse_rel),
+        "RELA": rela.where(~flip, inverse_rela),
+    })
+    if "SAB" in chunk.columns:
+        canonical["SAB"] = chunk["SAB"].fillna("")
+    return canonical
+
+
+def row_fingerprints(chunk, key_columns=None, collapse_inverse=False, inverses=None):
+    """
+    uint64 fingerprint per row of chunk.
+    :param key_columns: columns that define a duplicate (default: all; use ["RUI"] to dedup by relation id)
+    :param collapse_inverse: fingerprint the canonical (CUI1 <= CUI2) edge instead, see _canonical_edges
+    :param inverses: load_inverses output, required with collapse_inverse
+    """
+    if collapse_inverse:
+        keys = _canonical_edges(chunk, inverses)
+    else:
+        keys = chunk[key_columns] if key_columns else chunk
+    return pd.util.hash_pandas_object(keys.fillna(""), index=False).to_numpy(dtype=np.uint64)
+
+
+def _first_occurrences(fingerprints, row_ids):
+    # Row ids of the first row of every distinct fingerprint
+    order = np.lexsort((row_ids, fingerprints))
+    fingerprints = fingerprints[order]
+    first = np.ones(len(fingerprints), dtype=bool)
+    first[1:] = fingerprints[1:] != fingerprints[:-1]
+    return row_ids[order][first]
+
+
+def dedup_rel_csv(input_csv, output_csv, key_columns=None, collapse_inverse=False, inverses=None,
+                  memory_budget_mb=1024, tmp_dir=None, chunksize=CHUNKSIZE):
+    """
+    De-duplicate a pipe-delimited CSV with header (filter_rel_by_cuis / extract_subgraph_tables output)
+    in three streaming passes with memory bounded by memory_budget_mb (plus a one-byte keep flag per row):
+        1) fingerprint all rows, spilling partitioned runs to disk when over budget
+        2) sort each partition, mark the first row of every fingerprint in a bitmap
+        3) re-read the input and write the marked rows
+    :param inverses: load_inverses(MRDOC.RRF) of the release, required with collapse_inverse
+    Return: (rows_in, rows_out)
+    """
+    if collapse_inverse and not inverses:
+        raise ValueError("collapse_inverse needs the REL / RELA inverse pairs of the release: "
+                         "inverses=load_inverses(MRDOC.RRF)")
+    start_t = time.time()
+    budget_entries = max(1, memory_budget_mb * (1 << 20) // _ENTRY_BYTES)
+
+    def read_input():
+        return pd.read_csv(input_csv, sep="|", dtype=str, chunksize=chunksize,
+                           keep_default_na=False, na_values=[])
+
+    # Pass 1: fingerprints
+    buffered_fps, buffered_ids = [], []
+    buffered = 0
+    spill_dir = None
+    rows_in = 0
+    try:
+        for chunk in read_input():
+            fps = row_fingerprints(chunk, key_columns=key_columns, collapse_inverse=collapse_inverse,
+                                   inverses=inverses)
+            ids = np.arange(rows_in, rows_in + len(chunk), dtype=np.int64)
+            rows_in += len(chunk)
+            buffered_fps.append(fps)
+            buffered_ids.append(ids)
+            buffered += len(fps)
+            if buffered > budget_entries:
+                if spill_dir is None:
+                    spill_dir = tempfile.mkdtemp(prefix="dedup_", dir=tmp_dir)
+                _spill(spill_dir, buffered_fps, buffered_ids)
+                buffered_fps, buffered_ids, buffered = [], [], 0
+
+        # Pass 2: first occurrence of each fingerprint -> keep bitmap
+        keep = np.zeros(rows_in, dtype=bool)
+        if spill_dir is None:
+            if buffered:
+                keep[_first_occurrences(np.concatenate(buffered_fps), np.concatenate(buffered_ids))] = True
+        else:
+            if buffered:
+                _spill(spill_dir, buffered_fps, buffered_ids)
+            buffered_fps, buffered_ids = [], []
+            for part in range(N_PARTITIONS):
+                fps_path = os.path.join(spill_dir, f"{part}.fp")
+                if not os.path.exists(fps_path):
+                    continue
+                fps = np.fromfile(fps_path, dtype=np.uint64)
+                ids = np.fromfile(os.path.join(spill_dir, f"{part}.id"), dtype=np.int64)
+                keep[_first_occurrences(fps, ids)] = True
+    finally:
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    # Pass 3: write kept rows in input order
+    rows_out = 0
+    offset = 0
+    with open(output_csv, "w", encoding="utf-8", newline="") as fout:
+        header_written = False
+        for chunk in read_input():
+            if not header_written:
+                fout.write("|".join(chunk.columns) + "\n")
+                header_written = True
+            kept = chunk[keep[offset:offset + len(chunk)]]
+            offset += len(chunk)
+            rows_out += len(kept)
+            kept.to_csv(fout, sep="|", header=False, index=False)
+        if not header_written:
+            fout.write("|".join(COL_REL) + "\n")
+
+    print(f"[dedup_rel_csv] rows_in={rows_in}, rows_out={rows_out}, spilled={spill_dir is not None}, "
+          f"cost={time.time() - start_t:.2f}s -> {output_csv}")
+    return rows_in, rows_out
+
+
+def _spill(spill_dir, fps_parts, ids_parts):
+    # Append buffered (fingerprint, row id) pairs to their partition files
+    fps = np.concatenate(fps_parts)
+    ids = np.concatenate(ids_parts)
+    parts = (fps >> np.uint64(56)).astype(np.int64)
+    order = np.argsort(parts, kind="stable")
+    fps, ids, parts = fps[order], ids[order], parts[order]
+    bounds = np.searchsorted(parts, np.arange(N_PARTITIONS + 1))
+    for part in range(N_PARTITIONS):
+        lo, hi = bounds[part], bounds[part + 1]
+        if lo == hi:
+            continue
+        with open(os.path.join(spill_dir, f"{part}.fp"), "ab") as fout:
+            fps[lo:hi].tofile(fout)
+        with open(os.path.join(spill_dir, f"{part}.id"), "ab") as fout:
+            ids[lo:hi].tofile(fout)
+
+
+if __name__ == "__main__":
+    data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "data", "umls_output"))
+    dedup_rel_csv(os.path.join(data_dir, "pd_nhop_rel.csv"),
+                  os.path.join(data_dir, "pd_nhop_rel_dedup.csv"),
+                  collapse_inverse=True, inverses=load_inverses("E:\\Data\\2024AB\\META\\MRDOC.RRF"))
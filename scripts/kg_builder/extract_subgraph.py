@@ -0,0 +1,109 @@
+"""
+This method extracts the REL, CONSO and STY subsets of a CUI node set in one fused stage.
+MRREL, MRCONSO and MRSTY are streamed concurrently (one thread per file, the parsers release the GIL),
+so the wall time is roughly that of reading the largest file, instead of three (or four) passes in a row.
+Outputs: pd_nhop_rel.csv, pd_nhop_conso.csv, pd_nhop_sty.csv
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.umls.cui_intern import cui_isin, load_cui_ids, make_cui_ids
+from scripts.umls.rrf_prefilter import cui_prefilter
+from scripts.umls.rrf_reader import COL_CONSO, COL_REL, COL_STY, read_rrf, rel_filter_mask
+
+
+def _rel_mask(chunk, cui_ids, rel_filter):
+    mask = cui_isin(chunk["CUI1"], cui_ids) & cui_isin(chunk["CUI2"], cui_ids)
+    if rel_filter:
+        mask &= rel_filter_mask(chunk, rel_filter)
+    return mask
+
+
+def _conso_mask(chunk, cui_ids, rel_filter):
+    return (chunk["LAT"].astype(str).str.upper() == "ENG") & cui_isin(chunk["CUI"], cui_ids)
+
+
+def _sty_mask(chunk, cui_ids, rel_filter):
+    return cui_isin(chunk["CUI"], cui_ids)
+
+
+def _stream_filter(name, rrf_path, columns, mask_fn, cui_ids, output_path, rel_filter, cui_filter):
+    """
+    Stream one RRF file, keep the rows selected by mask_fn and write them to output_path.
+    Lines whose cui_filter columns are not all in cui_ids are dropped by the byte-level prefilter unparsed.
+    Return: (name, rows_read, rows_kept, seconds)
+    """
+    start_t = time.time()
+    counts = {"rows_in": 0}
+    rows_kept = 0
+    prefilter = cui_prefilter(cui_ids, list(cui_filter), match="all")
+    with open(output_path, "w", encoding="utf-8", newline="") as fout:
+        fout.write("|".join(columns) + "\n")
+        for chunk in read_rrf(rrf_path, columns, cui_filter=cui_filter, prefilter=prefilter, counts=counts):
+            counts["rows_in"] += len(chunk)
+            filtered = chunk[mask_fn(chunk, cui_ids, rel_filter)]
+            if not filtered.empty:
+                rows_kept += len(filtered)
+                filtered.to_csv(fout, sep="|", header=False, index=False)
+    # rows_in also holds the lines the prefilter skipped
+    return name, counts["rows_in"], rows_kept, time.time() - start_t
+
+
+def extract_subgraph_tables(mrrel_path, mrconso_path, mrsty_path, node_set, out_dir,
+                            prefix="pd_nhop", rel_filter=None):
+    """
+    One stage for a CUI set:
+        <prefix>_rel.csv   - MRREL rows with CUI1 and CUI2 in node_set (and passing rel_filter)
+        <prefix>_conso.csv - English MRCONSO rows with CUI in node_set
+        <prefix>_sty.csv   - MRSTY rows with CUI in node_set
+    node_set: CUI strings or a CUI id array. Inputs may be RRF files or Parquet datasets.
+    Membership is tested on a sorted int CUI array.
+    Return: {"rel": path, "conso": path, "sty": path}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cui_ids = make_cui_ids(node_set)
+    outputs = {
+        "rel": os.path.join(out_dir, f"{prefix}_rel.csv"),
+        "conso": os.path.join(out_dir, f"{prefix}_conso.csv"),
+        "sty": os.path.join(out_dir, f"{prefix}_sty.csv"),
+    }
+    jobs = [
+        ("rel", mrrel_path, COL_REL, _rel_mask, {"CUI1": cui_ids, "CUI2": cui_ids}),
+        ("conso", mrconso_path, COL_CONSO, _conso_mask, {"CUI": cui_ids}),
+        ("sty", mrsty_path, COL_STY, _sty_mask, {"CUI": cui_ids}),
+    ]
+
+    start_t = time.time()
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [pool.submit(_stream_filter, name, path, columns, mask_fn, cui_ids,
+                               outputs[name], rel_filter, cui_filter)
+                   for name, path, columns, mask_fn, cui_filter in jobs]
+        for future in futures:
+            name, rows_read, rows_kept, cost = future.result()
+            print(f"[extract_subgraph_tables] {name}: rows_read={rows_read}, rows_kept={rows_kept}, "
+                  f"cost={cost:.2f}s -> {outputs[name]}")
+    print(f"[extract_subgraph_tables] Done, wall time={time.time() - start_t:.2f}s")
+    return outputs
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+    cui_txt = os.path.join(out_dir, "pd_nhop_cuis.txt")
+
+    # Absolute path
+    mrrel_path = "E:\\Data\\2024AB\\META\\MRREL.RRF"
+    mrconso_path = "E:\\Data\\2024AB\\META\\MRCONSO.RRF"
+    mrsty_path = "E:\\Data\\2024AB\\META\\MRSTY.RRF"
+
+    # 1) load final_cuis (as a CUI id array, see cui_intern)
+    final_cuis = load_cui_ids(cui_txt)
+
+    # 2) REL + CONSO + STY in one concurrent pass
+    extract_subgraph_tables(mrrel_path, mrconso_path, mrsty_path, final_cuis, out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,22 @@
 # This method is used to generate pd_nhop_conso.csv and pd_nhop_sty.csv files
 
+import argparse
 import os
 from scripts.umls.chunk_extract_example import filter_mrconso,filter_mrsty
+from scripts.umls.cui_intern import load_cui_ids
+from scripts.umls.stage_metrics import add_metrics_args, configure_metrics
+from scripts.umls.rrf_parallel import default_workers
+from scripts.umls.stage_cache import cached_stage, code_version
 
 def main():
+    parser = argparse.ArgumentParser(description="Filter MRCONSO / MRSTY to the PD n-hop CUIs")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue interrupted filters from their last checkpoint")
+    parser.add_argument("--no-cache", action="store_true", help="recompute, ignoring the stage cache")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..",".."))
     rrf_dir = os.path.join(base_dir,"data","umls")
     out_dir = os.path.join(base_dir,"data","umls_output")
@@ -13,19 +26,31 @@ def main():
     mrconso_path = "E:\\Data\\2024AB\\META\\MRCONSO.RRF"
     mrsty_path = "E:\\Data\\2024AB\\META\\MRSTY.RRF"
 
+    # Prefer the Parquet datasets from rrf_parquet.convert_release when they exist
+    parquet_dir = os.path.join(base_dir, "data", "umls_parquet")
+    if os.path.isdir(os.path.join(parquet_dir, "MRCONSO")):
+        mrconso_path = os.path.join(parquet_dir, "MRCONSO")
+    if os.path.isdir(os.path.join(parquet_dir, "MRSTY")):
+        mrsty_path = os.path.join(parquet_dir, "MRSTY")
+
     conso_filtered = os.path.join(out_dir,"pd_nhop_conso.csv")
     sty_filtered = os.path.join(out_dir,"pd_nhop_sty.csv")
 
-    # 1) load final_cuis
-    final_cuis = set()
-    with open(cui_txt, 'r', encoding='utf-8') as fin:
-        for line in fin:
-            final_cuis.add(line.strip())
+    # 1) load final_cuis (as a CUI id array, see cui_intern)
+    final_cuis = load_cui_ids(cui_txt)
 
-    # 2) filter mrconso
-    filter_mrconso(mrconso_path, final_cuis, conso_filtered)
+    # 2) filter mrconso (skipped when MRCONSO, the CUI list and the code are unchanged, see stage_cache)
+    cached_stage("pd_nhop_conso",
+                 lambda: filter_mrconso(mrconso_path, final_cuis, conso_filtered, n_workers=default_workers(),
+                                        resume=args.resume),
+                 inputs=[mrconso_path, cui_txt], outputs=[conso_filtered], code=code_version(filter_mrconso),
+                 enabled=not args.no_cache)
     # 3) filter mrsty
-    filter_mrsty(mrsty_path, final_cuis, sty_filtered)
+    cached_stage("pd_nhop_sty",
+                 lambda: filter_mrsty(mrsty_path, final_cuis, sty_filtered, n_workers=default_workers(),
+                                      resume=args.resume),
+                 inputs=[mrsty_path, cui_txt], outputs=[sty_filtered], code=code_version(filter_mrsty),
+                 enabled=not args.no_cache)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""
+This is a method to export the extracted subgraph (pd_nhop_rel*.csv + pd_nhop_sty.csv) as NumPy arrays,
+so training runs load the graph with np.load(mmap_mode=...) instead of re-parsing the csv files.
+
+The export directory contains:
+    edge_index.npy  - int64 [2, n_edges], row 0 = source node id (CUI1), row 1 = target node id (CUI2)
+    edge_type.npy   - int64 [n_edges], relation id = line number in relations.txt
+    node_cuis.npy   - int32 [n_nodes], CUI id (see cui_intern) of every node id, ascending
+    relations.txt   - one relation label (RELA, otherwise REL) per line
+    node_sty.npy    - uint8 [n_nodes, n_types] semantic type multi-hot (only when a STY csv is given)
+    sty_vocab.tsv   - column <TAB> TUI <TAB> STY of node_sty.npy
+    graph.json      - sizes and sources, written last: marks a complete export
+edge_index / edge_type are int64 because that is what torch_geometric expects, so torch.from_numpy
+can share the memory-mapped pages instead of converting them.
+Node ids follow the CUI order, so node_cuis is also the lookup for a CUI: np.searchsorted(node_cuis, cui_id).
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.kg_builder.build_triples import read_rel_columns, relation_labels
+from scripts.kg_builder.mrrel_index import encode_cuis
+from scripts.umls.cui_intern import column_cui_ids, cui_strings, load_cui_ids, make_cui_ids
+from scripts.umls.stage_cache import cached_stage, code_version
+
+try:
+    import networkx as nx
+except ImportError:
+    nx = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+EDGE_INDEX_FILE = "edge_index.npy"
+EDGE_TYPE_FILE = "edge_type.npy"
+NODE_CUIS_FILE = "node_cuis.npy"
+RELATIONS_FILE = "relations.txt"
+NODE_STY_FILE = "node_sty.npy"
+STY_VOCAB_FILE = "sty_vocab.tsv"
+GRAPH_FILE = "graph.json"
+
+CHUNKSIZE = 1_000_000
+
+
+def read_edges(rel_csv_path, chunksize=CHUNKSIZE):
+    """
+    Stream the REL csv into integer edges (rows with a malformed / empty CUI are dropped).
+    Return: src CUI ids (int32), dst CUI ids (int32), relation ids (int32), relations (list)
+    """
+    relation_to_id = {}
+    src_parts, dst_parts, type_parts = [], [], []
+    for chunk in read_rel_columns(rel_csv_path, chunksize=chunksize):
+        src = column_cui_ids(chunk["CUI1"])
+        dst = column_cui_ids(chunk["CUI2"])
+        rels = encode_cuis(relation_labels(chunk).fillna(""), relation_to_id)
+        keep = (src >= 0) & (dst >= 0)
+        src_parts.append(src[keep])
+        dst_parts.append(dst[keep])
+        type_parts.append(rels[keep])
+
+    def join(parts):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+    return join(src_parts), join(dst_parts), join(type_parts), list(relation_to_id)
+
+
+def _unique_edges(src, dst, edge_type, n_nodes, n_relations):
+    # Drop repeated (src, type, dst) triples; the result is sorted by source node, then type, then target
+    keys = np.unique((src.astype(np.int64) * max(n_relations, 1) + edge_type) * n_nodes + dst)
+    dst = keys % n_nodes
+    rest = keys // n_nodes
+    return rest // max(n_relations, 1), dst, rest % max(n_relations, 1)
+
+
+def _sty_features(sty_csv_path, node_cuis):
+    # Multi-hot [n_nodes, n_types] of the semantic types of every node, with the (TUI, STY) of each column
+    sty = pd.read_csv(sty_csv_path, sep="|", dtype=str,
+                      usecols=["CUI", "TUI", "STY"]).dropna(subset=["CUI", "TUI"])
+    vocab = sty[["TUI", "STY"]].drop_duplicates("TUI").sort_values("TUI").reset_index(drop=True)
+    column_of_tui = {tui: column for column, tui in enumerate(vocab["TUI"])}
+
+    cui_ids = column_cui_ids(sty["CUI"])
+    rows = np.searchsorted(node_cuis, cui_ids)
+    # CUIs of the STY csv that are not nodes of the graph are ignored
+    known = (cui_ids >= 0) & (rows < len(node_cuis))
+    known[known] = node_cuis[rows[known]] == cui_ids[known]
+
+    features = np.zeros((len(node_cuis), len(vocab)), dtype=np.uint8)
+    features[rows[known], sty["TUI"].map(column_of_tui).to_numpy()[known]] = 1
+    return features, list(zip(vocab["TUI"], vocab["STY"].fillna("")))
+
+
+def export_graph_arrays(rel_csv_path, out_dir, sty_csv_path=None, node_cuis=None, dedup=True,
+                        chunksize=CHUNKSIZE):
+    """
+    Write the subgraph of a REL csv as edge_index / edge_type / node arrays (layout above).
+    :param sty_csv_path: STY csv of the same subgraph (pd_nhop_sty.csv) for node_sty.npy, or None
+    :param node_cuis: extra nodes, e.g. load_cui_ids("pd_nhop_cuis.txt"), so BFS nodes without
+                      any kept edge still get a node id
+    :param dedup: drop repeated (CUI1, relation, CUI2) edges (the edges are then sorted by source node);
+                  False keeps every row in file order
+    Return: dict with n_nodes, n_edges, n_relations
+    """
+    start_time = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    # graph.json marks a complete export (graph_export_matches), so it is removed first and written last
+    if os.path.exists(os.path.join(out_dir, GRAPH_FILE)):
+        os.remove(os.path.join(out_dir, GRAPH_FILE))
+
+    src, dst, edge_type, relations = read_edges(rel_csv_path, chunksize=chunksize)
+    nodes = [src, dst]
+    if node_cuis is not None:
+        nodes.append(make_cui_ids(node_cuis))
+    all_cuis = np.unique(np.concatenate(nodes)).astype(np.int32)
+
+    src = np.searchsorted(all_cuis, src)
+    dst = np.searchsorted(all_cuis, dst)
+    if dedup:
+        src, dst, edge_type = _unique_edges(src, dst, edge_type, len(all_cuis), len(relations))
+
+    # One C-contiguous [2, n] block: edge_index[0] / edge_index[1] are views, no copy on load
+    edge_index = np.empty((2, len(src)), dtype=np.int64)
+    edge_index[0] = src
+    edge_index[1] = dst
+    np.save(os.path.join(out_dir, EDGE_INDEX_FILE), edge_index)
+    np.save(os.path.join(out_dir, EDGE_TYPE_FILE), edge_type.astype(np.int64))
+    np.save(os.path.join(out_dir, NODE_CUIS_FILE), all_cuis)
+    with open(os.path.join(out_dir, RELATIONS_FILE), "w", encoding="utf-8") as fout:
+        for relation in relations:
+            fout.write(relation + "\n")
+
+    n_types = None
+    if sty_csv_path is not None:
+        features, sty_vocab = _sty_features(sty_csv_path, all_cuis)
+        np.save(os.path.join(out_dir, NODE_STY_FILE), features)
+        with open(os.path.join(out_dir, STY_VOCAB_FILE), "w", encoding="utf-8") as fout:
+            for column, (tui, sty_name) in enumerate(sty_vocab):
+                fout.write(f"{column}\t{tui}\t{sty_name}\n")
+        n_types = len(sty_vocab)
+    elif os.path.exists(os.path.join(out_dir, NODE_STY_FILE)):
+        # Left over from an earlier export with semantic types
+        os.remove(os.path.join(out_dir, NODE_STY_FILE))
+        os.remove(os.path.join(out_dir, STY_VOCAB_FILE))
+
+    summary = {"n_nodes": len(all_cuis), "n_edges": int(edge_index.shape[1]), "n_relations": len(relations)}
+    with open(os.path.join(out_dir, GRAPH_FILE), "w", encoding="utf-8") as fout:
+        json.dump(dict(summary, n_semantic_types=n_types, dedup=dedup, rel_csv=str(rel_csv_path),
+                       sty_csv=None if sty_csv_path is None else str(sty_csv_path)), fout, indent=2)
+
+    print(f"[export_graph_arrays] nodes={summary['n_nodes']}, edges={summary['n_edges']}, "
+          f"relations={summary['n_relations']}, semantic_types={n_types}, "
+          f"cost={time.time() - start_time:.2f}s -> {out_dir}")
+    return summary
+
+
+def load_graph_arrays(export_dir, mmap_mode="r"):
+    """
+    Open an export of export_graph_arrays; the arrays are memory-mapped, so this takes milliseconds
+    whatever the graph size.
+    :param mmap_mode: "r" read-only, "c" copy-on-write (writable without touching the files), None = read into memory
+    Return: dict with edge_index, edge_type, node_cuis, relations (list), node_sty (None without semantic types),
+            sty_vocab [(TUI, STY), ...]
+    """
+    with open(os.path.join(export_dir, RELATIONS_FILE), "r", encoding="utf-8") as fin:
+        relations = [line.rstrip("\n") for line in fin]
+    node_sty, sty_vocab = None, []
+    if os.path.exists(os.path.join(export_dir, NODE_STY_FILE)):
+        node_sty = np.load(os.path.join(export_dir, NODE_STY_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(export_dir, STY_VOCAB_FILE), "r", encoding="utf-8") as fin:
+            sty_vocab = [tuple(line.rstrip("\n").split("\t")[1:3]) for line in fin]
+    return {
+        "edge_index": np.load(os.path.join(export_dir, EDGE_INDEX_FILE), mmap_mode=mmap_mode),
+        "edge_type": np.load(os.path.join(export_dir, EDGE_TYPE_FILE), mmap_mode=mmap_mode),
+        "node_cuis": np.load(os.path.join(export_dir, NODE_CUIS_FILE), mmap_mode=mmap_mode),
+        "relations": relations,
+        "node_sty": node_sty,
+        "sty_vocab": sty_vocab,
+    }
+
+
+def graph_export_matches(export_dir):
+    """
+    True if export_dir holds a complete export
+    """
+    return os.path.exists(os.path.join(export_dir, GRAPH_FILE))
+
+
+def load_torch_graph(export_dir):
+    """
+    The export as torch tensors that share memory with the mapped files (torch.from_numpy, no copy).
+    The files are mapped copy-on-write: torch wants writable arrays, and in-place edits stay in this process.
+    Return: dict with edge_index (int64 [2, n]), edge_type (int64), node_cuis (int32), x (uint8 semantic
+            type multi-hot, or None), relations (list)
+    """
+    if torch is None:
+        raise ImportError("load_torch_graph needs torch (pip install torch)")
+    graph = load_graph_arrays(export_dir, mmap_mode="c")
+    return {
+        "edge_index": torch.from_numpy(graph["edge_index"]),
+        "edge_type": torch.from_numpy(graph["edge_type"]),
+        "node_cuis": torch.from_numpy(graph["node_cuis"]),
+        "x": None if graph["node_sty"] is None else torch.from_numpy(graph["node_sty"]),
+        "relations": graph["relations"],
+    }
+
+
+def to_networkx(graph, directed=True, multigraph=False, relation_attr="rel", cui_attr=None):
+    """
+    Build a networkx graph from load_graph_arrays output, with node ids as node keys.
+    Edges are handed to add_edges_from as plain Python ints from tolist() (iterating the NumPy arrays
+    would create one NumPy scalar per endpoint); relation attributes use one shared dict per relation,
+    which networkx copies per edge.
+    :param multigraph: keep parallel edges with different relations (otherwise the last relation of a pair wins)
+    :param relation_attr: edge attribute with the relation label, None = no edge attributes (fastest)
+    :param cui_attr: node attribute with the CUI string, None = none
+    Return: nx.DiGraph / nx.Graph / nx.MultiDiGraph / nx.MultiGraph
+    """
+    if nx is None:
+        raise ImportError("to_networkx needs networkx (pip install networkx)")
+    if multigraph:
+        graph_cls = nx.MultiDiGraph if directed else nx.MultiGraph
+    else:
+        graph_cls = nx.DiGraph if directed else nx.Graph
+    nx_graph = graph_cls()
+
+    n_nodes = len(graph["node_cuis"])
+    if cui_attr:
+        nx_graph.add_nodes_from((node, {cui_attr: cui})
+                                for node, cui in enumerate(cui_strings(graph["node_cuis"])))
+    else:
+        nx_graph.add_nodes_from(range(n_nodes))
+
+    src = graph["edge_index"][0].tolist()
+    dst = graph["edge_index"][1].tolist()
+    if relation_attr:
+        attrs = [{relation_attr: relation} for relation in graph["relations"]]
+        nx_graph.add_edges_from(zip(src, dst, [attrs[t] for t in graph["edge_type"].tolist()]))
+    else:
+        nx_graph.add_edges_from(zip(src, dst))
+    return nx_graph
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+
+    rel_csv = os.path.join(out_dir, "pd_nhop_rel_dedup.csv")
+    sty_csv = os.path.join(out_dir, "pd_nhop_sty.csv")
+    cui_txt = os.path.join(out_dir, "pd_nhop_cuis.txt")
+    export_dir = os.path.join(out_dir, "pd_nhop_graph")
+
+    # Skipped when the csv files and the code are unchanged (see stage_cache)
+    cached_stage("pd_nhop_graph",
+                 lambda: export_graph_arrays(rel_csv, export_dir, sty_csv_path=sty_csv,
+                                             node_cuis=load_cui_ids(cui_txt)),
+                 inputs=[rel_csv, sty_csv, cui_txt], outputs=[export_dir], code=code_version(export_graph_arrays))
+
+    start_time = time.time()
+    graph = load_graph_arrays(export_dir)
+    print(f"[main] loaded {graph['edge_index'].shape[1]} edges, {len(graph['node_cuis'])} nodes "
+          f"in {time.time() - start_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
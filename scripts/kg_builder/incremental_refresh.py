@@ -0,0 +1,454 @@
+"""
+Incremental refresh of the n-hop subgraph outputs between two UMLS releases.
+
+Instead of rerunning bfs_node_only + filter_rel_by_cuis + filter_pd_labels from scratch:
+    1) every release is reduced once to a fingerprint state (64-bit hash per MRREL / MRCONSO / MRSTY row,
+       plus the row's CUIs and, for a plain RRF file, the byte offset of its line), saved in state_dir;
+       the previous release is never read again
+    2) the row fingerprints of the two releases are diffed: a row whose RUI / AUI / ATUI content
+       changed shows up as one removed and one added row
+    3) the adjacency index of the new release is built from its state (no extra MRREL pass), and hop
+       distances are repaired only around nodes whose adjacency changed
+    4) pd_nhop_cuis.txt (+ _hops/_seeds), pd_nhop_rel.csv, pd_nhop_conso.csv and pd_nhop_sty.csv are
+       patched (old rows dropped, new rows appended) and a change manifest is written.
+       The rows to append are picked from the state; only their lines are read again, by byte offset
+       (compressed / Parquet sources have no offsets and are scanned once more)
+Every new file (outputs, index, state) is written to a staging dir first and moved in one commit step, recorded
+in a commit list: a run that fails before it leaves the outputs and state untouched, and the next run finishes
+a commit that was cut short before it does anything else.
+"""
+
+import heapq
+import io
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.kg_builder.dedup_edges import row_fingerprints
+from scripts.kg_builder.mrrel_index import (
+    edges_to_csr, load_adjacency_index, write_adjacency_index, write_bfs_result
+)
+from scripts.umls.rrf_reader import (
+    BLOCK_SIZE, COL_CONSO, COL_REL, COL_STY, cui_numbers, is_parquet_source, read_rrf, rel_filter_mask
+)
+from scripts.umls.rrf_source import is_stream_source
+
+# Table -> (columns, CUI columns kept in the state, output csv suffix)
+TABLES = {
+    "MRREL": (COL_REL, ["CUI1", "CUI2"], "rel"),
+    "MRCONSO": (COL_CONSO, ["CUI"], "conso"),
+    "MRSTY": (COL_STY, ["CUI"], "sty"),
+}
+
+_UNREACHED = np.iinfo(np.int32).max
+
+# (staged path, target path) pairs of a refresh that is ready to commit, in its staging dir
+COMMIT_FILE = "commit.json"
+
+
+def _keep_mask(table, chunk, rel_filter):
+    # bool per row: the rows of a release that can end up in the outputs at all
+    if table == "MRREL" and rel_filter:
+        return np.asarray(rel_filter_mask(chunk, rel_filter), dtype=bool)
+    if table == "MRCONSO":
+        return (chunk["LAT"].astype(str).str.upper() == "ENG").to_numpy()
+    return np.ones(len(chunk), dtype=bool)
+
+
+def _has_offsets(rrf_path):
+    # Plain RRF files can be read again line by line at the offsets kept in the state
+    return os.path.isfile(rrf_path) and not is_stream_source(rrf_path) and not is_parquet_source(rrf_path)
+
+
+def _line_blocks(rrf_path, block_size):
+    # (byte offsets of the non-blank lines, bytes of those whole lines) per block of about block_size bytes
+    with open(rrf_path, "rb") as fin:
+        position = 0
+        while True:
+            block = fin.read(block_size)
+            if not block:
+                return
+            if not block.endswith(b"\n"):
+                block += fin.readline()
+            stops = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")) + 1
+            if not len(stops) or stops[-1] != len(block):
+                stops = np.append(stops, len(block))
+            starts = np.concatenate([[0], stops[:-1]])
+            # Blank lines ("\n", "\r\n") are skipped by the parser and never become rows
+            short = np.flatnonzero(stops - starts <= 2)
+            blank = short[[not block[starts[i]:stops[i]].strip() for i in short]] if len(short) else short
+            yield position + np.delete(starts, blank), block
+            position += len(block)
+
+
+def _release_chunks(rrf_path, columns, table, rel_filter):
+    """
+    Kept rows of a release table (see _keep_mask) as string chunks, in file order, each with the byte offsets
+    of its lines (None for compressed / Parquet sources)
+    """
+    if not _has_offsets(rrf_path):
+        for chunk in read_rrf(rrf_path, columns):
+            yield _as_strings(chunk[_keep_mask(table, chunk, rel_filter)]), None
+        return
+    for offsets, block in _line_blocks(rrf_path, BLOCK_SIZE):
+        first = 0
+        for chunk in read_rrf(io.BytesIO(block), columns):
+            chunk_offsets = offsets[first:first + len(chunk)]
+            first += len(chunk)
+            keep = _keep_mask(table, chunk, rel_filter)
+            yield _as_strings(chunk[keep]), chunk_offsets[keep]
+        if first != len(offsets):
+            raise ValueError(f"{rrf_path}: parsed {first} rows from {len(offsets)} lines near byte {offsets[0]}")
+
+
+def _as_strings(chunk):
+    # Same representation as the csv outputs read back with keep_default_na=False
+    return chunk.astype(object).fillna("")
+
+
+def snapshot_release(meta_dir, state_dir, rel_filter=None):
+    """
+    Fingerprint MRREL / MRCONSO / MRSTY of a release into state_dir/<table>.npz
+    (fps: uint64 row fingerprints, plus one int64 CUI-number array per CUI column and, for a plain RRF
+    file, offsets: int64 byte offset of every row's line).
+    Run it once for the release the current outputs were built from; refresh() keeps it up to date.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    for table, (columns, cui_columns, _) in TABLES.items():
+        start_t = time.time()
+        rrf_path = os.path.join(meta_dir, table + ".RRF")
+        fps, cuis, offsets = [], {col: [] for col in cui_columns}, []
+        for chunk, chunk_offsets in _release_chunks(rrf_path, columns, table, rel_filter):
+            fps.append(row_fingerprints(chunk))
+            for col in cui_columns:
+                cuis[col].append(cui_numbers(chunk[col]))
+            if chunk_offsets is not None:
+                offsets.append(chunk_offsets)
+        arrays = {"fps": np.concatenate(fps) if fps else np.empty(0, dtype=np.uint64)}
+        for col in cui_columns:
+            arrays[col] = np.concatenate(cuis[col]) if cuis[col] else np.empty(0, dtype=np.int64)
+        if _has_offsets(rrf_path):
+            arrays["offsets"] = np.concatenate(offsets) if offsets else np.empty(0, dtype=np.int64)
+        np.savez(os.path.join(state_dir, table + ".npz"), **arrays)
+        print(f"[snapshot_release] {table}: rows={len(arrays['fps'])}, cost={time.time() - start_t:.2f}s")
+    with open(os.path.join(state_dir, "release.json"), "w", encoding="utf-8") as fout:
+        json.dump({"meta_dir": str(meta_dir), "rel_filter": rel_filter}, fout, sort_keys=True)
+
+
+def load_state(state_dir, table):
+    with np.load(os.path.join(state_dir, table + ".npz")) as data:
+        return {key: data[key] for key in data.files}
+
+
+def diff_states(old, new):
+    """
+    Return: (removed mask over old rows, added mask over new rows)
+    """
+    old_fps, new_fps = old["fps"], new["fps"]
+    return ~np.isin(old_fps, new_fps), ~np.isin(new_fps, old_fps)
+
+
+def index_from_state(mrrel_state, index_dir, rel_filter=None):
+    """
+    Build the adjacency index of a release straight from its MRREL state (ids = sorted CUI numbers)
+    """
+    c1, c2 = mrrel_state["CUI1"], mrrel_state["CUI2"]
+    valid = (c1 >= 0) & (c2 >= 0)
+    c1, c2 = c1[valid], c2[valid]
+    numbers = np.unique(np.concatenate([c1, c2]))
+    offsets, neighbors = edges_to_csr(np.searchsorted(numbers, c1), np.searchsorted(numbers, c2), len(numbers))
+    write_adjacency_index(index_dir, [f"C{n:07d}" for n in numbers], offsets, neighbors, rel_filter)
+    return load_adjacency_index(index_dir)
+
+
+def _neighbors(index, node):
+    return index["neighbors"][index["offsets"][node]:index["offsets"][node + 1]]
+
+
+def repair_distances(index, old_cuis, old_hops, old_seeds, seed_cuis, changed_cuis, max_hops):
+    """
+    Carry the previous hop distances over to the new index and repair them only around changed_cuis
+    (endpoints of added / removed edges):
+        - nodes that lost every neighbor one hop closer to a seed are invalidated, transitively
+        - invalidated and changed nodes are re-relaxed from their valid neighbors (unit-weight Dijkstra,
+          bounded by max_hops)
+        - seeds are recomputed where distances or edges changed, in hop order, and a changed seed is passed
+          on to the next hop: like bfs_multi_seed, a node takes the lowest seed index among its neighbors
+          one hop closer (the seed listed first wins ties)
+    Return: hops (int8, -1 = unreached), seeds (int16) over the new index ids
+    """
+    cui_to_id = index["cui_to_id"]
+    n_nodes = len(index["offsets"]) - 1
+    dist = np.full(n_nodes, _UNREACHED, dtype=np.int32)
+    seeds = np.full(n_nodes, -1, dtype=np.int16)
+    for cui, hop, seed in zip(old_cuis, old_hops, old_seeds):
+        node = cui_to_id.get(cui)
+        if node is not None and 0 <= hop <= max_hops:
+            dist[node] = hop
+            seeds[node] = seed
+    seed_nodes = {}
+    for seed_idx, cui in enumerate(seed_cuis):
+        node = cui_to_id.get(cui)
+        if node is not None and node not in seed_nodes:
+            seed_nodes[node] = seed_idx
+            dist[node] = 0
+            seeds[node] = seed_idx
+
+    changed = [cui_to_id[c] for c in changed_cuis if c in cui_to_id]
+    carried = dist.copy()
+
+    # Step A: invalidate nodes without support
+    invalidated = set()
+    queue = list(changed)
+    while queue:
+        node = queue.pop()
+        d = dist[node]
+        if d == 0 or d == _UNREACHED:
+            continue
+        nbrs = _neighbors(index, node)
+        if len(nbrs) and (dist[nbrs] == d - 1).any():
+            continue
+        dist[node] = _UNREACHED
+        seeds[node] = -1
+        invalidated.add(node)
+        queue.extend(int(z) for z in nbrs[dist[nbrs] == d + 1])
+
+    # Step B: re-relax invalidated / changed nodes, then propagate improvements
+    heap = []
+    for node in invalidated.union(changed):
+        nbrs = _neighbors(index, node)
+        valid = nbrs[dist[nbrs] < max_hops]
+        if len(valid):
+            best = valid[np.argmin(dist[valid])]
+            if dist[best] + 1 < dist[node]:
+                dist[node] = dist[best] + 1
+                seeds[node] = seeds[best]
+        if dist[node] != _UNREACHED:
+            heapq.heappush(heap, (int(dist[node]), node))
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d != dist[node] or d >= max_hops:
+            continue
+        for z in _neighbors(index, node):
+            if d + 1 < dist[z]:
+                dist[z] = d + 1
+                seeds[z] = seeds[node]
+                heapq.heappush(heap, (d + 1, int(z)))
+
+    # Step C: seeds of the nodes whose closer neighbors may have changed, then of their successors
+    moved = np.flatnonzero(dist != carried)
+    recheck = invalidated.union(changed, moved.tolist())
+    for node in moved:
+        recheck.update(_neighbors(index, node).tolist())
+    heap = [(int(dist[node]), node) for node in recheck if 0 < dist[node] <= max_hops]
+    heapq.heapify(heap)
+    queued = {node for _, node in heap}
+    while heap:
+        d, node = heapq.heappop(heap)
+        queued.discard(node)
+        nbrs = _neighbors(index, node)
+        closer = nbrs[dist[nbrs] == d - 1]
+        seed = seeds[closer].min() if len(closer) else -1
+        if seed == seeds[node]:
+            continue
+        seeds[node] = seed
+        if d < max_hops:
+            for z in nbrs[dist[nbrs] == d + 1].tolist():
+                if z not in queued:
+                    queued.add(z)
+                    heapq.heappush(heap, (d + 1, z))
+
+    hops = np.where(dist <= max_hops, dist, -1).astype(np.int8)
+    return hops, np.where(hops >= 0, seeds, -1).astype(np.int16)
+
+
+def _picked_rows(rrf_path, columns, table, state, pick, rel_filter, batch_rows=100_000):
+    """
+    The rows of a release table selected by pick (bool over the rows of its state), as string chunks.
+    With byte offsets in the state only those lines are read; otherwise the table is scanned once more and
+    rows are picked by their position among the kept rows.
+    """
+    if "offsets" in state and _has_offsets(rrf_path):
+        with open(rrf_path, "rb") as fin:
+            lines = []
+            for offset in state["offsets"][pick].tolist():
+                fin.seek(offset)
+                lines.append(fin.readline())
+                if len(lines) == batch_rows:
+                    yield from (_as_strings(chunk) for chunk in read_rrf(io.BytesIO(b"".join(lines)), columns))
+                    lines = []
+            if lines:
+                yield from (_as_strings(chunk) for chunk in read_rrf(io.BytesIO(b"".join(lines)), columns))
+        return
+    first = 0
+    for chunk, _ in _release_chunks(rrf_path, columns, table, rel_filter):
+        yield chunk[pick[first:first + len(chunk)]]
+        first += len(chunk)
+
+
+def _patch_output(output_csv, patched_csv, columns, cui_columns, removed_fps, node_numbers, added_chunks):
+    """
+    Write output_csv to patched_csv without the rows that left the release or lost a node, followed by
+    added_chunks (new-release rows that were added or touch a newly reached node).
+    Return: (rows_dropped, rows_added)
+    """
+    dropped = added = 0
+    with open(patched_csv, "w", encoding="utf-8", newline="") as fout:
+        fout.write("|".join(columns) + "\n")
+        if os.path.exists(output_csv):
+            # Same quoting as to_csv wrote it with, so a kept row fingerprints like its RRF row
+            for chunk in pd.read_csv(output_csv, sep="|", dtype=str, chunksize=100_000,
+                                     keep_default_na=False, na_values=[]):
+                keep = ~np.isin(row_fingerprints(chunk), removed_fps)
+                for col in cui_columns:
+                    keep &= np.isin(cui_numbers(chunk[col]), node_numbers)
+                dropped += int((~keep).sum())
+                chunk[keep].to_csv(fout, sep="|", header=False, index=False)
+
+        for chunk in added_chunks:
+            added += len(chunk)
+            chunk.to_csv(fout, sep="|", header=False, index=False)
+    return dropped, added
+
+
+def _commit(staging_dir):
+    """
+    Move every staged path listed in staging_dir/commit.json over its target, then drop the staging dirs.
+    Moves that are done already are skipped, so a commit that was cut short is finished by running it again.
+    """
+    with open(os.path.join(staging_dir, COMMIT_FILE), "r", encoding="utf-8") as fin:
+        commit = json.load(fin)
+    for staged, target in commit["moves"]:
+        if not os.path.exists(staged):
+            continue
+        if os.path.isdir(staged):
+            shutil.rmtree(target, ignore_errors=True)
+        os.replace(staged, target)
+    for path in commit["staged_dirs"]:
+        shutil.rmtree(path, ignore_errors=True)
+    print(f"[commit] {len(commit['moves'])} files moved from {staging_dir}")
+
+
+def refresh(new_meta_dir, state_dir, out_dir, prefix="pd_nhop", max_hops=7, rel_filter=None):
+    """
+    Bring <prefix>_cuis.txt / _rel.csv / _conso.csv / _sty.csv in out_dir from the release in state_dir
+    to the release in new_meta_dir, then make the new release the stored state.
+    Everything is staged in out_dir/<prefix>_refresh.staging and state_dir + ".new", then committed together;
+    rerunning after a failure is safe.
+    Return: manifest dict (also written to out_dir/<prefix>_changes.json)
+    """
+    start_t = time.time()
+    staging_dir = os.path.join(out_dir, f"{prefix}_refresh.staging")
+    new_state_dir = state_dir + ".new"
+    manifest_path = os.path.join(out_dir, f"{prefix}_changes.json")
+    if os.path.exists(os.path.join(staging_dir, COMMIT_FILE)):
+        # The previous run failed while committing: finish it, it may already be the refresh asked for
+        _commit(staging_dir)
+        with open(manifest_path, "r", encoding="utf-8") as fin:
+            manifest = json.load(fin)
+        if manifest["new_release"] == str(new_meta_dir):
+            return manifest
+    # Leftovers of a run that failed before its commit
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    shutil.rmtree(new_state_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    cui_txt = os.path.join(out_dir, f"{prefix}_cuis.txt")
+    stem = os.path.splitext(cui_txt)[0]
+    with open(cui_txt, "r", encoding="utf-8") as fin:
+        old_cuis = [line.strip() for line in fin if line.strip()]
+    old_hops = np.load(stem + "_hops.npy")
+    old_seeds = np.load(stem + "_seeds.npy")
+    with open(stem + "_seeds.txt", "r", encoding="utf-8") as fin:
+        seed_cuis = [line.strip() for line in fin if line.strip()]
+
+    # 1) fingerprint the new release next to the old state
+    snapshot_release(new_meta_dir, new_state_dir, rel_filter=rel_filter)
+
+    # 2) MRREL diff -> nodes whose adjacency changed
+    old_rel, new_rel = load_state(state_dir, "MRREL"), load_state(new_state_dir, "MRREL")
+    rel_removed, rel_added = diff_states(old_rel, new_rel)
+    changed_numbers = np.unique(np.concatenate([
+        old_rel["CUI1"][rel_removed], old_rel["CUI2"][rel_removed],
+        new_rel["CUI1"][rel_added], new_rel["CUI2"][rel_added]]))
+    changed_cuis = [f"C{n:07d}" for n in changed_numbers if n >= 0]
+
+    # 3) new index from the state, distances repaired around the changed nodes
+    index = index_from_state(new_rel, os.path.join(staging_dir, "mrrel_index"), rel_filter=rel_filter)
+    hops, seeds = repair_distances(index, old_cuis, old_hops, old_seeds, seed_cuis, changed_cuis, max_hops)
+    write_bfs_result(index, seed_cuis, hops, seeds, os.path.join(staging_dir, os.path.basename(cui_txt)))
+
+    new_nodes = {index["cuis"][i] for i in np.flatnonzero(hops >= 0)}
+    added_nodes = sorted(new_nodes - set(old_cuis))
+    removed_nodes = sorted(set(old_cuis) - new_nodes)
+    node_numbers = np.unique(cui_numbers(sorted(new_nodes)))
+    added_numbers = np.unique(cui_numbers(added_nodes)) if added_nodes else np.empty(0, dtype=np.int64)
+
+    # 4) patch the table outputs
+    with open(os.path.join(state_dir, "release.json"), "r", encoding="utf-8") as fin:
+        old_release = json.load(fin)["meta_dir"]
+    manifest = {
+        "old_release": old_release,
+        "new_release": str(new_meta_dir),
+        "max_hops": max_hops,
+        "seed_cuis": seed_cuis,
+        "nodes_added": added_nodes,
+        "nodes_removed": removed_nodes,
+        "adjacency_changed_cuis": len(changed_cuis),
+        "tables": {},
+    }
+    for table, (columns, cui_columns, suffix) in TABLES.items():
+        old, new = (old_rel, new_rel) if table == "MRREL" else (load_state(state_dir, table),
+                                                                load_state(new_state_dir, table))
+        removed, added = diff_states(old, new)
+        inside = np.logical_and.reduce([np.isin(new[col], node_numbers) for col in cui_columns])
+        touches_new = np.logical_or.reduce([np.isin(new[col], added_numbers) for col in cui_columns])
+        # An unchanged row with all its CUIs in the old node set is already among the kept rows
+        pick = inside & (added | touches_new)
+        added_chunks = _picked_rows(os.path.join(new_meta_dir, table + ".RRF"), columns, table, new, pick,
+                                    rel_filter)
+        dropped, appended = _patch_output(os.path.join(out_dir, f"{prefix}_{suffix}.csv"),
+                                          os.path.join(staging_dir, f"{prefix}_{suffix}.csv"), columns, cui_columns,
+                                          old["fps"][removed], node_numbers, added_chunks)
+        manifest["tables"][table] = {"release_rows_removed": int(removed.sum()),
+                                     "release_rows_added": int(added.sum()),
+                                     "output_rows_dropped": dropped, "output_rows_added": appended}
+
+    manifest["cost_seconds"] = round(time.time() - start_t, 2)
+    with open(os.path.join(staging_dir, os.path.basename(manifest_path)), "w", encoding="utf-8") as fout:
+        json.dump(manifest, fout, indent=2)
+
+    # 5) commit: staged outputs over the old ones, the new release becomes the stored state
+    moves = [(os.path.join(staging_dir, name), os.path.join(out_dir, name)) for name in os.listdir(staging_dir)]
+    moves += [(os.path.join(new_state_dir, name), os.path.join(state_dir, name)) for name in os.listdir(new_state_dir)]
+    # Written under another name and renamed, so the commit list is either complete or absent
+    with open(os.path.join(staging_dir, COMMIT_FILE + ".tmp"), "w", encoding="utf-8") as fout:
+        json.dump({"moves": moves, "staged_dirs": [new_state_dir, staging_dir]}, fout, indent=2)
+    os.replace(os.path.join(staging_dir, COMMIT_FILE + ".tmp"), os.path.join(staging_dir, COMMIT_FILE))
+    _commit(staging_dir)
+    print(f"[refresh] nodes +{len(added_nodes)} / -{len(removed_nodes)}, "
+          f"cost={manifest['cost_seconds']:.2f}s, manifest -> {manifest_path}")
+    return manifest
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+    state_dir = os.path.join(out_dir, "release_state")
+
+    # Absolute path
+    old_meta_dir = "E:\\Data\\2024AB\\META"
+    new_meta_dir = "E:\\Data\\2025AA\\META"
+
+    # The state of the release the current outputs were built from is needed once
+    if not os.path.exists(os.path.join(state_dir, "release.json")):
+        snapshot_release(old_meta_dir, state_dir)
+    refresh(new_meta_dir, state_dir, out_dir, max_hops=7)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+This is a method to build a compact adjacency index of MRREL.RRF, so that n-hop BFS can run in memory
+instead of re-scanning the whole RRF file once per hop.
+
+The index directory contains:
+    cuis.txt       - one CUI per line, line number = integer CUI id
+    offsets.npy    - CSR offsets (int64, length = n_cuis + 1)
+    neighbors.npy  - CSR neighbor ids (int32), undirected, de-duplicated, no self loops
+    degrees.npy    - degree table (int32, number of distinct neighbors per CUI id)
+    source.json    - stage_cache.file_identity of the MRREL the index was built from (null = unknown)
+    rel_filter.json - the REL/RELA/SAB/SUPPRESS filter applied while building (null = all edges)
+"""
+
+import os
+import json
+import time
+import numpy as np
+
+from scripts.umls.chunk_extract_example import PD_CUI
+from scripts.umls.cui_intern import CUI_RANGE, cui_numbers
+from scripts.umls.rrf_parallel import scan_rrf
+from scripts.umls.rrf_reader import COL_REL, rel_filter_columns, rel_filter_mask
+from scripts.umls.stage_cache import file_identity
+from scripts.umls.stage_metrics import emit_event, finish_stage, observe, stage_metrics, timed
+
+CUIS_FILE = "cuis.txt"
+OFFSETS_FILE = "offsets.npy"
+NEIGHBORS_FILE = "neighbors.npy"
+REL_FILTER_FILE = "rel_filter.json"
+SOURCE_FILE = "source.json"
+DEGREES_FILE = "degrees.npy"
+
+# Hub pruning options of bfs_multi_seed / bfs_node_only, e.g. {"max_degree": 2000, "max_fanout": 500}:
+#   max_degree   - reached nodes with more neighbors are kept but not expanded (seeds always are)
+#   max_fanout   - at most this many new nodes per expanded node, lowest degree first (most specific)
+#   max_frontier - at most this many new nodes per hop, lowest degree first
+#   sab_priority - bfs_node_only only: SABs in order of preference, ranked before degree for max_fanout
+PRUNE_KEYS = ("max_degree", "max_fanout", "max_frontier", "sab_priority")
+
+
+def _edge_chunk(chunk, rel_filter):
+    # Per-chunk work of build_adjacency_index: the CUI1 / CUI2 columns of the rows rel_filter keeps
+    if rel_filter:
+        chunk = chunk[rel_filter_mask(chunk, rel_filter)]
+    return chunk[["CUI1", "CUI2"]]
+
+
+def build_adjacency_index(mrrel_path, index_dir, rel_filter=None):
+    """
+    Read MRREL only once and write the CSR adjacency index to index_dir.
+    Only CUI1/CUI2 (plus the columns rel_filter needs) are materialized; rows rejected by
+    rel_filter never become edges. CUIs get integer ids chunk by chunk as they are first seen.
+    Return: number of CUIs, number of (directed) neighbor entries
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    metrics = stage_metrics("build_adjacency_index", source=str(mrrel_path), rel_filter=rel_filter)
+
+    cui_to_id = {}
+    src_parts = []
+    dst_parts = []
+
+    for chunk in scan_rrf(mrrel_path, COL_REL, _edge_chunk, shared=rel_filter,
+                          usecols=["CUI1", "CUI2"] + rel_filter_columns(rel_filter), metrics=metrics):
+        with timed(metrics, "encode_s"):
+            src_parts.append(encode_cuis(chunk["CUI1"], cui_to_id))
+            dst_parts.append(encode_cuis(chunk["CUI2"], cui_to_id))
+        observe(metrics, rows_out=len(chunk))
+
+    n_cuis = len(cui_to_id)
+    src = np.concatenate(src_parts) if src_parts else np.empty(0, dtype=np.int32)
+    dst = np.concatenate(dst_parts) if dst_parts else np.empty(0, dtype=np.int32)
+    del src_parts, dst_parts
+
+    offsets, neighbors = edges_to_csr(src, dst, n_cuis)
+
+    with timed(metrics, "write_s"):
+        write_adjacency_index(index_dir, list(cui_to_id), offsets, neighbors, rel_filter, source=mrrel_path)
+
+    finish_stage(metrics, cuis=n_cuis, neighbor_entries=len(neighbors))
+    return n_cuis, len(neighbors)
+
+
+def write_adjacency_index(index_dir, cuis, offsets, neighbors, rel_filter=None, source=None):
+    """
+    Write an index (cuis in id order + CSR arrays) in the layout load_adjacency_index reads
+    :param source: the MRREL the index was built from, recorded for index_matches (None = not recorded)
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    # rel_filter.json marks a complete index (index_matches), so it is removed first and written last
+    if os.path.exists(os.path.join(index_dir, REL_FILTER_FILE)):
+        os.remove(os.path.join(index_dir, REL_FILTER_FILE))
+    with open(os.path.join(index_dir, CUIS_FILE), "w", encoding="utf-8") as fout:
+        for cui in cuis:
+            fout.write(cui + "\n")
+    np.save(os.path.join(index_dir, OFFSETS_FILE), offsets)
+    np.save(os.path.join(index_dir, NEIGHBORS_FILE), neighbors)
+    np.save(os.path.join(index_dir, DEGREES_FILE), np.diff(offsets).astype(np.int32))
+    with open(os.path.join(index_dir, SOURCE_FILE), "w", encoding="utf-8") as fout:
+        json.dump(None if source is None else file_identity(source), fout, sort_keys=True)
+    with open(os.path.join(index_dir, REL_FILTER_FILE), "w", encoding="utf-8") as fout:
+        json.dump(rel_filter, fout, sort_keys=True)
+
+
+def encode_cuis(series, cui_to_id):
+    """
+    Map a CUI column to int32 ids, registering CUIs not seen before in cui_to_id.
+    For categoricals only the categories are looked up, then the codes are translated.
+    """
+    series = series.astype("category")
+    categories = series.cat.categories
+    lookup = np.empty(len(categories), dtype=np.int32)
+    for pos, cui in enumerate(categories):
+        node = cui_to_id.get(cui)
+        if node is None:
+            node = cui_to_id[cui] = len(cui_to_id)
+        lookup[pos] = node
+    return lookup[series.cat.codes.to_numpy()]
+
+
+def edges_to_csr(src, dst, n_nodes):
+    """
+    Turn an (src, dst) integer edge list into an undirected CSR structure.
+    Both directions are stored, duplicates and self loops are removed.
+    Return: offsets (int64, n_nodes + 1), neighbors (int32)
+    """
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    both_src = np.concatenate([src, dst]).astype(np.int64)
+    both_dst = np.concatenate([dst, src]).astype(np.int64)
+
+    # Sort by (src, dst) through a single int64 key, then drop repeated pairs
+    keys = np.unique(both_src * n_nodes + both_dst)
+    rows = keys // n_nodes
+    neighbors = (keys % n_nodes).astype(np.int32)
+
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=offsets[1:])
+    return offsets, neighbors
+
+
+def index_matches(index_dir, rel_filter=None, mrrel_path=None):
+    """
+    True if index_dir holds a complete index built with the same rel_filter
+    (and, if mrrel_path is given, from a file with the same identity as mrrel_path, see stage_cache.file_identity)
+    """
+    filter_path = os.path.join(index_dir, REL_FILTER_FILE)
+    if not (os.path.exists(filter_path) and os.path.exists(os.path.join(index_dir, NEIGHBORS_FILE))):
+        return False
+    with open(filter_path, "r", encoding="utf-8") as fin:
+        if json.load(fin) != json.loads(json.dumps(rel_filter)):
+            return False
+    if mrrel_path is None:
+        return True
+    source_path = os.path.join(index_dir, SOURCE_FILE)
+    if not os.path.exists(source_path):
+        # Index written before the source was recorded
+        return False
+    with open(source_path, "r", encoding="utf-8") as fin:
+        return json.load(fin) == json.loads(json.dumps(file_identity(mrrel_path)))
+
+
+def load_adjacency_index(index_dir):
+    """
+    Open the index written by build_adjacency_index.
+    offsets/neighbors are memory-mapped, so opening is cheap and pages are shared between processes.
+    Return: dict with keys cuis (list), cui_to_id (dict), offsets, neighbors, degrees
+    """
+    with open(os.path.join(index_dir, CUIS_FILE), "r", encoding="utf-8") as fin:
+        cuis = [line.rstrip("\n") for line in fin]
+    offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+    neighbors = np.load(os.path.join(index_dir, NEIGHBORS_FILE), mmap_mode="r")
+    degrees_path = os.path.join(index_dir, DEGREES_FILE)
+    # Indexes written before the degree table existed
+    degrees = np.load(degrees_path, mmap_mode="r") if os.path.exists(degrees_path) else np.diff(offsets).astype(np.int32)
+    return {
+        "cuis": cuis,
+        "cui_to_id": {c: i for i, c in enumerate(cuis)},
+        "offsets": offsets,
+        "neighbors": neighbors,
+        "degrees": degrees,
+    }
+
+
+def degree_table(index):
+    """
+    Return: int32 degree per CUI id (CUI number, see cui_intern) over the whole CUI range, 0 for CUIs
+    without edges, for bfs_node_only(prune=..., degree_table=...)
+    """
+    table = np.zeros(CUI_RANGE, dtype=np.int32)
+    numbers = cui_numbers(index["cuis"])
+    valid = (numbers >= 0) & (numbers < CUI_RANGE)
+    table[numbers[valid]] = np.asarray(index["degrees"])[valid]
+    return table
+
+
+def check_prune(prune):
+    unknown = set(prune or {}) - set(PRUNE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown prune options: {sorted(unknown)} (expected {PRUNE_KEYS})")
+    return prune or {}
+
+
+def _cui_order(index, nodes):
+    # Tie-break key that follows CUI order (ids follow first appearance in MRREL), same as bfs_node_only
+    return cui_numbers([index["cuis"][i] for i in nodes])
+
+
+def _cap_fanout(index, candidates, source, degrees, max_fanout):
+    # Keep the max_fanout lowest-degree candidates of every source node
+    order = np.lexsort((_cui_order(index, candidates), degrees[candidates], source))
+    candidates, source = candidates[order], source[order]
+    group_start = np.flatnonzero(np.r_[True, source[1:] != source[:-1]])
+    rank = np.arange(len(source)) - np.repeat(group_start, np.diff(np.r_[group_start, len(source)]))
+    keep = rank < max_fanout
+    return candidates[keep], source[keep]
+
+
+def _cap_frontier(index, nodes, degrees, max_frontier):
+    # Keep the max_frontier lowest-degree nodes (ties in CUI order), in id order
+    if len(nodes) <= max_frontier:
+        return nodes
+    order = np.lexsort((_cui_order(index, nodes), degrees[nodes]))
+    return np.sort(nodes[order[:max_frontier]])
+
+
+def gather_neighbors(offsets, neighbors, nodes, return_source=False):
+    """
+    Concatenate the CSR neighbor lists of all ids in nodes (vectorized, no Python loop per node).
+    With return_source=True also return, for every neighbor, the position in nodes it was reached from.
+    """
+    starts = offsets[nodes]
+    lengths = offsets[nodes + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int32)
+        return (empty, np.empty(0, dtype=np.int64)) if return_source else empty
+    # Position of every output element inside the flat neighbors array
+    shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    result = neighbors[np.arange(total, dtype=np.int64) + shift]
+    if return_source:
+        return result, np.repeat(np.arange(len(nodes), dtype=np.int64), lengths)
+    return result
+
+
+def bfs_multi_seed(index, seed_cuis, max_hops=5, prune=None, prune_stats=None):
+    """
+    Expand all seed CUIs together in one frontier pass over the index.
+    Every node keeps the minimum hop distance to any seed, and the seed it was first reached from
+    (ties at the same hop go to the seed listed first).
+    prune (see PRUNE_KEYS) limits hub expansion using the degree table; prune_stats, if a list, receives
+    one dict per hop with the number of hubs not expanded and of nodes cut by max_fanout / max_frontier.
+    Return:
+        hops:  int8 array over index ids, -1 = not reached, 0 = seed
+        seeds: int16 array over index ids, position in seed_cuis, -1 = not reached
+    """
+    prune = check_prune(prune)
+    metrics = stage_metrics("bfs_multi_seed", seeds=len(seed_cuis), max_hops=max_hops)
+    cui_to_id = index["cui_to_id"]
+    offsets = index["offsets"]
+    neighbors = index["neighbors"]
+    degrees = np.asarray(index["degrees"])
+    n_nodes = len(offsets) - 1
+
+    hops = np.full(n_nodes, -1, dtype=np.int8)
+    seeds = np.full(n_nodes, -1, dtype=np.int16)
+
+    frontier = []
+    for seed_idx, cui in enumerate(seed_cuis):
+        node = cui_to_id.get(cui.upper())
+        if node is None:
+            emit_event(metrics, "seed_not_found", cui=cui)
+            continue
+        if hops[node] < 0:
+            hops[node] = 0
+            seeds[node] = seed_idx
+            frontier.append(node)
+    frontier = np.array(frontier, dtype=np.int64)
+
+    for hop in range(1, max_hops + 1):
+        if len(frontier) == 0:
+            # frontier empty, stop early
+            break
+        start_t = time.time()
+        frontier_size = len(frontier)
+        stats = {"hop": hop, "hubs_not_expanded": 0, "fanout_pruned": 0, "frontier_pruned": 0}
+
+        if "max_degree" in prune and hop > 1:
+            hub = degrees[frontier] > prune["max_degree"]
+            stats["hubs_not_expanded"] = int(hub.sum())
+            frontier = frontier[~hub]
+        candidates, source = gather_neighbors(offsets, neighbors, frontier, return_source=True)
+        observe(metrics, rows_in=len(candidates))
+        keep = hops[candidates] < 0
+        candidates, source = candidates[keep], source[keep]
+        if "max_fanout" in prune:
+            reachable = len(np.unique(candidates))
+            candidates, source = _cap_fanout(index, candidates, source, degrees, prune["max_fanout"])
+            stats["fanout_pruned"] = reachable - len(np.unique(candidates))
+        cand_seeds = seeds[frontier[source]]
+
+        # Sort by (node, seed) and keep the first row of each node -> smallest seed index wins
+        order = np.lexsort((cand_seeds, candidates))
+        candidates, cand_seeds = candidates[order], cand_seeds[order]
+        first = np.ones(len(candidates), dtype=bool)
+        first[1:] = candidates[1:] != candidates[:-1]
+        newly_found = candidates[first].astype(np.int64)
+        new_seeds = cand_seeds[first]
+
+        if "max_frontier" in prune:
+            capped = _cap_frontier(index, newly_found, degrees, prune["max_frontier"])
+            stats["frontier_pruned"] = len(newly_found) - len(capped)
+            new_seeds = new_seeds[np.searchsorted(newly_found, capped)]
+            newly_found = capped
+
+        hops[newly_found] = hop
+        seeds[newly_found] = new_seeds
+        frontier = newly_found
+        observe(metrics, rows_out=len(newly_found))
+        pruned = {} if not prune else {key: value for key, value in stats.items() if key != "hop"}
+        emit_event(metrics, "hop", hop=hop, frontier_size=frontier_size, newly_found=len(newly_found),
+                   all_cuis=int((hops >= 0).sum()), hop_s=time.time() - start_t, **pruned)
+        if prune_stats is not None:
+            prune_stats.append(stats)
+
+    finish_stage(metrics, all_cuis=int((hops >= 0).sum()))
+    return hops, seeds
+
+
+def bfs_index(index, start_cui, max_hops=5):
+    """
+    Same result as bfs_node_only, but on the in-memory adjacency index.
+    Return: all_cuis (set of CUIs reachable within max_hops, start_cui included)
+    """
+    if start_cui.upper() not in index["cui_to_id"]:
+        print(f"[bfs_index] {start_cui} not found in index")
+        return {start_cui.upper()}
+    hops, _ = bfs_multi_seed(index, [start_cui], max_hops=max_hops)
+    cuis = index["cuis"]
+    return {cuis[i] for i in np.flatnonzero(hops >= 0)}
+
+
+def write_bfs_result(index, seed_cuis, hops, seeds, out_cui_txt):
+    """
+    Write the reached CUIs (sorted, one per line) to out_cui_txt, and next to it:
+        <name>_hops.npy   - int8 min hop distance, aligned with the lines of out_cui_txt
+        <name>_seeds.npy  - int16 originating seed, aligned with the lines of out_cui_txt
+        <name>_seeds.txt  - the seed CUIs, line number = value in <name>_seeds.npy
+    """
+    cuis = index["cuis"]
+    reached = np.flatnonzero(hops >= 0)
+    reached = reached[np.argsort([cuis[i] for i in reached], kind="stable")]
+
+    with open(out_cui_txt, "w", encoding="utf-8") as fout:
+        for i in reached:
+            fout.write(cuis[i] + "\n")
+
+    stem = os.path.splitext(out_cui_txt)[0]
+    np.save(stem + "_hops.npy", hops[reached])
+    np.save(stem + "_seeds.npy", seeds[reached])
+    with open(stem + "_seeds.txt", "w", encoding="utf-8") as fout:
+        for cui in seed_cuis:
+            fout.write(cui + "\n")
+    print(f"[write_bfs_result] {len(reached)} CUIs -> {out_cui_txt} (+ _hops.npy, _seeds.npy, _seeds.txt)")
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    index_dir = os.path.join(base_dir, "data", "umls_output", "mrrel_index")
+
+    # Absolute path
+    mrrel_path = "E:\\Data\\2024AB\\META\\MRREL.RRF"
+
+    build_adjacency_index(mrrel_path, index_dir)
+    index = load_adjacency_index(index_dir)
+    print(f"[main] Index ready, PD 1-hop neighbors: {len(bfs_index(index, PD_CUI, max_hops=1)) - 1}")
+
+
+if __name__ == "__main__":
+    main()
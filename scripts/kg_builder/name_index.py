@@ -0,0 +1,575 @@
+"""
+Inverted name index over MRCONSO: term -> CUIs, for seed selection and entity linking without a table scan.
+
+Every atom string is normalized (normalize_term: accents stripped, lower-cased, "'s" dropped, runs of
+punctuation / whitespace -> one space) and indexed twice: as a whole string and by its tokens.
+A posting is a CUI plus the best preference rank of its atoms with that string / token (lower is better,
+see atom_rank: TTY, then SAB, then ISPREF / TS). Token postings are per CUI, so intersecting them also
+finds CUIs whose tokens are spread over different atoms; a multi-token query checks its candidates
+against their own atom strings (the atom tables below) before ranking them.
+
+The index directory contains, for <dict> in "strings" and "tokens":
+    <dict>_terms.bin            utf-8 terms back to back, sorted bytewise (prefix = contiguous range)
+    <dict>_term_offsets.npy     int64 [n + 1], term i = terms.bin[off[i]:off[i + 1]]
+    <dict>_postings.bin         CUI numbers per term, ascending, as gaps to the previous one (first gap = 0)
+                                in the smallest of 1 / 2 / 4 bytes that holds the term's largest gap
+    <dict>_posting_offsets.npy  int64 [n + 1], byte range of term i in postings.bin
+    <dict>_widths.npy           uint8 bytes per gap of term i
+    <dict>_skips.npy            int32 CUI number at every POSTING_BLOCK-th posting (the first one included)
+    <dict>_skip_offsets.npy     int64 [n + 1], skip range of term i
+    <dict>_ranks.npy            uint8 preference rank per posting
+    <dict>_rank_offsets.npy     int64 [n + 1], posting range of term i (= number of CUIs per term)
+and the atom tables:
+    atoms_cuis.npy              int32 CUI number per distinct (CUI, string) atom, ascending
+    atoms_strings.npy           int32 "strings" term id of the atom
+    atoms_ranks.npy             uint8 best preference rank of the CUI's atoms with that string
+    string_tokens.npy           int32 "tokens" term ids of every string, string after string
+    string_token_offsets.npy    int64 [n_strings + 1], token range of string i
+    name_index.json             build parameters and sizes, written last
+Everything is memory-mapped on load; a lookup is a binary search over the terms plus a cumsum over the gaps.
+A long postings list that is intersected with a much shorter one is not decoded as a whole: the skips tell
+which blocks of POSTING_BLOCK postings can hold the short list's CUIs, and only those are decoded.
+"""
+
+import json
+import os
+import re
+import time
+import unicodedata
+import numpy as np
+import pandas as pd
+
+from scripts.umls.cui_intern import cui_numbers, cui_strings
+from scripts.umls.rrf_reader import COL_CONSO, read_rrf
+from scripts.umls.stage_cache import cached_stage, code_version
+
+META_FILE = "name_index.json"
+DICTIONARIES = ("strings", "tokens")
+ATOM_ARRAYS = ("atoms_cuis", "atoms_strings", "atoms_ranks", "string_tokens", "string_token_offsets")
+# Bumped when the layout changes; an index of another format is rebuilt
+FORMAT_VERSION = 2
+
+CHUNKSIZE = 1_000_000
+
+# Preference order of term types and sources; anything else ranks after the listed values
+TTY_PREFERENCE = ["PN", "PT", "MH", "FN", "SY", "ET"]
+SAB_PREFERENCE = ["MTH", "SNOMEDCT_US", "MSH", "NCI", "RXNORM", "HPO", "MDR"]
+
+# SUPPRESS values left out of the index (obsolete / suppressible / suppressed by editors)
+SUPPRESS_DENY = ["O", "E", "Y"]
+
+# A prefix query expands to at most this many tokens (the ones with the most CUIs)
+PREFIX_MAX_TERMS = 64
+
+MATCH_CLASSES = ("exact", "tokens", "prefix")
+
+# Gap widths in bytes and their little-endian dtypes
+GAP_DTYPES = {1: "<u1", 2: "<u2", 4: "<u4"}
+
+# Postings per skip entry; a list is probed by blocks instead of decoded when it is PROBE_RATIO times longer
+POSTING_BLOCK = 128
+PROBE_RATIO = 16
+
+# Multi-token candidates checked against their atoms per batch (doubled every round)
+ATOM_CHECK_BATCH = 256
+
+_POSSESSIVE = re.compile(r"(?<=\w)['’]s\b")
+_SEPARATORS = re.compile(r"[\W_]+")
+_COMBINING = re.compile("[\u0300-\u036f]")
+
+_CONSO_COLUMNS = ["CUI", "LAT", "TS", "ISPREF", "SAB", "TTY", "STR", "SUPPRESS"]
+
+
+def normalize_term(text):
+    """
+    Normalized form of a name: "Parkinson's Disease, NOS" -> "parkinson disease nos"
+    """
+    text = _COMBINING.sub("", unicodedata.normalize("NFKD", text)).lower()
+    return _SEPARATORS.sub(" ", _POSSESSIVE.sub("", text)).strip()
+
+
+def _normalize_series(strings):
+    # normalize_term for a whole column
+    strings = strings.fillna("").astype(str).str.normalize("NFKD").str.replace(_COMBINING, "", regex=True).str.lower()
+    return strings.str.replace(_POSSESSIVE, "", regex=True).str.replace(_SEPARATORS, " ", regex=True).str.strip()
+
+
+def atom_rank(chunk, tty_preference=TTY_PREFERENCE, sab_preference=SAB_PREFERENCE):
+    """
+    uint8 preference rank of MRCONSO rows (lower = better): TTY position, then SAB position, then ISPREF=Y,
+    then TS=P. Positions past 7 share the last slot.
+    """
+    def position(values, preference):
+        codes = pd.Categorical(values.astype(object), categories=list(preference)[:7]).codes.astype(np.int64)
+        return np.where(codes < 0, 7, codes)
+
+    rank = position(chunk["TTY"], tty_preference) * 32 + position(chunk["SAB"], sab_preference) * 4
+    rank += (chunk["ISPREF"].astype(object) != "Y").to_numpy(dtype=np.int64) * 2
+    rank += (chunk["TS"].astype(object) != "P").to_numpy(dtype=np.int64)
+    return rank.astype(np.uint8)
+
+
+def _conso_chunks(conso_path, chunksize):
+    # MRCONSO rows (CUI, LAT, TS, ISPREF, SAB, TTY, STR, SUPPRESS) from a filtered .csv with a header
+    # (pd_conso.csv / pd_nhop_conso.csv) or from MRCONSO itself (any read_rrf source)
+    if str(conso_path).endswith(".csv"):
+        yield from pd.read_csv(conso_path, sep="|", dtype=str, chunksize=chunksize,
+                               keep_default_na=False, usecols=_CONSO_COLUMNS)
+    else:
+        yield from read_rrf(conso_path, COL_CONSO, usecols=_CONSO_COLUMNS, chunksize=chunksize)
+
+
+def _intern(values, vocab):
+    # Global int ids of values, growing vocab (term -> id) with the unseen ones
+    codes, uniques = pd.factorize(values)
+    ids = np.fromiter((vocab.setdefault(term, len(vocab)) for term in uniques), dtype=np.int64, count=len(uniques))
+    return ids[codes]
+
+
+def _gap_widths(max_gaps):
+    return np.where(max_gaps < 1 << 8, 1, np.where(max_gaps < 1 << 16, 2, 4)).astype(np.uint8)
+
+
+def _ranges(starts, counts):
+    # Concatenated aranges [start, start + count)
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+def _write_dictionary(index_dir, name, vocab, term_ids, cuis, ranks):
+    # Sort terms bytewise, keep the best rank per (term, CUI), write the files of one dictionary
+    # Return: (sizes, new term id per vocab id)
+    terms = [term.encode("utf-8") for term in vocab]
+    term_order = sorted(range(len(terms)), key=terms.__getitem__)
+    terms = [terms[i] for i in term_order]
+    new_id = np.empty(len(terms), dtype=np.int64)
+    new_id[term_order] = np.arange(len(terms))
+    term_ids = new_id[term_ids]
+
+    order = np.lexsort((ranks, cuis, term_ids))
+    term_ids, cuis, ranks = term_ids[order], cuis[order], ranks[order]
+    first = np.ones(len(term_ids), dtype=bool)
+    first[1:] = (term_ids[1:] != term_ids[:-1]) | (cuis[1:] != cuis[:-1])
+    term_ids, cuis, ranks = term_ids[first], cuis[first], ranks[first]
+
+    counts = np.bincount(term_ids, minlength=len(terms))
+    rank_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(counts, out=rank_offsets[1:])
+    term_start = rank_offsets[:-1][counts > 0]
+    gaps = np.diff(cuis, prepend=0)
+    gaps[term_start] = 0
+    is_skip = (np.arange(len(cuis)) - rank_offsets[term_ids]) % POSTING_BLOCK == 0
+    skips = cuis[is_skip].astype(np.int32)
+    skip_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids[is_skip], minlength=len(terms)), out=skip_offsets[1:])
+    max_gaps = np.zeros(len(terms), dtype=np.int64)
+    np.maximum.at(max_gaps, term_ids, gaps)
+    widths = _gap_widths(max_gaps)
+    posting_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(counts * widths, out=posting_offsets[1:])
+    # Every term's gaps as bytes of its width, back to back
+    postings = np.empty(int(posting_offsets[-1]), dtype=np.uint8)
+    posting_widths = widths[term_ids]
+    for width, dtype in GAP_DTYPES.items():
+        has = posting_widths == width
+        if has.any():
+            chunk = gaps[has].astype(dtype).view(np.uint8).reshape(-1, width)
+            byte_start = posting_offsets[term_ids[has]] + (np.arange(len(gaps))[has] - rank_offsets[term_ids[has]]) * width
+            postings[byte_start[:, None] + np.arange(width)] = chunk
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in terms], out=term_offsets[1:])
+
+    with open(os.path.join(index_dir, f"{name}_terms.bin"), "wb") as fout:
+        fout.write(b"".join(terms))
+    postings.tofile(os.path.join(index_dir, f"{name}_postings.bin"))
+    np.save(os.path.join(index_dir, f"{name}_term_offsets.npy"), term_offsets)
+    np.save(os.path.join(index_dir, f"{name}_posting_offsets.npy"), posting_offsets)
+    np.save(os.path.join(index_dir, f"{name}_widths.npy"), widths)
+    np.save(os.path.join(index_dir, f"{name}_skips.npy"), skips)
+    np.save(os.path.join(index_dir, f"{name}_skip_offsets.npy"), skip_offsets)
+    np.save(os.path.join(index_dir, f"{name}_ranks.npy"), ranks.astype(np.uint8))
+    np.save(os.path.join(index_dir, f"{name}_rank_offsets.npy"), rank_offsets)
+    return {"terms": len(terms), "postings": int(len(cuis)), "postings_bytes": int(len(postings))}, new_id
+
+
+def _write_atoms(index_dir, string_ids, cuis, ranks):
+    # atoms_*.npy: distinct (CUI, string) pairs by CUI, with the best rank of their atoms
+    order = np.lexsort((ranks, string_ids, cuis))
+    string_ids, cuis, ranks = string_ids[order], cuis[order], ranks[order]
+    first = np.ones(len(cuis), dtype=bool)
+    first[1:] = (cuis[1:] != cuis[:-1]) | (string_ids[1:] != string_ids[:-1])
+    np.save(os.path.join(index_dir, "atoms_cuis.npy"), cuis[first].astype(np.int32))
+    np.save(os.path.join(index_dir, "atoms_strings.npy"), string_ids[first].astype(np.int32))
+    np.save(os.path.join(index_dir, "atoms_ranks.npy"), ranks[first].astype(np.uint8))
+    return int(first.sum())
+
+
+def _write_string_tokens(index_dir, string_ids, token_ids, n_strings):
+    # string_tokens.npy / string_token_offsets.npy: the token ids of every string (term ids after sorting)
+    order = np.argsort(string_ids, kind="stable")
+    offsets = np.zeros(n_strings + 1, dtype=np.int64)
+    np.cumsum(np.bincount(string_ids, minlength=n_strings), out=offsets[1:])
+    np.save(os.path.join(index_dir, "string_tokens.npy"), token_ids[order].astype(np.int32))
+    np.save(os.path.join(index_dir, "string_token_offsets.npy"), offsets)
+
+
+def build_name_index(conso_path, index_dir, lat="ENG", suppress_deny=SUPPRESS_DENY,
+                     tty_preference=TTY_PREFERENCE, sab_preference=SAB_PREFERENCE, chunksize=CHUNKSIZE):
+    """
+    Write the inverted name index of a MRCONSO file (MRCONSO.RRF or a filtered conso .csv) to index_dir.
+    :param lat: language of the atoms to index (None = all)
+    :param suppress_deny: SUPPRESS values that are left out
+    Return: dict with the number of atoms and the terms / postings of both dictionaries
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    meta_path = os.path.join(index_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    start_time = time.time()
+
+    vocabs = {name: {} for name in DICTIONARIES}
+    parts = {name: [] for name in DICTIONARIES}
+    # (string id, token id) pairs of every string, collected when the string is first seen
+    string_token_parts = []
+    n_atoms = 0
+    for chunk in _conso_chunks(conso_path, chunksize):
+        keep = np.ones(len(chunk), dtype=bool)
+        if lat is not None:
+            keep &= (chunk["LAT"].astype(object) == lat).to_numpy()
+        if suppress_deny:
+            keep &= ~chunk["SUPPRESS"].astype(object).isin(suppress_deny).to_numpy()
+        chunk = chunk[keep]
+        strings = _normalize_series(chunk["STR"])
+        cuis = cui_numbers(chunk["CUI"].astype(object))
+        valid = (cuis >= 0) & (strings != "").to_numpy()
+        strings, cuis = strings[valid], cuis[valid]
+        ranks = atom_rank(chunk[valid], tty_preference, sab_preference)
+        n_atoms += len(cuis)
+
+        if not len(cuis):
+            continue
+        # int32 ids and CUIs until the final sort, a full MRCONSO has tens of millions of tokens
+        cuis = cuis.astype(np.int32)
+        n_known = len(vocabs["strings"])
+        string_ids = _intern(strings.to_numpy(), vocabs["strings"]).astype(np.int32)
+        parts["strings"].append((string_ids, cuis, ranks))
+        # Normalized strings are single-space separated, explode keeps the row order
+        n_tokens = (strings.str.count(" ") + 1).to_numpy()
+        tokens = strings.str.split(" ").explode().to_numpy()
+        token_ids = _intern(tokens, vocabs["tokens"]).astype(np.int32)
+        parts["tokens"].append((token_ids, np.repeat(cuis, n_tokens), np.repeat(ranks, n_tokens)))
+        unique_ids, first_rows = np.unique(string_ids, return_index=True)
+        token_rows = np.repeat(np.arange(len(string_ids)), n_tokens)
+        new_tokens = np.isin(token_rows, first_rows[unique_ids >= n_known])
+        string_token_parts.append((string_ids[token_rows[new_tokens]], token_ids[new_tokens]))
+
+    result = {"atoms": n_atoms}
+    new_ids = {}
+    for name in DICTIONARIES:
+        term_ids, cuis, ranks = [np.concatenate([part[i] for part in parts[name]]) if parts[name]
+                                 else np.array([], dtype=np.int64) for i in range(3)]
+        result[name], new_ids[name] = _write_dictionary(index_dir, name, list(vocabs[name]),
+                                                        term_ids.astype(np.int64), cuis.astype(np.int64),
+                                                        ranks.astype(np.uint8))
+        if name == "strings":
+            result["distinct_atoms"] = _write_atoms(index_dir, new_ids[name][term_ids.astype(np.int64)],
+                                                    cuis.astype(np.int64), ranks.astype(np.uint8))
+        # Free the build arrays before the next dictionary
+        parts[name] = vocabs[name] = None
+
+    string_ids, token_ids = [np.concatenate([part[i] for part in string_token_parts]) if string_token_parts
+                             else np.array([], dtype=np.int64) for i in range(2)]
+    _write_string_tokens(index_dir, new_ids["strings"][string_ids.astype(np.int64)],
+                         new_ids["tokens"][token_ids.astype(np.int64)], result["strings"]["terms"])
+
+    with open(meta_path, "w", encoding="utf-8") as fout:
+        json.dump({**result, "format": FORMAT_VERSION, "source": str(conso_path), "lat": lat,
+                   "suppress_deny": suppress_deny, "tty_preference": tty_preference,
+                   "sab_preference": sab_preference}, fout, indent=1)
+    print(f"[build_name_index] atoms={n_atoms}, strings={result['strings']['terms']}, "
+          f"tokens={result['tokens']['terms']}, cost={time.time() - start_time:.2f}s -> {index_dir}")
+    return result
+
+
+def name_index_matches(index_dir):
+    """
+    True if index_dir holds a complete name index of the current format
+    """
+    meta_path = os.path.join(index_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as fin:
+        return json.load(fin).get("format") == FORMAT_VERSION
+
+
+def load_name_index(index_dir):
+    """
+    Open a name index; all arrays and term blobs are memory-mapped (as plain ndarray views, indexing a
+    np.memmap costs more than the binary search itself).
+    Return: {"strings": {...}, "tokens": {...}, "atoms": {...}, "meta": name_index.json}
+    """
+    if not name_index_matches(index_dir):
+        raise FileNotFoundError(f"No complete name index (format {FORMAT_VERSION}) in {index_dir}")
+    index = {}
+    with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as fin:
+        index["meta"] = json.load(fin)
+    for name in DICTIONARIES:
+        blobs = {}
+        for blob in ("terms", "postings"):
+            path = os.path.join(index_dir, f"{name}_{blob}.bin")
+            blobs[blob] = (np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray) if os.path.getsize(path)
+                           else np.empty(0, dtype=np.uint8))
+        index[name] = {
+            **blobs,
+            **{key: np.load(os.path.join(index_dir, f"{name}_{key}.npy"), mmap_mode="r").view(np.ndarray)
+               for key in ("term_offsets", "posting_offsets", "widths", "skips", "skip_offsets", "ranks",
+                           "rank_offsets")},
+        }
+    index["atoms"] = {key: np.load(os.path.join(index_dir, f"{key}.npy"), mmap_mode="r").view(np.ndarray)
+                      for key in ATOM_ARRAYS}
+    return index
+
+
+def _term(dictionary, i):
+    offsets = dictionary["term_offsets"]
+    return dictionary["terms"][offsets[i]:offsets[i + 1]].tobytes()
+
+
+def _bisect(dictionary, key):
+    # First term >= key (bytewise)
+    lo, hi = 0, len(dictionary["term_offsets"]) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _term(dictionary, mid) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def term_range(dictionary, term, prefix=False):
+    """
+    Range [start, end) of the term ids equal to term (0 or 1 of them), or starting with it if prefix
+    """
+    key = term.encode("utf-8")
+    start = _bisect(dictionary, key)
+    if prefix:
+        # 0xFF never occurs in utf-8, so it sorts after every continuation of key
+        return start, _bisect(dictionary, key + b"\xff")
+    n_terms = len(dictionary["term_offsets"]) - 1
+    return start, start + (start < n_terms and _term(dictionary, start) == key)
+
+
+def term_count(dictionary, term_id):
+    """
+    Number of CUIs of a term id
+    """
+    return int(dictionary["rank_offsets"][term_id + 1] - dictionary["rank_offsets"][term_id])
+
+
+def _gaps(dictionary, term_id):
+    start, end = dictionary["posting_offsets"][term_id], dictionary["posting_offsets"][term_id + 1]
+    return dictionary["postings"][start:end].view(GAP_DTYPES[int(dictionary["widths"][term_id])])
+
+
+def term_postings(dictionary, term_id):
+    """
+    Return: (ascending int64 CUI numbers, uint8 ranks) of a term id
+    """
+    cuis = np.cumsum(_gaps(dictionary, term_id), dtype=np.int64)
+    cuis += dictionary["skips"][dictionary["skip_offsets"][term_id]]
+    start, end = dictionary["rank_offsets"][term_id], dictionary["rank_offsets"][term_id + 1]
+    return cuis, dictionary["ranks"][start:end]
+
+
+def _probe(dictionary, term_id, cuis, ranks):
+    # _intersect of (cuis, ranks) with the postings of term_id, decoding only the blocks cuis can fall in
+    skips = dictionary["skips"][dictionary["skip_offsets"][term_id]:dictionary["skip_offsets"][term_id + 1]]
+    blocks = np.searchsorted(skips, cuis, side="right") - 1
+    cuis, ranks, blocks = cuis[blocks >= 0], ranks[blocks >= 0], blocks[blocks >= 0]
+    needed, row = np.unique(blocks, return_inverse=True)
+    # One row of POSTING_BLOCK decoded CUIs per needed block; past the end of the list -> -1
+    count = term_count(dictionary, term_id)
+    pos = needed[:, None] * POSTING_BLOCK + np.arange(POSTING_BLOCK)
+    decoded = _gaps(dictionary, term_id)[np.minimum(pos, count - 1)].astype(np.int64)
+    decoded[:, 0] = skips[needed]
+    decoded = np.cumsum(decoded, axis=1)
+    decoded[pos >= count] = -1
+    hit = decoded[row] == cuis[:, None]
+    found = hit.any(axis=1)
+    other_ranks = dictionary["ranks"][dictionary["rank_offsets"][term_id] + pos[row, hit.argmax(axis=1)][found]]
+    return cuis[found], np.maximum(ranks[found], other_ranks)
+
+
+def _best_per_cui(cuis, ranks):
+    # Sorted unique CUIs with their lowest rank
+    keys = np.sort(cuis.astype(np.int64) << 8 | ranks)
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] >> 8) != (keys[:-1] >> 8)
+    return keys[first] >> 8, (keys[first] & 0xFF).astype(np.uint8)
+
+
+def _intersect(cuis, ranks, other_cuis, other_ranks):
+    # CUIs in both sorted arrays (cuis the shorter one), with the worse of their two ranks
+    if len(cuis) * PROBE_RATIO < len(other_cuis):
+        pos = np.searchsorted(other_cuis, cuis)
+        pos[pos == len(other_cuis)] = 0
+        both = other_cuis[pos] == cuis
+        return cuis[both], np.maximum(ranks[both], other_ranks[pos[both]])
+    # Similar lengths: a stable sort of the two sorted runs is a linear merge; a CUI in both is a neighbor pair
+    keys = np.concatenate([cuis << 8 | ranks, other_cuis << 8 | other_ranks])
+    keys.sort(kind="stable")
+    pair = np.flatnonzero((keys[1:] >> 8) == (keys[:-1] >> 8))
+    return keys[pair] >> 8, np.maximum(keys[pair] & 0xFF, keys[pair + 1] & 0xFF).astype(np.uint8)
+
+
+def _token_terms(dictionary, token, prefix):
+    # Term ids a query token stands for
+    start, end = term_range(dictionary, token, prefix=prefix)
+    if end - start > PREFIX_MAX_TERMS:
+        # Expand a short prefix only to its most frequent tokens, plus the prefix itself if it is a token
+        # (it sorts first), so an exact match is always among the token matches
+        counts = np.diff(dictionary["rank_offsets"][start:end + 1])
+        top = np.argpartition(-counts, PREFIX_MAX_TERMS)[:PREFIX_MAX_TERMS]
+        return (start + np.union1d(top, [0])).tolist()
+    return list(range(start, end))
+
+
+def _union_postings(dictionary, term_ids):
+    postings = [term_postings(dictionary, term_id) for term_id in term_ids]
+    if len(postings) == 1:
+        return postings[0]
+    if not postings:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+    return _best_per_cui(np.concatenate([p[0] for p in postings]), np.concatenate([p[1] for p in postings]))
+
+
+def _check_atoms(index, cuis, term_ids):
+    # CUIs with one atom string that holds a token of every group in term_ids, with the best rank of such an atom
+    atoms = index["atoms"]
+    keys = cuis.astype(np.int32)
+    start = np.searchsorted(atoms["atoms_cuis"], keys, side="left")
+    counts = np.searchsorted(atoms["atoms_cuis"], keys, side="right") - start
+    rows = _ranges(start, counts)
+    strings = atoms["atoms_strings"][rows]
+    token_offsets = atoms["string_token_offsets"]
+    n_tokens = token_offsets[strings + 1] - token_offsets[strings]
+    tokens = atoms["string_tokens"][_ranges(token_offsets[strings], n_tokens)]
+    owner = np.repeat(np.arange(len(rows)), n_tokens)
+    holds_all = np.ones(len(rows), dtype=bool)
+    for ids in term_ids:
+        holds_all &= np.bincount(owner[np.isin(tokens, ids)], minlength=len(rows)) > 0
+    return _best_per_cui(np.repeat(cuis, counts)[holds_all], atoms["atoms_ranks"][rows][holds_all])
+
+
+def _atom_matches(index, cuis, bounds, term_ids, limit):
+    """
+    Candidates of the per-CUI token intersection that have one atom holding every token group of term_ids,
+    with the rank of their best such atom. A candidate's intersection rank (bounds) is a lower bound of that
+    rank, so candidates are checked best bound first in growing batches, until no unchecked one can make
+    the best limit.
+    Return: (CUIs, ranks) of the matches found, a superset of the best limit
+    """
+    if limit <= 0 or not len(cuis):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+    order = np.lexsort((cuis, bounds))
+    cuis, bounds = cuis[order], np.asarray(bounds, dtype=np.int64)[order]
+    found_cuis, found_ranks = [], []
+    start, batch = 0, max(limit, ATOM_CHECK_BATCH)
+    while start < len(cuis):
+        matched_cuis, matched_ranks = _check_atoms(index, cuis[start:start + batch], term_ids)
+        found_cuis.append(matched_cuis)
+        found_ranks.append(matched_ranks)
+        start, batch = start + batch, batch * 2
+        found = np.concatenate(found_ranks).astype(np.int64) << 32 | np.concatenate(found_cuis)
+        if start < len(cuis) and len(found) >= limit and \
+                np.partition(found, limit - 1)[limit - 1] < (bounds[start] << 32 | cuis[start]):
+            break
+    return np.concatenate(found_cuis), np.concatenate(found_ranks)
+
+
+def search(index, query, limit=10, prefix=False):
+    """
+    CUIs for a name, best first: exact (normalized) string matches, then CUIs with one atom containing every
+    token of query, each group ordered by the preference rank (atom_rank) of the best such atom, then CUI.
+    :param prefix: treat the last token as a prefix (type-ahead), e.g. "parkinson dis"
+    Return: list of {"cui", "match" ("exact" / "tokens" / "prefix"), "rank"}
+    """
+    text = normalize_term(query)
+    if not text:
+        return []
+    tokens_dict = index["tokens"]
+
+    tokens = text.split(" ")
+    term_ids = [_token_terms(tokens_dict, token, prefix and i == len(tokens) - 1) for i, token in enumerate(tokens)]
+    # Rarest token first, so the candidate list is as short as possible from the start
+    term_ids.sort(key=lambda ids: sum(term_count(tokens_dict, term_id) for term_id in ids))
+    cuis, ranks = _union_postings(tokens_dict, term_ids[0])
+    for ids in term_ids[1:]:
+        if len(ids) == 1 and term_count(tokens_dict, ids[0]) > PROBE_RATIO * len(cuis):
+            cuis, ranks = _probe(tokens_dict, ids[0], cuis, ranks)
+        else:
+            cuis, ranks = _intersect(cuis, ranks, *_union_postings(tokens_dict, ids))
+
+    # Every exact match is also a token match; it moves up to class 0 with its exact-string rank
+    start, end = term_range(index["strings"], text)
+    exact_cuis, exact_ranks = (term_postings(index["strings"], start) if end > start
+                               else (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)))
+    # The exact CUIs are among the (ascending) candidates
+    others = np.ones(len(cuis), dtype=bool)
+    others[np.searchsorted(cuis, exact_cuis)] = False
+    cuis, ranks = cuis[others], ranks[others]
+    if len(term_ids) > 1:
+        # Token postings are per CUI: keep the candidates with one atom that holds every token
+        cuis, ranks = _atom_matches(index, cuis, ranks, term_ids, limit - len(exact_cuis))
+    classes = np.concatenate([np.zeros(len(exact_cuis), dtype=np.int64),
+                              np.full(len(cuis), 2 if prefix else 1, dtype=np.int64)])
+    cuis = np.concatenate([exact_cuis, cuis])
+    ranks = np.concatenate([exact_ranks, ranks])
+
+    # (class, rank, CUI) packed into one sortable key; only the best limit keys are sorted
+    keys = classes << 40 | np.asarray(ranks, dtype=np.int64) << 32 | cuis
+    if len(keys) > limit:
+        keys = np.partition(keys, limit - 1)[:limit]
+    keys = np.sort(keys)
+    return [{"cui": cui, "match": MATCH_CLASSES[match], "rank": rank}
+            for cui, match, rank in zip(cui_strings(keys & 0xFFFFFFFF), (keys >> 40).tolist(),
+                                        ((keys >> 32) & 0xFF).tolist())]
+
+
+def seed_cuis(index, names, per_name=1):
+    """
+    Seed CUIs for a list of concept names (the best per_name search results of each), in order, de-duplicated
+    """
+    seeds = []
+    for name in names:
+        hits = search(index, name, limit=per_name)
+        if not hits:
+            print(f"[seed_cuis] No CUI found for {name!r}")
+        for hit in hits:
+            if hit["cui"] not in seeds:
+                seeds.append(hit["cui"])
+    return seeds
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+
+    # Absolute path
+    mrconso_path = "E:\\Data\\2024AB\\META\\MRCONSO.RRF"
+    index_dir = os.path.join(out_dir, "name_index")
+
+    # Skipped when MRCONSO and the code are unchanged (see stage_cache)
+    cached_stage("name_index", lambda: build_name_index(mrconso_path, index_dir), inputs=[mrconso_path],
+                 outputs=[index_dir], code=code_version(build_name_index))
+
+    index = load_name_index(index_dir)
+    for query, prefix in [("Parkinson's disease", False), ("parkinson dis", True), ("levodopa", False)]:
+        start_time = time.perf_counter()
+        hits = search(index, query, limit=5, prefix=prefix)
+        print(f"[main] {query!r}: {hits} ({(time.perf_counter() - start_time) * 1000:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
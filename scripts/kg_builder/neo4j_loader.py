@@ -0,0 +1,224 @@
+"""
+This is a method to bulk load the PD subgraph into Neo4j.
+
+Nodes (:Concept {cui, name, semantic_types, tuis}) come from the CONSO/STY csv files, edges
+(:RELATED {rel, rela, sab, rui}) from the de-duplicated REL csv (pd_nhop_rel_dedup.csv, one edge per
+inverse twin pair). Two modes:
+    - online:  sized UNWIND batches sent by parallel sessions over one pooled driver,
+               after the uniqueness constraint / indexes exist. Nodes are merged on cui and
+               relationships on rui, so rerunning after a partial failure adds nothing twice
+    - offline: nodes / relationships csv files for `neo4j-admin database import full`
+Any object with driver.session(database=...) -> context manager with execute_write(fn) works as driver,
+so the loader can run against a stub as well as a local Neo4j container.
+"""
+
+import csv
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import pandas as pd
+
+from scripts.kg_builder.concept_mapping import preferred_name_rows
+
+try:
+    from neo4j import GraphDatabase
+except ImportError:
+    GraphDatabase = None
+
+CHUNKSIZE = 100_000
+BATCH_SIZE = 10_000
+N_SESSIONS = 4
+
+NODE_LABEL = "Concept"
+REL_TYPE = "RELATED"
+
+SCHEMA_QUERIES = [
+    f"CREATE CONSTRAINT concept_cui IF NOT EXISTS FOR (c:{NODE_LABEL}) REQUIRE c.cui IS UNIQUE",
+    f"CREATE INDEX concept_name IF NOT EXISTS FOR (c:{NODE_LABEL}) ON (c.name)",
+    f"CREATE INDEX related_rela IF NOT EXISTS FOR ()-[r:{REL_TYPE}]-() ON (r.rela)",
+    f"CREATE INDEX related_rui IF NOT EXISTS FOR ()-[r:{REL_TYPE}]-() ON (r.rui)",
+]
+
+NODE_QUERY = f"""
+UNWIND $rows AS row
+MERGE (c:{NODE_LABEL} {{cui: row.cui}})
+SET c.name = row.name, c.semantic_types = row.semantic_types, c.tuis = row.tuis
+"""
+
+EDGE_QUERY = f"""
+UNWIND $rows AS row
+MATCH (a:{NODE_LABEL} {{cui: row.cui1}})
+MATCH (b:{NODE_LABEL} {{cui: row.cui2}})
+MERGE (a)-[r:{REL_TYPE} {{rui: row.rui}}]->(b)
+SET r.rel = row.rel, r.rela = row.rela, r.sab = row.sab
+"""
+
+
+def iter_nodes(conso_csv_path, sty_csv_path):
+    """
+    Yield one dict per CUI: {cui, name, semantic_types: [...], tuis: [...]}
+    """
+    names = preferred_name_rows(conso_csv_path, CHUNKSIZE).set_index("CUI")["STR"]
+    sty = pd.read_csv(sty_csv_path, sep="|", dtype=str,
+                      usecols=["CUI", "TUI", "STY"]).dropna(subset=["CUI"]).drop_duplicates()
+    sty_groups = sty.groupby("CUI", sort=True)
+    tuis = sty_groups["TUI"].agg(list)
+    sty_names = sty_groups["STY"].agg(list)
+
+    for cui in sorted(set(names.index) | set(tuis.index)):
+        yield {
+            "cui": cui,
+            "name": names.get(cui, ""),
+            "semantic_types": [s for s in sty_names.get(cui, []) if isinstance(s, str)],
+            "tuis": [t for t in tuis.get(cui, []) if isinstance(t, str)],
+        }
+
+
+def iter_edges(rel_csv_path):
+    """
+    Yield one dict per REL row: {cui1, cui2, rel, rela, sab, rui}, reading only those columns
+    """
+    columns = ["CUI1", "REL", "CUI2", "RELA", "RUI", "SAB"]
+    for chunk in pd.read_csv(rel_csv_path, sep="|", dtype=str, chunksize=CHUNKSIZE,
+                             usecols=columns, keep_default_na=False):
+        chunk = chunk[columns].rename(columns=str.lower)
+        yield from chunk.to_dict("records")
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def create_schema(driver, database=None):
+    """
+    Constraint and indexes first, so MERGE / MATCH on cui and MERGE on rui are index lookups
+    """
+    with driver.session(database=database) as session:
+        for query in SCHEMA_QUERIES:
+            session.execute_write(lambda tx, q=query: tx.run(q).consume())
+
+
+def write_batches(driver, query, rows, batch_size=BATCH_SIZE, n_sessions=N_SESSIONS, database=None):
+    """
+    Send rows as UNWIND batches of batch_size, n_sessions batches in flight at a time
+    (each in its own session / transaction, retried by execute_write on transient errors).
+    Return: number of rows written
+    """
+    in_flight = threading.BoundedSemaphore(n_sessions * 2)
+    written = 0
+    lock = threading.Lock()
+
+    def write_one(batch):
+        nonlocal written
+        try:
+            with driver.session(database=database) as session:
+                session.execute_write(lambda tx: tx.run(query, rows=batch).consume())
+            with lock:
+                written += len(batch)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+        futures = []
+        for batch in batched(rows, batch_size):
+            # Bound the number of queued batches so the input is streamed, not loaded at once
+            in_flight.acquire()
+            futures.append(pool.submit(write_one, batch))
+            # Forget finished batches, re-raising their errors early
+            for future in [f for f in futures if f.done()]:
+                future.result()
+            futures = [f for f in futures if not f.done()]
+        for future in futures:
+            future.result()
+    return written
+
+
+def load_subgraph(driver, conso_csv_path, sty_csv_path, rel_csv_path,
+                  batch_size=BATCH_SIZE, n_sessions=N_SESSIONS, database=None):
+    """
+    Online mode: schema, then nodes, then edges.
+    Return: (nodes_written, edges_written)
+    """
+    create_schema(driver, database=database)
+
+    start_t = time.time()
+    nodes = write_batches(driver, NODE_QUERY, iter_nodes(conso_csv_path, sty_csv_path),
+                          batch_size=batch_size, n_sessions=n_sessions, database=database)
+    print(f"[load_subgraph] nodes={nodes}, cost={time.time() - start_t:.2f}s")
+
+    start_t = time.time()
+    edges = write_batches(driver, EDGE_QUERY, iter_edges(rel_csv_path),
+                          batch_size=batch_size, n_sessions=n_sessions, database=database)
+    print(f"[load_subgraph] edges={edges}, cost={time.time() - start_t:.2f}s")
+    return nodes, edges
+
+
+def write_admin_import_csvs(conso_csv_path, sty_csv_path, rel_csv_path, out_dir):
+    """
+    Offline mode: write nodes.csv / relationships.csv for neo4j-admin import (array delimiter ";").
+    Return: (nodes_path, relationships_path)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    nodes_path = os.path.join(out_dir, "nodes.csv")
+    rels_path = os.path.join(out_dir, "relationships.csv")
+
+    nodes = 0
+    with open(nodes_path, "w", encoding="utf-8", newline="") as fout:
+        writer = csv.writer(fout)
+        writer.writerow([f"cui:ID({NODE_LABEL})", "name", "semantic_types:string[]", "tuis:string[]", ":LABEL"])
+        for node in iter_nodes(conso_csv_path, sty_csv_path):
+            writer.writerow([node["cui"], node["name"], ";".join(node["semantic_types"]),
+                             ";".join(node["tuis"]), NODE_LABEL])
+            nodes += 1
+
+    edges = 0
+    with open(rels_path, "w", encoding="utf-8", newline="") as fout:
+        writer = csv.writer(fout)
+        writer.writerow([f":START_ID({NODE_LABEL})", f":END_ID({NODE_LABEL})", ":TYPE", "rel", "rela", "sab", "rui"])
+        for edge in iter_edges(rel_csv_path):
+            writer.writerow([edge["cui1"], edge["cui2"], REL_TYPE, edge["rel"], edge["rela"], edge["sab"], edge["rui"]])
+            edges += 1
+
+    print(f"[write_admin_import_csvs] nodes={nodes}, edges={edges} -> {out_dir}")
+    print(f"   neo4j-admin database import full --nodes={nodes_path} --relationships={rels_path} "
+          f"--skip-bad-relationships neo4j")
+    return nodes_path, rels_path
+
+
+def connect(uri, user, password, n_sessions=N_SESSIONS):
+    if GraphDatabase is None:
+        raise ImportError("The online loader requires the neo4j package (see requirements.txt)")
+    return GraphDatabase.driver(uri, auth=(user, password), max_connection_pool_size=n_sessions * 2)
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+    conso_csv = os.path.join(out_dir, "pd_nhop_conso.csv")
+    sty_csv = os.path.join(out_dir, "pd_nhop_sty.csv")
+    rel_csv = os.path.join(out_dir, "pd_nhop_rel_dedup.csv")
+
+    OFFLINE = False  # True: only write neo4j-admin import csv files
+
+    if OFFLINE:
+        write_admin_import_csvs(conso_csv, sty_csv, rel_csv, os.path.join(out_dir, "neo4j_import"))
+        return
+
+    uri = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
+    driver = connect(uri, os.environ.get("NEO4J_USER", "neo4j"), os.environ.get("NEO4J_PASSWORD", "neo4j"))
+    try:
+        load_subgraph(driver, conso_csv, sty_csv, rel_csv)
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
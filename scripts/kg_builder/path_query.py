@@ -0,0 +1,391 @@
+"""
+Path queries between two CUIs on a prebuilt, labeled MRREL adjacency index ("how is drug X connected to
+Parkinson's?"), without building the n-hop subgraph.
+
+The path index is the mrrel_index layout (cuis.txt, offsets.npy, neighbors.npy, degrees.npy, rel_filter.json)
+where every neighbor entry also carries its relation, so parallel edges with different labels are kept:
+    edge_labels.npy - int32 per neighbor entry: relation id * 2 + direction
+                      (0: the MRREL row is CUI1 = this node, CUI2 = the neighbor; 1: the other way round)
+    relations.tsv   - relation id <TAB> REL <TAB> RELA
+    degrees.npy     - counts labeled entries, not distinct neighbors
+
+Queries (ids and frontiers are numpy arrays, nothing is materialized beyond the visited nodes):
+    shortest_path - bidirectional BFS, the smaller side is expanded level by level until the two meet
+    find_paths    - all simple paths up to max_length in order of length (the first k are the k shortest):
+                    a BFS from the target bounds the search, then a DFS from the source only steps to nodes
+                    that can still reach the target within the remaining hops
+Both take an optional rel_filter over the relations ({"REL_ALLOW": [...], "RELA_DENY": [...]}, as in
+rrf_reader; only REL / RELA keys), directed=True to follow rows only from CUI1 to CUI2, and max_degree to
+keep hubs (more than max_degree labeled entries) out of the inside of a path: a hub is never visited, so it
+is neither expanded nor a meeting node; the two end points may be hubs.
+Every hop of a returned path lists all the MRREL relations between its two CUIs that the filter allows.
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from scripts.kg_builder.mrrel_index import (
+    REL_FILTER_FILE, encode_cuis, index_matches, load_adjacency_index, write_adjacency_index
+)
+from scripts.umls.chunk_extract_example import PD_CUI
+from scripts.umls.rrf_parallel import scan_rrf
+from scripts.umls.rrf_reader import COL_REL, rel_filter_columns, rel_filter_mask
+from scripts.umls.stage_cache import cached_stage, code_version
+from scripts.umls.stage_metrics import finish_stage, observe, stage_metrics, timed
+
+EDGE_LABELS_FILE = "edge_labels.npy"
+RELATIONS_FILE = "relations.tsv"
+
+# Relation columns a query-time rel_filter can use
+PATH_FILTER_COLUMNS = ["REL", "RELA"]
+
+FORWARD = 0
+REVERSE = 1
+
+
+def _labeled_edge_chunk(chunk, rel_filter):
+    # Per-chunk work of build_path_index: CUI1 / REL / RELA / CUI2 of the rows rel_filter keeps
+    if rel_filter:
+        chunk = chunk[rel_filter_mask(chunk, rel_filter)]
+    return chunk[["CUI1", "REL", "RELA", "CUI2"]]
+
+
+def _encode_relations(chunk, relation_to_id):
+    # int32 id of every row's (REL, RELA) pair; only the distinct pairs of the chunk are looked up
+    rel, rela = chunk["REL"].astype("category"), chunk["RELA"].astype("category")
+    width = len(rela.cat.categories) + 1
+    # Codes are -1 for missing values, shifted to 0
+    keys = (rel.cat.codes.to_numpy(dtype=np.int64) + 1) * width + rela.cat.codes.to_numpy(dtype=np.int64) + 1
+    pairs, inverse = np.unique(keys, return_inverse=True)
+    lookup = np.empty(len(pairs), dtype=np.int32)
+    for pos, key in enumerate(pairs.tolist()):
+        rel_code, rela_code = divmod(key, width)
+        label = (rel.cat.categories[rel_code - 1] if rel_code else "") + "\t" + \
+                (rela.cat.categories[rela_code - 1] if rela_code else "")
+        lookup[pos] = relation_to_id.setdefault(label, len(relation_to_id))
+    return lookup[inverse.reshape(-1)]
+
+
+def build_path_index(mrrel_path, index_dir, rel_filter=None):
+    """
+    Read MRREL once and write the labeled adjacency index (layout above) to index_dir.
+    :param rel_filter: build-time REL/RELA/SAB/SUPPRESS filter (see rrf_reader.rel_filter_mask)
+    Return: number of CUIs, number of labeled neighbor entries
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    # rel_filter.json marks a complete index; drop it before the label files change
+    if os.path.exists(os.path.join(index_dir, REL_FILTER_FILE)):
+        os.remove(os.path.join(index_dir, REL_FILTER_FILE))
+    metrics = stage_metrics("build_path_index", source=str(mrrel_path), rel_filter=rel_filter)
+
+    cui_to_id = {}
+    relation_to_id = {}
+    src_parts, dst_parts, rel_parts = [], [], []
+    usecols = ["CUI1", "REL", "RELA", "CUI2"] + [col for col in rel_filter_columns(rel_filter)
+                                                 if col not in ("REL", "RELA")]
+    for chunk in scan_rrf(mrrel_path, COL_REL, _labeled_edge_chunk, shared=rel_filter, usecols=usecols,
+                          metrics=metrics):
+        with timed(metrics, "encode_s"):
+            src_parts.append(encode_cuis(chunk["CUI1"], cui_to_id))
+            dst_parts.append(encode_cuis(chunk["CUI2"], cui_to_id))
+            rel_parts.append(_encode_relations(chunk, relation_to_id))
+        observe(metrics, rows_out=len(chunk))
+
+    n_cuis = len(cui_to_id)
+    src = np.concatenate(src_parts) if src_parts else np.empty(0, dtype=np.int32)
+    dst = np.concatenate(dst_parts) if dst_parts else np.empty(0, dtype=np.int32)
+    rel = np.concatenate(rel_parts) if rel_parts else np.empty(0, dtype=np.int32)
+    del src_parts, dst_parts, rel_parts
+
+    # Every row is an entry at both of its CUIs; sort by (node, neighbor, label) and drop repeats
+    keep = src != dst
+    src, dst, rel = src[keep], dst[keep], rel[keep].astype(np.int32) * 2
+    nodes = np.concatenate([src, dst])
+    neighbors = np.concatenate([dst, src])
+    labels = np.concatenate([rel + FORWARD, rel + REVERSE])
+    order = np.lexsort((labels, neighbors, nodes))
+    nodes, neighbors, labels = nodes[order], neighbors[order], labels[order]
+    first = np.ones(len(nodes), dtype=bool)
+    first[1:] = (nodes[1:] != nodes[:-1]) | (neighbors[1:] != neighbors[:-1]) | (labels[1:] != labels[:-1])
+    nodes, neighbors, labels = nodes[first], neighbors[first], labels[first]
+    offsets = np.zeros(n_cuis + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=n_cuis), out=offsets[1:])
+
+    with timed(metrics, "write_s"):
+        np.save(os.path.join(index_dir, EDGE_LABELS_FILE), labels.astype(np.int32))
+        with open(os.path.join(index_dir, RELATIONS_FILE), "w", encoding="utf-8") as fout:
+            for relation_id, label in enumerate(relation_to_id):
+                fout.write(f"{relation_id}\t{label}\n")
+        write_adjacency_index(index_dir, list(cui_to_id), offsets, neighbors.astype(np.int32), rel_filter,
+                              source=mrrel_path)
+
+    finish_stage(metrics, cuis=n_cuis, neighbor_entries=len(neighbors), relations=len(relation_to_id))
+    return n_cuis, len(neighbors)
+
+
+def path_index_matches(index_dir, rel_filter=None, mrrel_path=None):
+    """
+    True if index_dir holds a complete path index built with the same rel_filter (and from mrrel_path, if given)
+    """
+    return (index_matches(index_dir, rel_filter, mrrel_path)
+            and os.path.exists(os.path.join(index_dir, EDGE_LABELS_FILE)))
+
+
+def load_path_index(index_dir):
+    """
+    Open a path index: load_adjacency_index plus edge_labels (memory-mapped) and
+    relations [(REL, RELA or None), ...] by relation id
+    """
+    if not (os.path.exists(os.path.join(index_dir, REL_FILTER_FILE))
+            and os.path.exists(os.path.join(index_dir, EDGE_LABELS_FILE))):
+        raise FileNotFoundError(f"No complete path index in {index_dir}")
+    index = load_adjacency_index(index_dir)
+    index["edge_labels"] = np.load(os.path.join(index_dir, EDGE_LABELS_FILE), mmap_mode="r")
+    # Plain ndarray views of the memory maps: np.memmap indexing overhead adds up over many small lookups
+    for key in ("offsets", "neighbors", "degrees", "edge_labels"):
+        index[key] = index[key].view(np.ndarray)
+    with open(os.path.join(index_dir, RELATIONS_FILE), "r", encoding="utf-8") as fin:
+        index["relations"] = [tuple(value or None for value in line.rstrip("\n").split("\t")[1:3]) for line in fin]
+    return index
+
+
+def relation_mask(index, rel_filter=None):
+    """
+    bool per relation id: allowed by rel_filter (REL / RELA keys only), all True without a filter
+    """
+    relations = index["relations"]
+    if not rel_filter:
+        return np.ones(len(relations), dtype=bool)
+    unknown = [col for col in rel_filter_columns(rel_filter) if col not in PATH_FILTER_COLUMNS]
+    if unknown:
+        raise ValueError(f"Path queries can only filter on {PATH_FILTER_COLUMNS}, not {unknown}; "
+                         f"apply those when building the path index")
+    table = pd.DataFrame(relations, columns=["REL", "RELA"])
+    return rel_filter_mask(table, rel_filter).to_numpy(dtype=bool)
+
+
+def _node_id(index, cui):
+    node = index["cui_to_id"].get(cui.upper())
+    if node is None:
+        raise KeyError(f"{cui} is not in the path index")
+    return node
+
+
+def _expand(index, nodes, allowed, direction):
+    # Allowed entries of nodes: (position in nodes, neighbor id, entry position); direction None = both,
+    # FORWARD / REVERSE = only entries whose MRREL row points that way
+    offsets = index["offsets"]
+    starts = offsets[nodes]
+    lengths = offsets[nodes + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    entries = np.arange(total, dtype=np.int64) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    labels = index["edge_labels"][entries]
+    keep = allowed[labels >> 1]
+    if direction is not None:
+        keep &= (labels & 1) == direction
+    source = np.repeat(np.arange(len(nodes), dtype=np.int64), lengths)
+    return source[keep], index["neighbors"][entries[keep]].astype(np.int64), entries[keep]
+
+
+class _Side:
+    """
+    One direction of a BFS: visited node ids (sorted) with their hop distance and BFS parent
+    """
+
+    def __init__(self, node, direction):
+        self.direction = direction
+        self.nodes = np.array([node], dtype=np.int64)
+        self.dist = np.zeros(1, dtype=np.int64)
+        self.parent = np.full(1, -1, dtype=np.int64)
+        self.frontier = self.nodes
+        self.hops = 0
+
+    def lookup(self, nodes):
+        # Position of nodes in self.nodes and whether they are visited
+        pos = np.searchsorted(self.nodes, nodes)
+        pos[pos == len(self.nodes)] = 0
+        return pos, self.nodes[pos] == nodes
+
+    def step(self, index, allowed, expandable):
+        # Visit the next level (hubs left out, see _expandable); return the newly reached ids
+        frontier = self.frontier
+        source, reached, _ = _expand(index, frontier, allowed, self.direction)
+        new = ~self.lookup(reached)[1]
+        reached, first = np.unique(reached[new], return_index=True)
+        parents = frontier[source[new][first]]
+        usable = expandable(reached)
+        reached, parents = reached[usable], parents[usable]
+        self.hops += 1
+        order = np.argsort(np.concatenate([self.nodes, reached]), kind="stable")
+        self.nodes = np.concatenate([self.nodes, reached])[order]
+        self.dist = np.concatenate([self.dist, np.full(len(reached), self.hops)])[order]
+        self.parent = np.concatenate([self.parent, parents])[order]
+        self.frontier = reached
+        return reached
+
+    def chain(self, node):
+        # node, its parent, ... back to the side's start
+        chain = [node]
+        while True:
+            pos, _ = self.lookup(np.array([chain[-1]]))
+            parent = int(self.parent[pos[0]])
+            if parent < 0:
+                return chain
+            chain.append(parent)
+
+
+def _expandable(index, max_degree, ends):
+    # Nodes a path may pass through: at most max_degree entries, or one of the end points
+    degrees = index["degrees"]
+    if max_degree is None:
+        return lambda nodes: np.ones(len(nodes), dtype=bool)
+    return lambda nodes: (degrees[nodes] <= max_degree) | np.isin(nodes, ends)
+
+
+def hop_relations(index, node, neighbor, allowed=None, direction=None):
+    """
+    MRREL relations between two node ids as [{"cui1", "rel", "rela", "cui2"}], oriented like the MRREL rows
+    """
+    start, end = index["offsets"][node], index["offsets"][node + 1]
+    entries = start + np.flatnonzero(index["neighbors"][start:end] == neighbor)
+    cuis = index["cuis"]
+    hops = []
+    for label in index["edge_labels"][entries].tolist():
+        if allowed is not None and not allowed[label >> 1]:
+            continue
+        if direction is not None and (label & 1) != direction:
+            continue
+        rel, rela = index["relations"][label >> 1]
+        cui1, cui2 = (cuis[node], cuis[neighbor]) if (label & 1) == FORWARD else (cuis[neighbor], cuis[node])
+        hops.append({"cui1": cui1, "rel": rel, "rela": rela, "cui2": cui2})
+    return hops
+
+
+def _path_result(index, path, allowed, directed):
+    return {
+        "cuis": [index["cuis"][node] for node in path],
+        "length": len(path) - 1,
+        "hops": [hop_relations(index, u, v, allowed, FORWARD if directed else None) for u, v in zip(path, path[1:])],
+    }
+
+
+def shortest_path(index, source_cui, target_cui, max_hops=6, rel_filter=None, directed=False, max_degree=None):
+    """
+    One shortest path from source_cui to target_cui by bidirectional BFS (ties: smallest meeting node id).
+    Both sides only hold nodes a path may pass through, so a side whose frontier runs empty has seen all of its
+    component and there is no path.
+    Return: {"cuis": [...], "length": hops, "hops": [[relation dicts] per hop]} or None if there is no path
+            within max_hops
+    """
+    allowed = relation_mask(index, rel_filter)
+    source, target = _node_id(index, source_cui), _node_id(index, target_cui)
+    if source == target:
+        return _path_result(index, [source], allowed, directed)
+    forward = _Side(source, FORWARD if directed else None)
+    backward = _Side(target, REVERSE if directed else None)
+    expandable = _expandable(index, max_degree, [source, target])
+
+    while forward.hops + backward.hops < max_hops and len(forward.frontier) and len(backward.frontier):
+        side, other = (forward, backward) if len(forward.frontier) <= len(backward.frontier) else (backward, forward)
+        reached = side.step(index, allowed, expandable)
+        pos, met = other.lookup(reached)
+        if met.any():
+            meeting = reached[met]
+            total = side.hops + other.dist[pos[met]]
+            node = int(meeting[np.argmin(total)])
+            path = forward.chain(node)[::-1] + backward.chain(node)[1:]
+            return _path_result(index, path, allowed, directed)
+    return None
+
+
+def _distances_to(index, target, max_hops, allowed, direction, expandable):
+    # Sorted ids within max_hops of target and their distance (a BFS from the target)
+    side = _Side(target, direction)
+    while side.hops < max_hops and len(side.frontier):
+        side.step(index, allowed, expandable)
+    return side
+
+
+def find_paths(index, source_cui, target_cui, max_length=4, k=None, rel_filter=None, directed=False,
+               max_degree=None, max_paths=1000):
+    """
+    Simple paths from source_cui to target_cui with at most max_length hops, shortest first
+    (same length: in neighbor id order). k = stop after the k shortest; max_paths bounds the enumeration.
+    Return: list of {"cuis", "length", "hops"} (see shortest_path)
+    """
+    allowed = relation_mask(index, rel_filter)
+    source, target = _node_id(index, source_cui), _node_id(index, target_cui)
+    limit = max_paths if k is None else min(k, max_paths)
+    if source == target:
+        return [_path_result(index, [source], allowed, directed)]
+    expandable = _expandable(index, max_degree, [source, target])
+    to_target = _distances_to(index, target, max_length - 1, allowed, REVERSE if directed else None, expandable)
+    direction = FORWARD if directed else None
+    next_cache = {}
+
+    def next_steps(node):
+        # Neighbors of node that can reach the target, with their distance to it (sorted by id)
+        if node not in next_cache:
+            # to_target holds no hubs, so a hub is never a next step (same rule as shortest_path)
+            _, reached_nodes, _ = _expand(index, np.array([node]), allowed, direction)
+            # One CSR row is sorted by neighbor id; parallel entries are neighbors
+            distinct = np.ones(len(reached_nodes), dtype=bool)
+            distinct[1:] = reached_nodes[1:] != reached_nodes[:-1]
+            pos, known = to_target.lookup(reached_nodes[distinct])
+            reached_nodes = reached_nodes[distinct]
+            next_cache[node] = (reached_nodes[known], to_target.dist[pos[known]])
+        return next_cache[node]
+
+    paths = []
+    for length in range(1, max_length + 1):
+        # Depth-first, only through nodes that are exactly close enough to end at the target after length hops
+        stack = [(source, [source])]
+        while stack and len(paths) < limit:
+            node, path = stack.pop()
+            remaining = length - (len(path) - 1)
+            candidates, dist = next_steps(node)
+            if remaining == 1:
+                if np.isin(target, candidates):
+                    paths.append(_path_result(index, path + [target], allowed, directed))
+                continue
+            ok = (dist <= remaining - 1) & (candidates != target)
+            on_path = np.isin(candidates, path)
+            for neighbor in candidates[ok & ~on_path][::-1].tolist():
+                stack.append((neighbor, path + [neighbor]))
+        if len(paths) >= limit:
+            break
+    return paths
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    index_dir = os.path.join(base_dir, "data", "umls_output", "path_index")
+
+    # Absolute path
+    mrrel_path = "E:\\Data\\2024AB\\META\\MRREL.RRF"
+    REL_FILTER = None  # e.g. CLINICAL_REL_FILTER, applied while building
+
+    # Skipped when MRREL, the filter and the code are unchanged (see stage_cache)
+    cached_stage("path_index", lambda: build_path_index(mrrel_path, index_dir, rel_filter=REL_FILTER),
+                 inputs=[mrrel_path], outputs=[index_dir], params={"rel_filter": REL_FILTER},
+                 code=code_version(build_path_index))
+    index = load_path_index(index_dir)
+
+    levodopa = "C0023570"
+    start_time = time.perf_counter()
+    path = shortest_path(index, levodopa, PD_CUI, rel_filter={"REL_DENY": ["SIB"]})
+    print(f"[main] shortest path ({(time.perf_counter() - start_time) * 1000:.1f} ms): {path}")
+    start_time = time.perf_counter()
+    paths = find_paths(index, levodopa, PD_CUI, max_length=3, k=10, max_degree=5000)
+    print(f"[main] {len(paths)} paths up to 3 hops ({(time.perf_counter() - start_time) * 1000:.1f} ms)")
+    for found in paths:
+        print("   ", " -> ".join(found["cuis"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,40 @@
 This is a method to build an n-hop subgraph from the original UMLS file, currently using a hop count of 7, and the resulting file is pd_nhop_rel.csv
 """
 
+import argparse
 import os
 import csv
-import pandas as pd
+import json
 import time
 
-CHUNKSIZE = 100_000
+import numpy as np
+import pandas as pd
 
-# UMLS Column name of MRREL
-COL_REL = [
-    "CUI1", "AUI1", "STYPE1", "REL", "CUI2", "AUI2", "STYPE2", "RELA", "RUI", "SRUI",
-    "SAB", "SL", "RG", "DIR", "SUPPRESS", "CVF"
-]
+from scripts.kg_builder.dedup_edges import dedup_rel_csv, load_inverses
+from scripts.kg_builder.mrrel_index import (
+    build_adjacency_index, check_prune, index_matches, load_adjacency_index, bfs_multi_seed, write_bfs_result
+)
+from scripts.kg_builder.name_index import build_name_index, load_name_index, seed_cuis
+from scripts.umls.cui_intern import (
+    column_cui_ids, cui_bitmap, cui_isin, cui_member, ids_signature, load_cui_ids, make_cui_ids, save_cui_ids
+)
+from scripts.umls.rrf_checkpoint import atomic_write_json, checkpointed_scan
+from scripts.umls.rrf_parallel import default_workers, scan_rrf
+from scripts.umls.rrf_prefilter import cui_prefilter
+from scripts.umls.rrf_reader import COL_REL, read_rrf, rel_filter_columns, rel_filter_mask
+from scripts.umls.stage_cache import cached_stage, code_version
+from scripts.umls.stage_metrics import (
+    add_metrics_args, configure_metrics, emit_event, finish_stage, observe, stage_metrics, timed
+)
 
 PD_CUI = "C0030567"  # Parkinson's disease
 
+# Seeds expanded together in one BFS pass; PD first so it wins hop ties
+SEED_CUIS = [PD_CUI]
+
+# bfs_node_only state after the last finished hop (see save_bfs_checkpoint)
+BFS_CHECKPOINT_FILE = "bfs_checkpoint.json"
+
 
 def find_direct_neighbors(mrrel_path, output_path):
     """
@@ -30,35 +49,25 @@ def find_direct_neighbors(mrrel_path, output_path):
     lines_pd_direct = []  # Store all lines related to PD
 
     chunk_idx = 0
-    with open(mrrel_path, "r", encoding="utf-8") as fin:
-        reader = pd.read_csv(fin,
-                             sep="|",
-                             names=COL_REL,
-                             dtype=str,
-                             chunksize=CHUNKSIZE,
-                             engine="python",
-                             quoting=csv.QUOTE_NONE,
-                             usecols=range(len(COL_REL))
-                             )
-        for chunk in reader:
-            chunk_idx += 1
-            chunk["CUI1"] = chunk["CUI1"].str.upper().fillna("")
-            chunk["CUI2"] = chunk["CUI2"].str.upper().fillna("")
-            # Keep only PD_CUI lines
-            mask = (chunk["CUI1"] == PD_CUI) | (chunk["CUI2"] == PD_CUI)
-            filtered = chunk[mask]
-            if not filtered.empty:
-                # Collect rows
-                lines_pd_direct.extend(filtered.values.tolist())
-                # Collect neighbor
-                for _, row in filtered.iterrows():
-                    c1 = row["CUI1"]
-                    c2 = row["CUI2"]
-                    # If PD is in CUI1, the neighbor is CUI2; If PD is in CUI2, the neighbor is CUI1
-                    if c1 == PD_CUI and c2 != PD_CUI:
-                        neighbor_set.add(c2)
-                    if c2 == PD_CUI and c1 != PD_CUI:
-                        neighbor_set.add(c1)
+    # Only lines with PD_CUI in their CUI1 / CUI2 bytes get parsed
+    reader = read_rrf(mrrel_path, COL_REL, prefilter=cui_prefilter([PD_CUI], ["CUI1", "CUI2"]))
+    for chunk in reader:
+        chunk_idx += 1
+        # Keep only PD_CUI lines
+        mask = (chunk["CUI1"] == PD_CUI) | (chunk["CUI2"] == PD_CUI)
+        filtered = chunk[mask]
+        if not filtered.empty:
+            # Collect rows
+            lines_pd_direct.extend(filtered.values.tolist())
+            # Collect neighbor
+            for _, row in filtered.iterrows():
+                c1 = row["CUI1"]
+                c2 = row["CUI2"]
+                # If PD is in CUI1, the neighbor is CUI2; If PD is in CUI2, the neighbor is CUI1
+                if c1 == PD_CUI and c2 != PD_CUI:
+                    neighbor_set.add(c2)
+                if c2 == PD_CUI and c1 != PD_CUI:
+                    neighbor_set.add(c1)
 
     # Write out lines_pd_direct
     with open(output_path, "w", encoding="utf-8", newline="") as fout:
@@ -86,28 +95,16 @@ def bfs_nhop_from_node(mrrel_path, start_cui, n_hops=3):
             break
         new_cuis = set()
 
-        with open(mrrel_path, "r", encoding="utf-8") as fin:
-            reader = pd.read_csv(fin,
-                                 sep="|",
-                                 names=COL_REL,
-                                 dtype=str,
-                                 chunksize=CHUNKSIZE,
-                                 engine="python",
-                                 quoting=csv.QUOTE_NONE,
-                                 usecols=range(len(COL_REL))
-                                 )
-            for chunk in reader:
-                chunk["CUI1"] = chunk["CUI1"].str.upper().fillna("")
-                chunk["CUI2"] = chunk["CUI2"].str.upper().fillna("")
-
-                mask = (chunk["CUI1"].isin(frontier)) | (chunk["CUI2"].isin(frontier))
-                filtered = chunk[mask]
-                if not filtered.empty:
-                    # Collect rows
-                    lines_found.extend(filtered.values.tolist())
-                    # Collect emerging CUI
-                    cuiset = set(filtered["CUI1"].tolist()) | set(filtered["CUI2"].tolist())
-                    new_cuis.update(cuiset)
+        reader = read_rrf(mrrel_path, COL_REL)
+        for chunk in reader:
+            mask = (chunk["CUI1"].isin(frontier)) | (chunk["CUI2"].isin(frontier))
+            filtered = chunk[mask]
+            if not filtered.empty:
+                # Collect rows
+                lines_found.extend(filtered.values.tolist())
+                # Collect emerging CUI
+                cuiset = set(filtered["CUI1"].tolist()) | set(filtered["CUI2"].tolist())
+                new_cuis.update(cuiset)
         newly_found = new_cuis - all_found_cuis
         frontier = newly_found
         all_found_cuis.update(new_cuis)
@@ -143,34 +140,21 @@ def bfs_n_hop(mrrel_path, start_cui, max_hops=5):
 
         # Block scan MRREL
         chunk_idx = 0
-        with open(mrrel_path, "r", encoding="utf-8") as fin:
-            reader = pd.read_csv(
-                fin,
-                sep="|",
-                names=COL_REL,
-                dtype=str,
-                chunksize=CHUNKSIZE,
-                engine="python",
-                quoting=csv.QUOTE_NONE,
-                usecols=range(len(COL_REL))
-            )
-            for chunk in reader:
-                chunk_idx += 1
-                chunk["CUI1"] = chunk["CUI1"].str.upper().fillna("")
-                chunk["CUI2"] = chunk["CUI2"].str.upper().fillna("")
-
-                # Find the row for (CUI1 in frontier) OR (CUI2 in frontier)
-                mask = chunk["CUI1"].isin(frontier) | chunk["CUI2"].isin(frontier)
-                filtered = chunk[mask]
-                if not filtered.empty:
-                    # Add these lines to all_lines
-                    all_lines.extend(filtered.values.tolist())
-
-                    # Extract new node
-                    c1s = filtered["CUI1"].tolist()
-                    c2s = filtered["CUI2"].tolist()
-                    candidate_cuis = set(c1s) | set(c2s)
-                    new_cuis.update(candidate_cuis)
+        reader = read_rrf(mrrel_path, COL_REL, prefilter=cui_prefilter(frontier, ["CUI1", "CUI2"]))
+        for chunk in reader:
+            chunk_idx += 1
+            # Find the row for (CUI1 in frontier) OR (CUI2 in frontier)
+            mask = chunk["CUI1"].isin(frontier) | chunk["CUI2"].isin(frontier)
+            filtered = chunk[mask]
+            if not filtered.empty:
+                # Add these lines to all_lines
+                all_lines.extend(filtered.values.tolist())
+
+                # Extract new node
+                c1s = filtered["CUI1"].tolist()
+                c2s = filtered["CUI2"].tolist()
+                candidate_cuis = set(c1s) | set(c2s)
+                new_cuis.update(candidate_cuis)
 
         end_t = time.time()
         print(
@@ -190,7 +174,8 @@ def bfs_n_hop(mrrel_path, start_cui, max_hops=5):
 def deduplicate_lines(all_lines):
     """
     De-weight all_lines(nested lists).
-    If the amount of data is very large, this step will consume a lot of memory.
+    If the amount of data is very large, this step will consume a lot of memory;
+    write the rows to CSV and use dedup_edges.dedup_rel_csv instead (bounded memory, spills to disk).
     """
     # Convert each row to tuple, put in a set
     lines_set = set(tuple(row) for row in all_lines)
@@ -198,7 +183,129 @@ def deduplicate_lines(all_lines):
     final_list = [list(x) for x in lines_set]
     return final_list
 
-def bfs_node_only(mrrel_path, start_cui, max_hops=5):
+def _frontier_chunk(chunk, shared):
+    # Per-chunk work of one bfs_node_only hop: CUI ids of rows touching the frontier (sorted id array)
+    frontier, rel_filter = shared
+    if rel_filter:
+        chunk = chunk[rel_filter_mask(chunk, rel_filter)]
+
+    mask = cui_isin(chunk["CUI1"], frontier) | cui_isin(chunk["CUI2"], frontier)
+    filtered = chunk[mask]
+    if filtered.empty:
+        return np.empty(0, dtype=np.int32)
+    return np.unique(np.concatenate([column_cui_ids(filtered["CUI1"]), column_cui_ids(filtered["CUI2"])]))
+
+
+def _frontier_edges_chunk(chunk, shared):
+    # Per-chunk work of a bfs_node_only hop with max_fanout: (src in frontier, dst, SAB) for both row directions
+    frontier, rel_filter = shared
+    if rel_filter:
+        chunk = chunk[rel_filter_mask(chunk, rel_filter)]
+    c1, c2 = column_cui_ids(chunk["CUI1"]), column_cui_ids(chunk["CUI2"])
+    sab = chunk["SAB"].astype(object).to_numpy()
+    in1, in2 = cui_member(c1, frontier), cui_member(c2, frontier)
+    return pd.DataFrame({
+        "src": np.concatenate([c1[in1], c2[in2]]),
+        "dst": np.concatenate([c2[in1], c1[in2]]),
+        "SAB": np.concatenate([sab[in1], sab[in2]]),
+    })
+
+
+def _rel_chunk(chunk, shared):
+    # Per-chunk work of filter_rel_by_cuis: rows with both ends in the CUI id set
+    cui_ids, rel_filter = shared
+    mask = cui_isin(chunk["CUI1"], cui_ids) & cui_isin(chunk["CUI2"], cui_ids)
+    if rel_filter:
+        mask &= rel_filter_mask(chunk, rel_filter)
+    return chunk[mask]
+
+
+def _write_cui_ids(path, cui_ids):
+    tmp_path = path + ".tmp"
+    save_cui_ids(tmp_path, cui_ids)
+    os.replace(tmp_path, path)
+
+
+def save_bfs_checkpoint(checkpoint_dir, run, hop, all_cuis, frontier):
+    """
+    Persist the BFS state after a finished hop: bfs_hop<h>_visited.txt / bfs_hop<h>_frontier.txt,
+    then bfs_checkpoint.json pointing at them (written last, so it always names complete files)
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    _write_cui_ids(os.path.join(checkpoint_dir, f"bfs_hop{hop}_visited.txt"), all_cuis)
+    _write_cui_ids(os.path.join(checkpoint_dir, f"bfs_hop{hop}_frontier.txt"), frontier)
+    atomic_write_json(os.path.join(checkpoint_dir, BFS_CHECKPOINT_FILE), dict(run, hop=hop))
+    # Files of the previous hop are no longer referenced
+    for name in (f"bfs_hop{hop - 1}_visited.txt", f"bfs_hop{hop - 1}_frontier.txt"):
+        if os.path.exists(os.path.join(checkpoint_dir, name)):
+            os.remove(os.path.join(checkpoint_dir, name))
+
+
+def load_bfs_checkpoint(checkpoint_dir, run):
+    """
+    Return: (hop, all_cuis, frontier) of the last finished hop of the same run (CUI id arrays), or None
+    """
+    ckpt_path = os.path.join(checkpoint_dir, BFS_CHECKPOINT_FILE)
+    if not os.path.exists(ckpt_path):
+        return None
+    with open(ckpt_path, "r", encoding="utf-8") as fin:
+        state = json.load(fin)
+    hop = state.pop("hop")
+    if state != run:
+        print(f"[load_bfs_checkpoint] {ckpt_path} belongs to another run, starting over")
+        return None
+    return (hop,
+            load_cui_ids(os.path.join(checkpoint_dir, f"bfs_hop{hop}_visited.txt")),
+            load_cui_ids(os.path.join(checkpoint_dir, f"bfs_hop{hop}_frontier.txt")))
+
+
+def _expand_hop(mrrel_path, frontier, visited, rel_filter, n_workers, prune, degrees, hop, stats, metrics=None):
+    """
+    One bfs_node_only hop over CUI ids (frontier: sorted id array, visited: bitmap).
+    Without prune: all CUIs of rows touching frontier that are not visited yet.
+    With prune: hubs are not expanded, and max_fanout / max_frontier keep the lowest-degree new nodes.
+    Return: sorted id array of the newly found CUIs
+    """
+    if "max_degree" in prune and hop > 1:
+        hub = degrees[frontier] > prune["max_degree"]
+        stats["hubs_not_expanded"] = int(hub.sum())
+        frontier = frontier[~hub]
+
+    # Lines touching the frontier, decided on the raw CUI bytes before parsing
+    prefilter = cui_prefilter(frontier, ["CUI1", "CUI2"], match="any")
+    if "max_fanout" not in prune:
+        parts = list(scan_rrf(mrrel_path, COL_REL, _frontier_chunk, shared=(frontier, rel_filter),
+                              usecols=["CUI1", "CUI2"] + rel_filter_columns(rel_filter),
+                              n_workers=n_workers, prefilter=prefilter, metrics=metrics))
+        found = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+        newly_found = found[(found >= 0) & ~cui_member(found, visited)]
+    else:
+        parts = list(scan_rrf(mrrel_path, COL_REL, _frontier_edges_chunk, shared=(frontier, rel_filter),
+                              usecols=list(dict.fromkeys(["CUI1", "CUI2", "SAB"] + rel_filter_columns(rel_filter))),
+                              n_workers=n_workers, prefilter=prefilter, metrics=metrics))
+        edges = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["src", "dst", "SAB"])
+        dst = edges["dst"].to_numpy(dtype=np.int64)
+        edges = edges[(dst >= 0) & ~cui_member(dst, visited)]
+        reachable = edges["dst"].nunique()
+        sab_rank = {sab: rank for rank, sab in enumerate(prune.get("sab_priority", []))}
+        edges = edges.assign(sab_rank=edges["SAB"].map(lambda sab: sab_rank.get(sab, len(sab_rank))),
+                             degree=degrees[edges["dst"].to_numpy(dtype=np.int64)])
+        # Best row per (src, dst), then the first max_fanout dst of every src
+        edges = edges.sort_values(["src", "sab_rank", "degree", "dst"], kind="stable")
+        edges = edges.drop_duplicates(["src", "dst"]).groupby("src", sort=False).head(prune["max_fanout"])
+        newly_found = np.unique(edges["dst"].to_numpy(dtype=np.int32))
+        stats["fanout_pruned"] = reachable - len(newly_found)
+
+    if "max_frontier" in prune and len(newly_found) > prune["max_frontier"]:
+        # Lowest degree first, ties in CUI order
+        order = np.lexsort((newly_found, degrees[newly_found]))
+        stats["frontier_pruned"] = len(newly_found) - prune["max_frontier"]
+        newly_found = np.sort(newly_found[order[:prune["max_frontier"]]])
+    return newly_found.astype(np.int32)
+
+
+def bfs_node_only(mrrel_path, start_cui, max_hops=5, rel_filter=None, n_workers=1,
+                  checkpoint_dir=None, resume=False, prune=None, degree_table=None, prune_stats=None):
     """
     Stage 1: Store only the multi-hop BFS of the "node collection".
     Logic:
@@ -211,86 +318,88 @@ def bfs_node_only(mrrel_path, start_cui, max_hops=5):
                 Extract CUI1, CUI2 → new_cuis from these rows
         frontier = new_cuis - all_cuis
         all_cuis |= new_cuis
-    Return: all_cuis (≤ n All nodes that can be jumped to)
+    CUIs are handled as int32 ids (see cui_intern): the frontier is a sorted id array shared with the
+    scan workers, the visited set a bitmap over the CUI range.
+    rel_filter (see rel_filter_mask) drops rows by REL/RELA/SAB/SUPPRESS before they reach the frontier logic.
+    n_workers > 1 scans each hop with scan_rrf worker processes; the frontier is shared read-only.
+    checkpoint_dir: frontier and all_cuis are saved there after every hop; resume=True starts after
+    the last saved hop of the same run (same MRREL file, start_cui, rel_filter and prune).
+    prune: hub pruning options (mrrel_index.PRUNE_KEYS), checked against degree_table (degree per CUI id,
+    see mrrel_index.degree_table); prune_stats, if a list, receives the pruned counts of every hop.
+    Progress goes to the stage_metrics sinks: one "hop" event per hop (frontier size, newly found, scan counts).
+    Return: all_cuis as a sorted int32 CUI id array (cui_strings() gives the CUIs back)
     Do not return all rows to avoid memory explosion.
     """
-
-    frontier = {start_cui}
-    all_cuis = set([start_cui])
-
-    for hop in range(1, max_hops + 1):
-        if not frontier:
-            print(f"[bfs_node_only] hop={hop}, frontier空，提前结束")
+    prune = check_prune(prune)
+    if prune and degree_table is None:
+        raise ValueError("bfs_node_only(prune=...) needs a degree_table, see mrrel_index.degree_table")
+
+    frontier = make_cui_ids([start_cui])
+    visited = cui_bitmap(frontier)
+    first_hop = 1
+    metrics = stage_metrics("bfs_node_only", source=str(mrrel_path), start_cui=start_cui, max_hops=max_hops,
+                            n_workers=n_workers)
+
+    run = {"source": os.path.abspath(mrrel_path), "start_cui": start_cui, "rel_filter": rel_filter}
+    if prune:
+        run["prune"] = prune
+    if checkpoint_dir is not None and resume:
+        saved = load_bfs_checkpoint(checkpoint_dir, run)
+        if saved is not None:
+            done_hop, all_cuis, frontier = saved
+            visited = cui_bitmap(all_cuis)
+            first_hop = done_hop + 1
+            emit_event(metrics, "resume", after_hop=done_hop, all_cuis=len(all_cuis))
+
+    for hop in range(first_hop, max_hops + 1):
+        if len(frontier) == 0:
+            # frontier is empty, stop early
             break
         start_t = time.time()
-        new_cuis = set()
-        print(f"[bfs_node_only] hop={hop}, frontier_size={len(frontier)}")
+        frontier_size = len(frontier)
+        stats = {"hop": hop, "hubs_not_expanded": 0, "fanout_pruned": 0, "frontier_pruned": 0}
 
         # Block traversal MRREL
-        with open(mrrel_path, "r", encoding="utf-8") as fin:
-            reader = pd.read_csv(fin,
-                                 sep="|",
-                                 names=COL_REL,
-                                 dtype=str,
-                                 chunksize=CHUNKSIZE,
-                                 engine="python",
-                                 quoting=csv.QUOTE_NONE,
-                                 usecols=range(len(COL_REL)))
-            for chunk in reader:
-                chunk["CUI1"] = chunk["CUI1"].str.upper().fillna("")
-                chunk["CUI2"] = chunk["CUI2"].str.upper().fillna("")
-
-                mask = chunk["CUI1"].isin(frontier) | chunk["CUI2"].isin(frontier)
-                filtered = chunk[mask]
-                if not filtered.empty:
-                    c1s = filtered["CUI1"].tolist()
-                    c2s = filtered["CUI2"].tolist()
-                    new_cuis.update(c1s)
-                    new_cuis.update(c2s)
-
-        newly_found = new_cuis - all_cuis
+        newly_found = _expand_hop(mrrel_path, frontier, visited, rel_filter, n_workers, prune, degree_table,
+                                  hop, stats, metrics)
         frontier = newly_found
-        all_cuis.update(new_cuis)
-        end_t = time.time()
-        print(f"   hop={hop} done, newly_found={len(newly_found)}, all_cuis={len(all_cuis)}, cost={end_t - start_t:.2f}s")
-
-    return all_cuis
-
-def filter_rel_by_cuis(mrrel_path, node_set, output_rel_path):
+        visited[newly_found] = True
+        if checkpoint_dir is not None:
+            save_bfs_checkpoint(checkpoint_dir, run, hop, np.flatnonzero(visited), frontier)
+        observe(metrics, rows_out=len(newly_found))
+        pruned = {} if not prune else {key: value for key, value in stats.items() if key != "hop"}
+        emit_event(metrics, "hop", hop=hop, frontier_size=frontier_size, newly_found=len(newly_found),
+                   all_cuis=int(visited.sum()), hop_s=time.time() - start_t, **pruned)
+        if prune_stats is not None:
+            prune_stats.append(stats)
+
+    finish_stage(metrics, all_cuis=int(visited.sum()))
+    return np.flatnonzero(visited).astype(np.int32)
+
+def filter_rel_by_cuis(mrrel_path, node_set, output_rel_path, rel_filter=None, n_workers=1, resume=False):
     """
-    Stage 2: After getting the node set node_set,
-    Read MRREL once again, keeping only the lines (CUI1 in node_set & CUI2 in node_set)
-    Write to output_rel_path
+    Stage 2: After getting the node set node_set (CUI strings or a CUI id array, see cui_intern),
+    Read MRREL (RRF file or Parquet dataset) once again, keeping only the lines (CUI1 in node_set & CUI2 in node_set)
+    and, if given, passing rel_filter (same filter as the traversal)
+    Write to output_rel_path (n_workers > 1: parallel byte-range scan, same row order)
+    The output is checkpointed (see rrf_checkpoint); resume=True continues an interrupted run with the same inputs.
     """
-
-    with open(output_rel_path, "w", encoding="utf-8", newline="") as fout:
-        writer = csv.writer(fout, delimiter="|")
-        writer.writerow(COL_REL)
-
-        chunk_idx = 0
-        lines_kept = 0
-
-        with open(mrrel_path, "r", encoding="utf-8") as fin:
-            reader = pd.read_csv(fin,
-                                 sep="|",
-                                 names=COL_REL,
-                                 dtype=str,
-                                 chunksize=CHUNKSIZE,
-                                 engine="python",
-                                 quoting=csv.QUOTE_NONE,
-                                 usecols=range(len(COL_REL)))
-            for chunk in reader:
-                chunk_idx += 1
-                chunk["CUI1"] = chunk["CUI1"].str.upper().fillna("")
-                chunk["CUI2"] = chunk["CUI2"].str.upper().fillna("")
-
-                mask = (chunk["CUI1"].isin(node_set)) & (chunk["CUI2"].isin(node_set))
-                filtered = chunk[mask]
-                if not filtered.empty:
-                    lines_kept += len(filtered)
-                    filtered.to_csv(fout, sep="|", header=False, index=False)
-
-    print(f"[filter_rel_by_cuis] lines_kept={lines_kept}, output -> {output_rel_path}")
+    cui_ids = make_cui_ids(node_set)
+    signature = {"nodes": ids_signature(cui_ids), "rel_filter": rel_filter}
+    metrics = stage_metrics("filter_rel_by_cuis", source=str(mrrel_path), cuis=len(cui_ids), n_workers=n_workers)
+
+    results = checkpointed_scan(mrrel_path, COL_REL, _rel_chunk, output_rel_path,
+                                header="|".join(COL_REL) + "\r\n", shared=(cui_ids, rel_filter),
+                                n_workers=n_workers, cui_filter={"CUI1": cui_ids, "CUI2": cui_ids},
+                                prefilter=cui_prefilter(cui_ids, ["CUI1", "CUI2"], match="all"),
+                                resume=resume, signature=signature, metrics=metrics)
+    for fout, filtered in results:
+        if not filtered.empty:
+            with timed(metrics, "write_s"):
+                filtered.to_csv(fout, sep="|", header=False, index=False)
+        observe(metrics, rows_out=len(filtered))
+
+    finish_stage(metrics, output=str(output_rel_path))
 
 def main():
     """
@@ -301,6 +410,14 @@ def main():
     5) Subsequently use finalCUI to filter MRCONSO/MRSTY
     """
 
+    parser = argparse.ArgumentParser(description="Build the PD n-hop subgraph from MRREL")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted MRREL filter from its last checkpoint")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage, ignoring the stage cache")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
     out_dir = os.path.join(base_dir, "data", "umls_output")
     os.makedirs(out_dir, exist_ok=True)
@@ -311,35 +428,80 @@ def main():
 
     # Absolute path
     mrrel_path = "E:\\Data\\2024AB\\META\\MRREL.RRF"
+    mrconso_path = "E:\\Data\\2024AB\\META\\MRCONSO.RRF"
+    mrdoc_path = "E:\\Data\\2024AB\\META\\MRDOC.RRF"
     out_rel_csv = os.path.join(out_dir, "pd_nhop_rel.csv")
+    out_rel_dedup_csv = os.path.join(out_dir, "pd_nhop_rel_dedup.csv")
     out_cui_txt = os.path.join(out_dir, "pd_nhop_cuis.txt")
+    index_dir = os.path.join(out_dir, "mrrel_index")
+    name_index_dir = os.path.join(out_dir, "name_index")
 
     MAX_HOPS = 7  # The maximum number of hops of a subgraph
-
-    # 第1阶段：只存节点 BFS
-    start_time = time.time()
-    final_nodes = bfs_node_only(
-        mrrel_path=str(mrrel_path),
-        start_cui=PD_CUI,
-        max_hops=MAX_HOPS
-    )
-    end_time = time.time()
-    print(f"[main] BFS node-only done, total nodes={len(final_nodes)}, cost={end_time - start_time:.2f}s")
-
-    # Write node list
-    with open(out_cui_txt, "w", encoding="utf-8") as fout:
-        for c in sorted(final_nodes):
-            fout.write(c + "\n")
-    print(f"[main] node list -> {out_cui_txt}")
+    N_WORKERS = default_workers()  # Processes for the MRREL scans
+    REL_FILTER = None  # e.g. CLINICAL_REL_FILTER for a clinical-only subgraph
+    PRUNE = None  # e.g. {"max_degree": 2000, "max_frontier": 200_000} to stop hubs from flooding later hops
+    SEED_TERMS = []  # e.g. ["Lewy body disease"]: extra seeds, looked up by name in the MRCONSO name index
+
+    # Stages are cached by MRREL identity + parameters + code (see stage_cache); --no-cache always recomputes
+    use_cache = not args.no_cache
+    seeds = list(SEED_CUIS)
+    if SEED_TERMS:
+        cached_stage("name_index", lambda: build_name_index(mrconso_path, name_index_dir), inputs=[mrconso_path],
+                     outputs=[name_index_dir], code=code_version(build_name_index), enabled=use_cache)
+        seeds += [cui for cui in seed_cuis(load_name_index(name_index_dir), SEED_TERMS) if cui not in seeds]
+    bfs_params = {"seeds": seeds, "max_hops": MAX_HOPS, "rel_filter": REL_FILTER, "prune": PRUNE}
+    stem = os.path.splitext(out_cui_txt)[0]
+    bfs_outputs = [out_cui_txt, stem + "_hops.npy", stem + "_seeds.npy", stem + "_seeds.txt"]
+
+    def bfs_stage():
+        # Stage 0: Read MRREL once into the CSR adjacency index (reused by later runs and any seed)
+        if not index_matches(index_dir, REL_FILTER, mrrel_path):
+            build_adjacency_index(str(mrrel_path), index_dir, rel_filter=REL_FILTER)
+
+        # 第1阶段：只存节点 BFS (in memory on the index, bfs_node_only is the scan-based fallback)
+        start_time = time.time()
+        index = load_adjacency_index(index_dir)
+        hops, seed_of_node = bfs_multi_seed(
+            index,
+            seed_cuis=seeds,
+            max_hops=MAX_HOPS,
+            prune=PRUNE
+        )
+        n_nodes = int((hops >= 0).sum())
+        end_time = time.time()
+        print(f"[main] BFS node-only done, seeds={len(seeds)}, total nodes={n_nodes}, "
+              f"cost={end_time - start_time:.2f}s")
+
+        # Write node list, with per-node hop distance and originating seed next to it
+        write_bfs_result(index, seeds, hops, seed_of_node, out_cui_txt)
+        return n_nodes
+
+    cached_stage("pd_nhop_bfs", bfs_stage, inputs=[mrrel_path], outputs=bfs_outputs, params=bfs_params,
+                 code=code_version(bfs_stage), enabled=use_cache)
 
     # Stage 2: One-time MRREL filtering
-    start_time = time.time()
-    filter_rel_by_cuis(str(mrrel_path), final_nodes, str(out_rel_csv))
-    end_time = time.time()
-    print(f"[main] filter_rel_by_cuis done, cost={end_time - start_time:.2f}s")
+    def filter_stage():
+        start_time = time.time()
+        final_nodes = load_cui_ids(out_cui_txt)
+        filter_rel_by_cuis(str(mrrel_path), final_nodes, str(out_rel_csv), rel_filter=REL_FILTER,
+                           n_workers=N_WORKERS, resume=args.resume)
+        end_time = time.time()
+        print(f"[main] filter_rel_by_cuis done, cost={end_time - start_time:.2f}s")
+
+    cached_stage("pd_nhop_rel", filter_stage, inputs=[mrrel_path, out_cui_txt], outputs=[out_rel_csv],
+                 params={"rel_filter": REL_FILTER}, code=code_version(filter_rel_by_cuis),
+                 enabled=use_cache)
+
+    # Stage 3: Drop duplicate rows and the inverse twin of every edge, with bounded memory
+    cached_stage("pd_nhop_rel_dedup",
+                 lambda: dedup_rel_csv(str(out_rel_csv), str(out_rel_dedup_csv), collapse_inverse=True,
+                                       inverses=load_inverses(mrdoc_path)),
+                 inputs=[out_rel_csv, mrdoc_path], outputs=[out_rel_dedup_csv], params={"collapse_inverse": True},
+                 code=code_version(dedup_rel_csv), enabled=use_cache)
 
     print("[main] Done. See results in:")
     print(f"   * {out_rel_csv}")
+    print(f"   * {out_rel_dedup_csv}")
     print(f"   * {out_cui_txt}")
 
 
@@ -0,0 +1,181 @@
+"""
+Relevance-ranked PD subgraph: personalized PageRank (random walk with restart) from the seed CUIs
+over the MRREL adjacency index, as an alternative to the fixed-radius n-hop BFS.
+
+    score = alpha * s + (1 - alpha) * A D^-1 score     (s = restart distribution over the seeds)
+
+Two solvers on the same index (mrrel_index.build_adjacency_index, read once from MRREL):
+    - personalized_pagerank: power iteration with a SciPy CSR matrix over the whole graph
+    - ppr_push: vectorized forward push, touches only the neighborhood of the seeds;
+                every node's score is within epsilon * degree of the exact value
+The top-N (or score >= epsilon) nodes are then cut out of MRREL with filter_rel_by_cuis.
+"""
+
+import os
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from scripts.kg_builder.mrrel_index import (
+    build_adjacency_index, gather_neighbors, index_matches, load_adjacency_index
+)
+from scripts.kg_builder.pd_bfs_nhop import SEED_CUIS, filter_rel_by_cuis
+from scripts.umls.rrf_parallel import default_workers
+
+# Restart probability of the walk (0.15 = ~6.7 steps on average before returning to a seed)
+ALPHA = 0.15
+MAX_ITER = 100
+TOL = 1e-10
+
+# Forward push stops when every residual is below PUSH_EPSILON * degree
+PUSH_EPSILON = 1e-7
+
+TOP_N = 50_000
+
+
+def _seed_vector(index, seed_cuis, seed_weights=None):
+    # Restart distribution over the index ids of the seeds found in the index
+    n_nodes = len(index["offsets"]) - 1
+    restart = np.zeros(n_nodes, dtype=np.float64)
+    weights = seed_weights if seed_weights is not None else [1.0] * len(seed_cuis)
+    for cui, weight in zip(seed_cuis, weights):
+        node = index["cui_to_id"].get(cui.upper())
+        if node is None:
+            print(f"[ppr] {cui} not found in index")
+            continue
+        restart[node] += weight
+    if restart.sum() == 0:
+        raise ValueError("None of the seed CUIs is in the index")
+    return restart / restart.sum()
+
+
+def adjacency_matrix(index):
+    """
+    SciPy CSR view of the index (shares offsets / neighbors, data = 1)
+    """
+    n_nodes = len(index["offsets"]) - 1
+    neighbors = np.asarray(index["neighbors"])
+    return sp.csr_matrix((np.ones(len(neighbors), dtype=np.float64), neighbors, np.asarray(index["offsets"])),
+                         shape=(n_nodes, n_nodes))
+
+
+def personalized_pagerank(index, seed_cuis, alpha=ALPHA, tol=TOL, max_iter=MAX_ITER, seed_weights=None):
+    """
+    Power iteration on the whole graph. Mass at nodes without edges goes back to the seeds.
+    Return: scores (float64 over index ids, sums to 1)
+    """
+    start_t = time.time()
+    restart = _seed_vector(index, seed_cuis, seed_weights)
+    adjacency = adjacency_matrix(index)
+    degrees = np.asarray(index["degrees"], dtype=np.float64)
+    inv_degrees = np.divide(1.0, degrees, out=np.zeros_like(degrees), where=degrees > 0)
+    dangling = degrees == 0
+
+    scores = restart.copy()
+    for iteration in range(1, max_iter + 1):
+        # The index is undirected, so A^T = A
+        walked = adjacency @ (scores * inv_degrees)
+        new_scores = alpha * restart + (1 - alpha) * (walked + scores[dangling].sum() * restart)
+        delta = np.abs(new_scores - scores).sum()
+        scores = new_scores
+        if delta < tol:
+            break
+    print(f"[personalized_pagerank] iterations={iteration}, delta={delta:.2e}, cost={time.time() - start_t:.2f}s")
+    return scores
+
+
+def ppr_push(index, seed_cuis, alpha=ALPHA, epsilon=PUSH_EPSILON, seed_weights=None):
+    """
+    Forward push (Andersen-Chung-Lang), all nodes with residual >= epsilon * degree pushed together per round.
+    Return: scores (float64 over index ids; an under-estimate, each node off by at most epsilon * degree)
+    """
+    start_t = time.time()
+    offsets, neighbors = index["offsets"], index["neighbors"]
+    degrees = np.asarray(index["degrees"], dtype=np.float64)
+    residual = _seed_vector(index, seed_cuis, seed_weights)
+    scores = np.zeros_like(residual)
+
+    rounds = pushes = 0
+    active = np.flatnonzero((residual >= epsilon * degrees) & (residual > 0))
+    while len(active):
+        rounds += 1
+        pushes += len(active)
+        mass = residual[active]
+        residual[active] = 0
+        scores[active] += alpha * mass
+        # Nodes without edges keep their whole mass as score
+        isolated = degrees[active] == 0
+        scores[active[isolated]] += (1 - alpha) * mass[isolated]
+
+        targets, source = gather_neighbors(offsets, neighbors, active, return_source=True)
+        spread = ((1 - alpha) * mass / np.maximum(degrees[active], 1))[source]
+        touched, position = np.unique(targets, return_inverse=True)
+        residual[touched] += np.bincount(position, weights=spread, minlength=len(touched))
+        active = touched[residual[touched] >= epsilon * degrees[touched]]
+    print(f"[ppr_push] rounds={rounds}, pushes={pushes}, nonzero={int((scores > 0).sum())}, "
+          f"cost={time.time() - start_t:.2f}s")
+    return scores
+
+
+def select_nodes(index, scores, seed_cuis, top_n=None, epsilon=None):
+    """
+    Highest-scoring nodes: the top_n best and / or those with score >= epsilon; seeds are always kept.
+    Return: index ids ordered by descending score
+    """
+    ranked = np.flatnonzero(scores > 0)
+    ranked = ranked[np.lexsort((ranked, -scores[ranked]))]
+    if epsilon is not None:
+        ranked = ranked[scores[ranked] >= epsilon]
+    if top_n is not None:
+        ranked = ranked[:top_n]
+    seeds = [index["cui_to_id"][c.upper()] for c in seed_cuis if c.upper() in index["cui_to_id"]]
+    missing = np.setdiff1d(np.array(seeds, dtype=np.int64), ranked)
+    return np.concatenate([missing, ranked]).astype(np.int64)
+
+
+def write_ppr_result(index, scores, selected, out_cui_txt):
+    """
+    Write the selected CUIs (sorted, one per line, like write_bfs_result) to out_cui_txt, and
+    <name>_scores.npy (float64 PPR score aligned with its lines) next to it
+    """
+    cuis = index["cuis"]
+    ordered = selected[np.argsort([cuis[i] for i in selected], kind="stable")]
+    with open(out_cui_txt, "w", encoding="utf-8") as fout:
+        for i in ordered:
+            fout.write(cuis[i] + "\n")
+    np.save(os.path.splitext(out_cui_txt)[0] + "_scores.npy", scores[ordered])
+    print(f"[write_ppr_result] {len(ordered)} CUIs -> {out_cui_txt} (+ _scores.npy)")
+    return [cuis[i] for i in ordered]
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Absolute path
+    mrrel_path = "E:\\Data\\2024AB\\META\\MRREL.RRF"
+    index_dir = os.path.join(out_dir, "mrrel_index")
+    out_cui_txt = os.path.join(out_dir, "pd_ppr_cuis.txt")
+    out_rel_csv = os.path.join(out_dir, "pd_ppr_rel.csv")
+
+    REL_FILTER = None  # Same meaning as in pd_bfs_nhop
+    USE_PUSH = True  # False: exact power iteration over the whole graph
+
+    if not index_matches(index_dir, REL_FILTER, mrrel_path):
+        build_adjacency_index(mrrel_path, index_dir, rel_filter=REL_FILTER)
+    index = load_adjacency_index(index_dir)
+
+    if USE_PUSH:
+        scores = ppr_push(index, SEED_CUIS)
+    else:
+        scores = personalized_pagerank(index, SEED_CUIS)
+    selected = select_nodes(index, scores, SEED_CUIS, top_n=TOP_N)
+    nodes = write_ppr_result(index, scores, selected, out_cui_txt)
+
+    filter_rel_by_cuis(mrrel_path, nodes, out_rel_csv, rel_filter=REL_FILTER, n_workers=default_workers())
+
+
+if __name__ == "__main__":
+    main()
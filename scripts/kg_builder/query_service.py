@@ -0,0 +1,548 @@
+"""
+Long-running local query service over the PD subgraph, so consumers ask questions over HTTP instead of
+re-running the scripts and paying the load cost every time.
+
+The graph export (graph_export.export_graph_arrays, pd_nhop_graph) and the concept store
+(concept_mapping.build_concept_store) are loaded once; both are memory-mapped, and the two CSR
+adjacency structures below are built from edge_index at startup.
+
+Endpoints (GET with query parameters, or POST with a JSON object of the same parameters; every endpoint
+takes a batch of CUIs, "cui=C0030567,C0023570" or {"cuis": [...]}, and answers per CUI):
+    /neighbors?cui=...[&tui=T047][&limit=1000]        - labeled neighbors (relation, direction out / in)
+    /nhop?cui=...&hops=2[&max_degree=][&tui=][&limit=] - CUIs within hops, nearest first, with hop distances
+    /label?cui=...                                     - preferred name
+    /sty?cui=...                                       - semantic types [(TUI, STY), ...]
+    /stats                                             - request / latency / cache counters
+tui keeps only result CUIs with that semantic type. CUIs that are not in the graph / store come back as
+null and are listed under "not_found".
+
+Expanded n-hop neighborhoods are kept in an LRU cache (bounded by entries and by total nodes), and
+concurrent requests for a neighborhood that is being expanded wait for the same expansion. Expansions run
+in a worker thread, so label lookups are answered while a large neighborhood is being computed.
+
+Run from the project root:
+    python -m scripts.kg_builder.query_service --port 8765
+    python -m experiments.load_test_query_service --port 8765
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from scripts.kg_builder.concept_mapping import load_concept_store
+from scripts.kg_builder.graph_export import load_graph_arrays
+from scripts.kg_builder.mrrel_index import gather_neighbors
+from scripts.umls.cui_intern import cui_strings
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Neighborhoods kept by the LRU cache, and the total nodes they may hold (5 bytes per node)
+CACHE_ENTRIES = 4096
+CACHE_MAX_NODES = 20_000_000
+
+# Per request limits: CUIs in one batch, hops of /nhop, CUIs listed per result (default of limit=)
+MAX_BATCH = 1000
+MAX_HOPS = 4
+RESULT_LIMIT = 1000
+
+# Latencies per endpoint kept for the percentiles of /stats
+LATENCY_WINDOW = 10_000
+
+DIRECTIONS = ("out", "in")
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+def sorted_positions(sorted_ids, ids):
+    """
+    Position of every id in the sorted array sorted_ids, -1 for ids that are not in it (or negative)
+    """
+    sorted_ids = np.asarray(sorted_ids)
+    ids = np.asarray(ids)
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where((ids >= 0) & (sorted_ids[positions] == ids), positions, -1)
+
+
+def _row_offsets(rows, n_rows):
+    # CSR offsets of a sorted row id array
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=offsets[1:])
+    return offsets
+
+
+def load_service_data(graph_dir, store_dir):
+    """
+    Load the graph export and the concept store, and build the adjacency the queries use:
+        offsets / neighbors               - undirected, de-duplicated CSR (n-hop expansion)
+        label_offsets / label_neighbors   - every edge at both ends with its relation id and direction,
+        label_types / label_dirs            sorted by (node, neighbor, relation) (/neighbors)
+        store_rows                        - concept store row of every node, -1 if it has none
+    Return: dict with the arrays above plus node_cuis, relations, degrees, store, load_s
+    """
+    start_time = time.time()
+    graph = load_graph_arrays(graph_dir)
+    store = load_concept_store(store_dir)
+    node_cuis = np.asarray(graph["node_cuis"])
+    n_nodes = len(node_cuis)
+    src, dst = np.asarray(graph["edge_index"][0]), np.asarray(graph["edge_index"][1])
+    edge_type = np.asarray(graph["edge_type"])
+
+    # Every edge at both ends; self loops are listed once, as "out"
+    loop = src == dst
+    node = np.concatenate([src, dst[~loop]])
+    other = np.concatenate([dst, src[~loop]])
+    types = np.concatenate([edge_type, edge_type[~loop]])
+    dirs = np.concatenate([np.zeros(len(src), dtype=np.int64), np.ones(int((~loop).sum()), dtype=np.int64)])
+    # Sort by (node, neighbor, relation, direction) through a single int64 key
+    order = np.argsort(((node * n_nodes + other) * max(len(graph["relations"]), 1) + types) * 2 + dirs,
+                       kind="stable")
+    node, other, types, dirs = node[order], other[order].astype(np.int32), types[order].astype(np.int32), \
+        dirs[order].astype(np.int8)
+    label_offsets = _row_offsets(node, n_nodes)
+
+    # The first entry of every (node, neighbor) pair, without self loops: the same CSR as edges_to_csr
+    distinct = node != other
+    distinct[1:] &= (node[1:] != node[:-1]) | (other[1:] != other[:-1])
+    offsets = _row_offsets(node[distinct], n_nodes)
+
+    data = {
+        "node_cuis": node_cuis,
+        "relations": graph["relations"],
+        "offsets": offsets,
+        "neighbors": other[distinct],
+        "degrees": np.diff(offsets).astype(np.int32),
+        "label_offsets": label_offsets,
+        "label_neighbors": other,
+        "label_types": types,
+        "label_dirs": dirs,
+        "store": store,
+        "store_rows": sorted_positions(store["cuis"], node_cuis),
+    }
+    data["load_s"] = time.time() - start_time
+    print(f"[load_service_data] nodes={n_nodes}, edges={len(src)}, concepts={len(store['cuis'])}, "
+          f"cost={data['load_s']:.2f}s")
+    return data
+
+
+def expand_neighborhood(data, node, hops, max_degree=None):
+    """
+    All nodes within hops of node (node included), level by level; nodes with more than max_degree
+    neighbors are reached but not expanded (node itself always is).
+    Return: nodes (int32, by hop, then id), their hop distances (int8)
+    """
+    offsets, neighbors, degrees = data["offsets"], data["neighbors"], data["degrees"]
+    visited = np.zeros(len(degrees), dtype=bool)
+    visited[node] = True
+    levels = [np.array([node], dtype=np.int32)]
+    for _ in range(hops):
+        frontier = levels[-1]
+        if max_degree is not None and len(levels) > 1:
+            frontier = frontier[degrees[frontier] <= max_degree]
+        # Marking a node mask de-duplicates and sorts the level without sorting the (hub-sized) neighbor lists
+        fresh = np.zeros(len(degrees), dtype=bool)
+        fresh[gather_neighbors(offsets, neighbors, frontier)] = True
+        fresh &= ~visited
+        reached = np.flatnonzero(fresh).astype(np.int32)
+        if len(reached) == 0:
+            break
+        visited |= fresh
+        levels.append(reached)
+    hop_of = np.repeat(np.arange(len(levels), dtype=np.int8), [len(level) for level in levels])
+    return np.concatenate(levels), hop_of
+
+
+class NeighborhoodCache:
+    """
+    LRU cache of expanded neighborhoods, bounded by the number of entries and their total nodes.
+    counts: hits, misses (expansions), evictions, coalesced (waited for an expansion already running)
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES, max_nodes=CACHE_MAX_NODES):
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self.entries = collections.OrderedDict()
+        self.n_nodes = 0
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "coalesced": 0}
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            return None
+        self.entries.move_to_end(key)
+        self.counts["hits"] += 1
+        return value
+
+    def put(self, key, value):
+        size = len(value[0])
+        if size > self.max_nodes or key in self.entries:
+            return
+        self.entries[key] = value
+        self.n_nodes += size
+        while len(self.entries) > self.max_entries or self.n_nodes > self.max_nodes:
+            _, evicted = self.entries.popitem(last=False)
+            self.n_nodes -= len(evicted[0])
+            self.counts["evictions"] += 1
+
+    def stats(self):
+        return dict(self.counts, entries=len(self.entries), nodes=self.n_nodes, max_entries=self.max_entries,
+                    max_nodes=self.max_nodes)
+
+
+class EndpointCounters:
+    """
+    Requests, errors, CUIs looked up and a window of recent latencies of one endpoint
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.requests = 0
+        self.errors = 0
+        self.lookups = 0
+        self.total_s = 0.0
+        self.latencies = collections.deque(maxlen=window)
+
+    def record(self, seconds, lookups, error):
+        self.requests += 1
+        self.errors += error
+        self.lookups += lookups
+        self.total_s += seconds
+        self.latencies.append(seconds)
+
+    def stats(self):
+        ms = np.array(self.latencies) * 1000
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99]).tolist() if len(ms) else (None, None, None)
+        return {"requests": self.requests, "errors": self.errors, "lookups": self.lookups,
+                "mean_ms": self.total_s * 1000 / self.requests if self.requests else None,
+                "p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "max_ms": float(ms.max()) if len(ms) else None}
+
+
+class QueryService:
+    """
+    The endpoints of the module docstring over load_service_data output
+    """
+
+    def __init__(self, data, cache_entries=CACHE_ENTRIES, cache_max_nodes=CACHE_MAX_NODES):
+        self.data = data
+        self.cache = NeighborhoodCache(cache_entries, cache_max_nodes)
+        self.pending = {}
+        self.tui_masks = {}
+        self.counters = collections.defaultdict(EndpointCounters)
+        self.started = time.time()
+        self.routes = {"/neighbors": self.neighbors, "/nhop": self.nhop, "/label": self.label,
+                       "/sty": self.sty, "/stats": self.stats}
+
+    #############################
+    # Lookups
+    #############################
+
+    def node_ids(self, cuis):
+        # Graph node id of every CUI, -1 if it is not in the graph
+        return sorted_positions(self.data["node_cuis"], _cui_ids(cuis))
+
+    def store_rows(self, cuis):
+        # Concept store row of every CUI, -1 if the store does not have it
+        return sorted_positions(self.data["store"]["cuis"], _cui_ids(cuis))
+
+    def tui_mask(self, tui):
+        """
+        Boolean mask over graph nodes: node has semantic type tui (masks are kept per TUI)
+        """
+        mask = self.tui_masks.get(tui)
+        if mask is None:
+            store = self.data["store"]
+            codes = [code for code, (vocab_tui, _) in enumerate(store["sty_vocab"]) if vocab_tui == tui]
+            sty_offsets = np.asarray(store["sty_offsets"])
+            row_has = np.zeros(len(sty_offsets), dtype=bool)
+            if codes:
+                items = np.flatnonzero(np.asarray(store["sty_codes"]) == codes[0])
+                row_has[np.searchsorted(sty_offsets, items, side="right") - 1] = True
+            rows = self.data["store_rows"]
+            mask = self.tui_masks[tui] = row_has[rows] & (rows >= 0)
+        return mask
+
+    async def neighborhood(self, node, hops, max_degree):
+        """
+        expand_neighborhood through the LRU cache; misses are expanded in a worker thread, and requests
+        arriving while the same neighborhood is expanded wait for that expansion
+        """
+        key = (node, hops, max_degree)
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        future = self.pending.get(key)
+        if future is not None:
+            self.cache.counts["coalesced"] += 1
+            return await asyncio.shield(future)
+        self.cache.counts["misses"] += 1
+        future = self.pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await asyncio.to_thread(expand_neighborhood, self.data, node, hops, max_degree)
+            self.cache.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here, so an expansion nobody else waited for does not log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
+
+    #############################
+    # Endpoints
+    #############################
+
+    async def neighbors(self, cuis, params):
+        limit = _int_param(params, "limit", RESULT_LIMIT)
+        tui = _tui_param(params)
+        data = self.data
+        results = {}
+        for cui, node in zip(cuis, self.node_ids(cuis).tolist()):
+            if node < 0:
+                results[cui] = None
+                continue
+            start, end = data["label_offsets"][node], data["label_offsets"][node + 1]
+            others = data["label_neighbors"][start:end]
+            keep = slice(None) if tui is None else self.tui_mask(tui)[others]
+            others, types, dirs = others[keep], data["label_types"][start:end][keep], data["label_dirs"][start:end][keep]
+            results[cui] = {
+                "degree": int(data["degrees"][node]),
+                "n_neighbors": len(others),
+                "neighbors": [{"cui": other, "relation": data["relations"][rel], "direction": DIRECTIONS[d]}
+                              for other, rel, d in zip(cui_strings(data["node_cuis"][others[:limit]]),
+                                                       types[:limit].tolist(), dirs[:limit].tolist())],
+            }
+        return results
+
+    async def nhop(self, cuis, params):
+        hops = _int_param(params, "hops", 2)
+        if not 1 <= hops <= MAX_HOPS:
+            raise ValueError(f"hops must be between 1 and {MAX_HOPS}, not {hops}")
+        max_degree = _int_param(params, "max_degree", None)
+        limit = _int_param(params, "limit", RESULT_LIMIT)
+        tui = _tui_param(params)
+        node_cuis = self.data["node_cuis"]
+        nodes = self.node_ids(cuis).tolist()
+        # The CUIs of the batch are expanded concurrently
+        known = [node for node in nodes if node >= 0]
+        by_node = dict(zip(known, await asyncio.gather(*(self.neighborhood(node, hops, max_degree)
+                                                         for node in known))))
+        results = {}
+        for cui, node in zip(cuis, nodes):
+            if node < 0:
+                results[cui] = None
+                continue
+            reached, hop_of = by_node[node]
+            if tui is not None:
+                keep = self.tui_mask(tui)[reached]
+                reached, hop_of = reached[keep], hop_of[keep]
+            results[cui] = {
+                "n_nodes": len(reached),
+                "per_hop": np.bincount(hop_of, minlength=hops + 1).tolist(),
+                "cuis": cui_strings(node_cuis[reached[:limit]]),
+                "hops": hop_of[:limit].tolist(),
+            }
+        return results
+
+    async def label(self, cuis, params):
+        store = self.data["store"]
+        results = {}
+        for cui, row in zip(cuis, self.store_rows(cuis).tolist()):
+            if row < 0:
+                results[cui] = None
+                continue
+            start, end = store["name_offsets"][row], store["name_offsets"][row + 1]
+            results[cui] = bytes(store["names"][start:end]).decode("utf-8")
+        return results
+
+    async def sty(self, cuis, params):
+        store = self.data["store"]
+        vocab = store["sty_vocab"]
+        results = {}
+        for cui, row in zip(cuis, self.store_rows(cuis).tolist()):
+            if row < 0:
+                results[cui] = None
+                continue
+            start, end = store["sty_offsets"][row], store["sty_offsets"][row + 1]
+            results[cui] = [list(vocab[code]) for code in store["sty_codes"][start:end].tolist()]
+        return results
+
+    async def stats(self, cuis, params):
+        uptime = time.time() - self.started
+        requests = sum(counter.requests for counter in self.counters.values())
+        return {
+            "uptime_s": uptime,
+            "requests": requests,
+            "errors": sum(counter.errors for counter in self.counters.values()),
+            "requests_per_s": requests / uptime if uptime else None,
+            "in_flight_expansions": len(self.pending),
+            "endpoints": {name: counter.stats() for name, counter in sorted(self.counters.items())},
+            "cache": self.cache.stats(),
+            "graph": {"nodes": len(self.data["node_cuis"]), "neighbor_entries": len(self.data["label_neighbors"]),
+                      "load_s": self.data["load_s"]},
+        }
+
+    #############################
+    # Requests
+    #############################
+
+    async def dispatch(self, method, target, body):
+        """
+        Answer one request.
+        Return: (HTTP status, JSON-serializable payload)
+        """
+        start_time = time.perf_counter()
+        url = urlsplit(target)
+        endpoint = self.routes.get(url.path)
+        name = url.path if endpoint is not None else "unknown"
+        cuis = []
+        try:
+            if endpoint is None:
+                status, payload = 404, {"error": f"Unknown endpoint {url.path}, expected one of {sorted(self.routes)}"}
+            elif method not in ("GET", "POST"):
+                status, payload = 405, {"error": f"{method} is not supported, use GET or POST"}
+            else:
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if method == "POST" and body:
+                    params.update(json.loads(body))
+                cuis = _cui_param(params) if url.path != "/stats" else []
+                results = await endpoint(cuis, params)
+                if url.path == "/stats":
+                    status, payload = 200, results
+                else:
+                    status, payload = 200, {"results": results,
+                                            "not_found": [cui for cui, value in results.items() if value is None]}
+        except (ValueError, TypeError) as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        self.counters[name].record(time.perf_counter() - start_time, len(cuis), status != 200)
+        return status, payload
+
+    async def handle_connection(self, reader, writer):
+        """
+        HTTP/1.1 over one connection: requests are answered in order until the client closes or asks to
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    header, _, value = line.decode("latin-1").partition(":")
+                    headers[header.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    writer.write(_http_response(400, {"error": "Malformed request line"}, keep_alive=False))
+                    break
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self.dispatch(method, target, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(_http_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _cui_ids(cuis):
+    # cui_numbers for the few upper-cased CUIs of a request, without its pandas overhead (~1 ms per call)
+    return np.array([int(cui[1:]) if cui[:1] == "C" and cui[1:].isdigit() else -1 for cui in cuis],
+                    dtype=np.int64)
+
+
+def _int_param(params, key, default):
+    value = params.get(key)
+    return default if value in (None, "") else int(value)
+
+
+def _tui_param(params):
+    tui = params.get("tui")
+    return str(tui).strip().upper() if tui else None
+
+
+def _cui_param(params):
+    # "cuis": [...] (JSON) or "cui": "C1,C2" / "cuis": "C1,C2" (query string), de-duplicated in order
+    cuis = params.get("cuis", params.get("cui"))
+    if cuis is None:
+        raise ValueError("No CUIs given (cui=C0030567,... or {\"cuis\": [...]})")
+    if isinstance(cuis, str):
+        cuis = cuis.split(",")
+    cuis = list(dict.fromkeys(str(cui).strip().upper() for cui in cuis if str(cui).strip()))
+    if not cuis or len(cuis) > MAX_BATCH:
+        raise ValueError(f"Between 1 and {MAX_BATCH} CUIs per request, got {len(cuis)}")
+    return cuis
+
+
+def _http_response(status, payload, keep_alive):
+    body = json.dumps(payload).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    """
+    Serve until cancelled, on host:port or, with unix_path, on a Unix socket (not on Windows)
+    """
+    if unix_path:
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix_path)
+        where = unix_path
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        where = f"http://{host}:{port}"
+    print(f"[serve] listening on {where}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    out_dir = os.path.join(base_dir, "data", "umls_output")
+
+    parser = argparse.ArgumentParser(description="Local query service over the PD subgraph")
+    parser.add_argument("--graph-dir", default=os.path.join(out_dir, "pd_nhop_graph"),
+                        help="graph_export.export_graph_arrays output")
+    parser.add_argument("--store-dir", default=os.path.join(out_dir, "concept_store"),
+                        help="concept_mapping.build_concept_store output")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", default=None, help="serve on this Unix socket instead of host:port")
+    parser.add_argument("--cache-entries", type=int, default=CACHE_ENTRIES)
+    parser.add_argument("--cache-max-nodes", type=int, default=CACHE_MAX_NODES)
+    args = parser.parse_args()
+
+    service = QueryService(load_service_data(args.graph_dir, args.store_dir),
+                           cache_entries=args.cache_entries, cache_max_nodes=args.cache_max_nodes)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = asyncio.run(service.stats([], {}))
+        print(f"[main] {stats['requests']} requests, {stats['errors']} errors, cache {stats['cache']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,39 @@
-import csv
+import argparse
 import os
 import pandas as pd
 
-# Set the block size, depending on the memory can be adjusted to large/small
-CHUNKSIZE = 100_000
+from scripts.umls.cui_intern import cui_isin, ids_signature, make_cui_ids
+from scripts.umls.rrf_checkpoint import checkpointed_scan
+from scripts.umls.rrf_parallel import scan_rrf
+from scripts.umls.rrf_prefilter import cui_prefilter
+from scripts.umls.rrf_reader import COL_CONSO, COL_REL, COL_STY
+from scripts.umls.stage_cache import cached_stage, code_version
+from scripts.umls.stage_metrics import add_metrics_args, configure_metrics, finish_stage, observe, stage_metrics, timed
 
 # CUI of Parkinson's disease
 PD_CUI = "C0030567"
 
 
-# Column name definition: Refer to the UMLS Reference Manual
-COL_CONSO = [
-    "CUI", "LAT", "TS", "LUI", "STT", "SUI", "ISPREF", "AUI", "SAUI", "SCUI", "SDUI",
-    "SAB", "TTY", "CODE", "STR", "SRL", "SUPPRESS", "CVF"
-]
+def _pd_rel_chunk(chunk, cui):
+    # Per-chunk work of filter_mrrel_for_pd
+    return chunk[(chunk['CUI1'] == cui) | (chunk['CUI2'] == cui)]
 
-COL_REL = [
-    "CUI1", "AUI1", "STYPE1", "REL", "CUI2", "AUI2", "STYPE2", "RELA", "RUI", "SRUI",
-    "SAB", "SL", "RG", "DIR", "SUPPRESS", "CVF"
-]
-
-COL_STY = [
-    "CUI", "TUI", "STN", "STY", "ATUI", "CVF"
-]
 
 def filter_mrrel_for_pd(rrf_path, output_path):
     """
     Read in chunks from MRREL, keeping only the lines directly related to PD_CUI, written to output_path.
+    Progress and totals go to the stage_metrics sinks (rows_out=0: no matching data in the whole file).
     """
-    #
-    print(f"\n[filter_mrrel_for_pd] Reading {rrf_path} in chunks...")
-    # Detection tag
-    has_data = False
+    metrics = stage_metrics("filter_mrrel_for_pd", source=str(rrf_path), cui=PD_CUI)
     with open(output_path, "w", encoding="utf-8", newline="") as fout:
         fout.write("|".join(COL_REL) + "\n")
-        for i, chunk in enumerate(
-                pd.read_csv(rrf_path, sep="|",
-                            names=COL_REL,
-                            dtype=str,
-                            chunksize=CHUNKSIZE,
-                            engine='python',
-                            quoting=csv.QUOTE_NONE,
-                            usecols=range(len(COL_REL)))):
-            filtered = chunk[(chunk['CUI1'].str.upper() == PD_CUI) | (chunk['CUI2'].str.upper() == PD_CUI)]
+        for filtered in scan_rrf(rrf_path, COL_REL, _pd_rel_chunk, shared=PD_CUI,
+                                 prefilter=cui_prefilter([PD_CUI], ["CUI1", "CUI2"]), metrics=metrics):
             if not filtered.empty:
-                filtered.to_csv(fout, header=False, index=False,sep="|")
-                has_data = True
-                print(f"Data found in chunk {i}, total rows: {len(filtered)}")
-    if not has_data:
-        print("No matching data found in the entire file.")
-    print(f"\n[filter_mrrel_for_pd]Done. Output -> {output_path}")
+                with timed(metrics, "write_s"):
+                    filtered.to_csv(fout, header=False, index=False,sep="|")
+            observe(metrics, rows_out=len(filtered))
+    finish_stage(metrics, output=str(output_path))
 
 def get_related_cuis_from_rel(rel_csv_path):
     """
@@ -67,72 +51,69 @@ def get_related_cuis_from_rel(rel_csv_path):
     print(f"\n[get_related_cuis_from_rel] CUIs sample: {list(cui_set)[:10]}")
     return cui_set
 
-def filter_mrconso(rrf_path, related_cuis, output_path):
+def _conso_chunk(chunk, cui_ids):
+    # Per-chunk work of filter_mrconso, also run inside scan_rrf worker processes
+    df_english = chunk[chunk["LAT"].str.upper() == "ENG"]
+    return len(df_english), df_english[cui_isin(df_english["CUI"], cui_ids)]
+
+
+def _sty_chunk(chunk, cui_ids):
+    # Per-chunk work of filter_mrsty
+    return chunk[cui_isin(chunk["CUI"], cui_ids)]
+
+
+def filter_mrconso(rrf_path, related_cuis, output_path, n_workers=1, resume=False):
     """
-    Block read MRCONSO, keeping only:
+    Block read MRCONSO (RRF file or Parquet dataset), keeping only:
     1) English (LAT=ENG)
-    2) CUI is in related_cuis
+    2) CUI is in related_cuis (CUI strings or a CUI id array, see cui_intern)
+    n_workers > 1 scans byte ranges of the RRF file in parallel processes (output order unchanged)
+    The output is checkpointed (see rrf_checkpoint); resume=True continues an interrupted run with the same CUIs.
+    Lines of other CUIs are dropped by the byte-level prefilter unparsed, so english_rows only counts
+    the English rows of the parsed lines.
     """
-    print(f"\n[filter_mrconso] Reading {rrf_path} in chunks...")
-    # Record the total number of matches
-    total_matched = 0
-    with open(output_path, mode='w',encoding='utf-8',newline="") as fout:
-        fout.write("|".join(COL_CONSO) + "\n")
-
-        for idx,chunk in enumerate  ( pd.read_csv(rrf_path,
-                                 sep="|",
-                                 names=COL_CONSO,
-                                 dtype=str,
-                                 engine="python",
-                                 quoting=csv.QUOTE_NONE,
-                                 chunksize=CHUNKSIZE,
-                                 usecols=range(len(COL_CONSO)))):
-            print("Related CUIs:", list(related_cuis)[:10])
-
-            df_english = chunk[chunk["LAT"].str.upper() == "ENG"]
-            df_filtered = df_english[df_english["CUI"].isin(related_cuis)]
-
-            # Output debugging information on each chunk processing
-            matched_count = len(df_filtered)
-            total_matched += matched_count
-            print(f"[filter_mrconso] chunk {idx} : English rows = {len(df_english)} , Matched rows={matched_count} ]")
-
-            if not df_filtered.empty:
+    cui_ids = make_cui_ids(related_cuis)
+    metrics = stage_metrics("filter_mrconso", source=str(rrf_path), cuis=len(cui_ids), n_workers=n_workers)
+    results = checkpointed_scan(rrf_path, COL_CONSO, _conso_chunk, output_path,
+                                header="|".join(COL_CONSO) + "\n", shared=cui_ids, n_workers=n_workers,
+                                cui_filter={"CUI": cui_ids}, prefilter=cui_prefilter(cui_ids, ["CUI"]),
+                                resume=resume, signature=ids_signature(cui_ids), metrics=metrics)
+    for fout, (english_count, df_filtered) in results:
+        if not df_filtered.empty:
+            with timed(metrics, "write_s"):
                 df_filtered.to_csv(fout, sep="|",header=False,index=False)
+        # Records the English rows and the matches of every chunk
+        observe(metrics, english_rows=english_count, rows_out=len(df_filtered))
 
-    print(f"\n[filter_mrconso] Done. Output -> {output_path}")
+    finish_stage(metrics, output=str(output_path))
 
-def filter_mrsty(rrf_path, related_cuis, output_path):
+def filter_mrsty(rrf_path, related_cuis, output_path, n_workers=1, resume=False):
     """
-    Block read MRSTY, leaving CUI only in related_cuis
+    Block read MRSTY (RRF file or Parquet dataset), leaving CUI only in related_cuis
+    n_workers > 1 scans byte ranges of the RRF file in parallel processes (output order unchanged)
+    The output is checkpointed like filter_mrconso's.
     """
-    print(f"\n[filter_mrstr] Reading {rrf_path} in chunks...")
-    # Records the total number of matches
-    total_matched = 0
-    with open(output_path, mode='w',encoding='utf-8',newline="") as fout:
-        fout.write("|".join(COL_STY) + "\n")
-
-        for idx, chunk in enumerate(pd.read_csv(rrf_path,
-                                                sep="|",
-                                                names=COL_STY,
-                                                dtype=str,
-                                                engine='python',
-                                                quoting=csv.QUOTE_NONE,
-                                                chunksize=CHUNKSIZE,
-                                                usecols=range(len(COL_STY)))):
-
-            df_filtered = chunk[chunk["CUI"].isin(related_cuis)]
-
-            #  Output debugging information on each chunk processing
-            matched_count = len(df_filtered)
-            total_matched += matched_count
-            print(f"[filter_mrsty] Chunk {idx}: Matched rows={matched_count}")
-            if not df_filtered.empty:
+    cui_ids = make_cui_ids(related_cuis)
+    metrics = stage_metrics("filter_mrsty", source=str(rrf_path), cuis=len(cui_ids), n_workers=n_workers)
+    results = checkpointed_scan(rrf_path, COL_STY, _sty_chunk, output_path,
+                                header="|".join(COL_STY) + "\n", shared=cui_ids, n_workers=n_workers,
+                                cui_filter={"CUI": cui_ids}, prefilter=cui_prefilter(cui_ids, ["CUI"]),
+                                resume=resume, signature=ids_signature(cui_ids), metrics=metrics)
+    for fout, df_filtered in results:
+        if not df_filtered.empty:
+            with timed(metrics, "write_s"):
                 df_filtered.to_csv(fout, sep="|",header=False,index=False)
+        observe(metrics, rows_out=len(df_filtered))
 
-    print(f"{filter_mrsty} Done. Output -> {output_path}")
+    finish_stage(metrics, output=str(output_path))
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract the PD one-hop REL / CONSO / STY tables")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every step, ignoring the stage cache")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    configure_metrics(args)
+
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..",".."))
     rrf_dir = os.path.join(base_dir,"data","umls")
     out_dir = os.path.join(base_dir,"data","umls_output")
@@ -152,18 +133,27 @@ def main():
     conso_filtered = os.path.join(out_dir,"pd_conso.csv")
     sty_filtered = os.path.join(out_dir,"pd_sty.csv")
 
+    # Every step is skipped when its inputs, parameters and code are unchanged (see stage_cache)
+    use_cache = not args.no_cache
+
     # 1) Block filter MRREL, and only PD-related rows are retained
-    filter_mrrel_for_pd(mrrel_path,rel_filtered)
+    cached_stage("pd_rel", lambda: filter_mrrel_for_pd(mrrel_path, rel_filtered),
+                 inputs=[mrrel_path], outputs=[rel_filtered], params={"cui": PD_CUI},
+                 code=code_version(filter_mrrel_for_pd), enabled=use_cache)
 
     # 2) Get the CUI collection according to the CUI in pd_rel.csv
     cui_set = get_related_cuis_from_rel(rel_filtered)
     print("Sample extracted CUIs:", list(cui_set)[:10])
 
     # 3) Block filter MRCONSO, retain (English + CUI in cui_set)
-    filter_mrconso(mrconso_path,cui_set,conso_filtered)
+    cached_stage("pd_conso", lambda: filter_mrconso(mrconso_path,cui_set,conso_filtered),
+                 inputs=[mrconso_path, rel_filtered], outputs=[conso_filtered],
+                 code=code_version(filter_mrconso), enabled=use_cache)
 
     # 4) Block screening MRSTY, reserved (CUI in cui_set)
-    filter_mrsty(mrsty_path,cui_set,sty_filtered)
+    cached_stage("pd_sty", lambda: filter_mrsty(mrsty_path,cui_set,sty_filtered),
+                 inputs=[mrsty_path, rel_filtered], outputs=[sty_filtered],
+                 code=code_version(filter_mrsty), enabled=use_cache)
 
     print("\nAll done! Final outputs:")
     print(f"  REL -> {rel_filtered}")
@@ -0,0 +1,143 @@
+"""
+Integer interning of UMLS identifiers.
+
+CUIs are "C" + 7 digits, so the number itself is a dense, order-preserving int32 id
+("C0030567" -> 30567, back with "C%07d"). AUI / RUI / SUI / LUI / ATUI numbers do not fit in 7 digits
+in every release and are interned as int64. Malformed or empty identifiers map to -1.
+
+CUI sets travel between stages as sorted, unique int32 arrays (4 bytes per CUI instead of a ~60-byte str
+in a set): membership is a vectorized binary search (cui_member), and bitmaps over the whole CUI range
+(CUI_RANGE bools, 10 MB) give O(1) lookups for sets that are hit very often, such as a BFS visited set.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# CUI numbers are below 10^7
+CUI_RANGE = 10_000_000
+
+# Identifier prefixes (UMLS Reference Manual, 3.3 Data Elements)
+PREFIX_CUI = "C"
+PREFIX_AUI = "A"
+PREFIX_RUI = "R"
+PREFIX_SUI = "S"
+PREFIX_LUI = "L"
+PREFIX_ATUI = "AT"
+
+
+def intern_ids(values, prefix):
+    """
+    Integer form of prefix + digits identifiers as an int64 array; other / empty values -> -1
+    """
+    values = pd.Series(values, dtype=object)
+    numbers = pd.to_numeric(values.str[len(prefix):], errors="coerce")
+    numbers = numbers.where(values.str[:len(prefix)].str.upper() == prefix)
+    return numbers.fillna(-1).astype("int64").to_numpy()
+
+
+def cui_numbers(cuis):
+    """
+    Integer form of CUIs ("C0030567" -> 30567) as an int64 array; malformed / empty CUIs -> -1
+    """
+    return intern_ids(cuis, PREFIX_CUI)
+
+
+def intern_cuis(cuis):
+    """
+    CUIs -> int32 ids (the CUI number), -1 for malformed / empty CUIs
+    """
+    return cui_numbers(cuis).astype(np.int32)
+
+
+def cui_strings(cui_ids):
+    """
+    int CUI ids -> list of "C%07d" strings
+    """
+    return [f"C{n:07d}" for n in np.asarray(cui_ids).tolist()]
+
+
+def make_cui_ids(cuis):
+    """
+    Sorted, unique int32 CUI id array (the CUI set type of the pipeline).
+    Accepts CUI strings (any iterable) or an integer array of CUI ids, which is used as is.
+    """
+    if isinstance(cuis, np.ndarray) and cuis.dtype.kind in "iu":
+        numbers = np.unique(cuis)
+    else:
+        numbers = np.unique(cui_numbers(list(cuis)))
+    return numbers[numbers >= 0].astype(np.int32)
+
+
+def cui_member(values, cui_ids):
+    """
+    Vectorized membership of int CUI ids (values) in a sorted id array or a bitmap (see cui_bitmap)
+    """
+    values = np.asarray(values)
+    if cui_ids.dtype == np.bool_:
+        valid = (values >= 0) & (values < len(cui_ids))
+        hit = np.zeros(len(values), dtype=bool)
+        hit[valid] = cui_ids[values[valid]]
+        return hit
+    if len(cui_ids) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(cui_ids, values).clip(0, len(cui_ids) - 1)
+    return cui_ids[pos] == values
+
+
+def cui_isin(series, cui_ids):
+    """
+    Vectorized "series in cui_ids" for a CUI column, cui_ids from make_cui_ids (or a bitmap).
+    For categoricals only the categories are encoded and searched, rows are resolved through the codes.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        hit = cui_member(cui_numbers(series.cat.categories), cui_ids)
+        codes = series.cat.codes.to_numpy()
+        return pd.Series((codes >= 0) & hit[codes], index=series.index)
+    return pd.Series(cui_member(cui_numbers(series), cui_ids), index=series.index)
+
+
+def column_cui_ids(series):
+    """
+    CUI column -> int32 ids per row (categoricals: encoded once per category)
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        lookup = np.append(intern_cuis(series.cat.categories), np.int32(-1))
+        # code -1 (missing) picks the trailing -1
+        return lookup[series.cat.codes.to_numpy()]
+    return intern_cuis(series)
+
+
+def cui_bitmap(cui_ids, size=CUI_RANGE):
+    """
+    Boolean bitmap over the CUI range with True at cui_ids
+    """
+    bitmap = np.zeros(size, dtype=bool)
+    cui_ids = np.asarray(cui_ids)
+    bitmap[cui_ids[(cui_ids >= 0) & (cui_ids < size)]] = True
+    return bitmap
+
+
+def ids_signature(cui_ids):
+    """
+    Short digest of a CUI id set (for checkpoints / cache keys)
+    """
+    return hashlib.sha1(make_cui_ids(cui_ids).tobytes()).hexdigest()
+
+
+def load_cui_ids(cui_txt):
+    """
+    Read a CUI list file (one CUI per line, e.g. pd_nhop_cuis.txt) straight into a CUI id array
+    """
+    with open(cui_txt, "r", encoding="utf-8") as fin:
+        return make_cui_ids([line.strip() for line in fin if line.strip()])
+
+
+def save_cui_ids(cui_txt, cui_ids):
+    """
+    Write a CUI id array as a sorted CUI list file
+    """
+    with open(cui_txt, "w", encoding="utf-8") as fout:
+        for cui in cui_strings(make_cui_ids(cui_ids)):
+            fout.write(cui + "\n")
@@ -0,0 +1,108 @@
+"""
+Checkpointed, resumable output of the RRF filter stages.
+
+Output goes to <output>.part; after every completed byte range of the input the .part file is flushed
+and <output>.ckpt.json records (input offset, .part size). A crashed run started again with resume=True
+cuts .part back to the recorded size and continues from the recorded input offset. When the scan is
+complete .part is atomically renamed to the output, so a truncated output file never appears under
+its final name.
+"""
+
+import json
+import os
+
+from scripts.umls.rrf_parallel import scan_rrf, scan_rrf_ranges
+from scripts.umls.rrf_reader import CHUNKSIZE, is_parquet_source
+from scripts.umls.rrf_source import is_stream_source
+
+PART_SUFFIX = ".part"
+CHECKPOINT_SUFFIX = ".ckpt.json"
+
+# Input bytes between two checkpoints (a crash loses at most this much work)
+CHECKPOINT_BYTES = 256 << 20
+
+
+def atomic_write_json(path, obj):
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        json.dump(obj, fout, sort_keys=True)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, path)
+
+
+def _load_checkpoint(output_path, source_path, signature):
+    ckpt_path = str(output_path) + CHECKPOINT_SUFFIX
+    part_path = str(output_path) + PART_SUFFIX
+    if not (os.path.exists(ckpt_path) and os.path.exists(part_path)):
+        return None
+    with open(ckpt_path, "r", encoding="utf-8") as fin:
+        state = json.load(fin)
+    if (state.get("source") != os.path.abspath(source_path)
+            or state.get("source_size") != os.path.getsize(source_path)
+            or state.get("signature") != signature
+            or os.path.getsize(part_path) < state.get("output_bytes", 0)):
+        print(f"[checkpointed_scan] Checkpoint {ckpt_path} does not match this run, starting over")
+        return None
+    return state
+
+
+def _commit(fout, state, ckpt_path, offset):
+    fout.flush()
+    os.fsync(fout.fileno())
+    state["offset"] = offset
+    state["output_bytes"] = os.fstat(fout.fileno()).st_size
+    atomic_write_json(ckpt_path, state)
+
+
+def checkpointed_scan(path, columns, chunk_fn, output_path, header, shared=None, usecols=None, n_workers=1,
+                      chunksize=CHUNKSIZE, cui_filter=None, resume=False, signature=None,
+                      checkpoint_bytes=CHECKPOINT_BYTES, prefilter=None, metrics=None):
+    """
+    scan_rrf with a checkpointed output file. Yields (fout, result) for every chunk_fn result in file order;
+    the caller writes what it wants to keep to fout. Once the generator is exhausted the output is final.
+    :param header: text written at the top of a new output (e.g. "CUI|TUI|...\\n")
+    :param resume: continue from <output>.ckpt.json if it matches path / signature, else start over
+    :param signature: anything JSON-serializable that identifies the run's inputs (e.g. cui_intern.ids_signature)
+    :param prefilter: byte-level CUI prefilter of raw RRF input (see scan_rrf)
+    :param metrics: stage_metrics record for the scan counts (see scan_rrf)
+    Parquet datasets and compressed / archived sources (rrf_source) have no byte offsets: they are scanned
+    from the start, only the atomic rename applies.
+    """
+    part_path = str(output_path) + PART_SUFFIX
+    ckpt_path = str(output_path) + CHECKPOINT_SUFFIX
+
+    if is_parquet_source(path) or is_stream_source(path):
+        with open(part_path, "w", encoding="utf-8", newline="") as fout:
+            fout.write(header)
+            for result in scan_rrf(path, columns, chunk_fn, shared=shared, usecols=usecols,
+                                   chunksize=chunksize, cui_filter=cui_filter, prefilter=prefilter,
+                                   metrics=metrics):
+                yield fout, result
+        os.replace(part_path, output_path)
+        return
+
+    state = _load_checkpoint(output_path, path, signature) if resume else None
+    if state is None:
+        with open(part_path, "w", encoding="utf-8", newline="") as fout:
+            fout.write(header)
+            state = {"source": os.path.abspath(path), "source_size": os.path.getsize(path),
+                     "signature": signature}
+            _commit(fout, state, ckpt_path, 0)
+    else:
+        # Drop whatever was written after the last checkpoint
+        os.truncate(part_path, state["output_bytes"])
+        print(f"[checkpointed_scan] Resuming {output_path} at input offset {state['offset']} "
+              f"of {state['source_size']}")
+
+    with open(part_path, "a", encoding="utf-8", newline="") as fout:
+        for range_end, results in scan_rrf_ranges(path, columns, chunk_fn, shared=shared, usecols=usecols,
+                                                  n_workers=n_workers, chunksize=chunksize,
+                                                  start=state["offset"], range_bytes=checkpoint_bytes,
+                                                  prefilter=prefilter, metrics=metrics):
+            for result in results:
+                yield fout, result
+            _commit(fout, state, ckpt_path, range_end)
+
+    os.replace(part_path, output_path)
+    os.remove(ckpt_path)
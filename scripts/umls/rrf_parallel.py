@@ -0,0 +1,186 @@
+"""
+Multi-process scanning of RRF files.
+
+The file is split into newline-aligned byte ranges, every range is parsed with read_rrf in a worker
+process, and the per-chunk results come back in file order, so outputs stay deterministic.
+With a stage_metrics record the scans add chunks / rows_in / bytes_read and the time spent parsing
+(read_rrf) vs in chunk_fn to it; the workers return these counts next to their results.
+A prefilter (rrf_prefilter.cui_prefilter) drops lines by their CUI bytes before read_rrf parses them;
+the dropped lines are counted as rows_skipped.
+Read-only state (CUI sets, filters, the prefilter) is handed to the workers once through the pool initializer:
+with the "fork" start method it is inherited without any copy, with "spawn" (Windows) it is
+pickled once per worker, never per chunk.
+Compressed / archived sources (rrf_source) have no byte offsets to split at; they are scanned in this process,
+with decompression running in a background thread.
+"""
+
+import io
+import multiprocessing as mp
+import os
+import time
+
+from scripts.umls.rrf_reader import CHUNKSIZE, is_parquet_source, read_rrf
+from scripts.umls.rrf_source import is_stream_source, source_size
+from scripts.umls.stage_metrics import observe
+
+# Ranges per worker; more ranges balance better and keep each returned result small
+RANGES_PER_WORKER = 4
+
+# State shared with the current worker process, set by _init_worker
+_SHARED = None
+
+
+class _RangeFile(io.RawIOBase):
+    """
+    Read-only file object that exposes bytes [start, end) of path
+    """
+
+    def __init__(self, path, start, end):
+        self._fin = open(path, "rb")
+        self._fin.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:min(len(buffer), self._remaining)]
+        n = self._fin.readinto(view)
+        self._remaining -= n
+        return n
+
+    def close(self):
+        self._fin.close()
+        super().close()
+
+
+def split_byte_ranges(path, n_parts, start=0):
+    """
+    Cut bytes [start, size) of path into about n_parts ranges [start, end) that begin and end on
+    line boundaries (start itself has to be a line boundary)
+    """
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, "rb") as fin:
+        for i in range(1, n_parts):
+            pos = start + (size - start) * i // n_parts
+            if pos <= bounds[-1]:
+                continue
+            fin.seek(pos - 1)
+            # Finish the line that pos falls into
+            fin.readline()
+            pos = fin.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i + 1] > bounds[i]]
+
+
+def _init_worker(shared, prefilter):
+    global _SHARED
+    _SHARED = (shared, prefilter)
+
+
+def _timed_chunks(reader, chunk_fn, shared, counts):
+    # chunk_fn results of a read_rrf reader, with parse / filter time and rows added to counts
+    start_t = time.perf_counter()
+    for chunk in reader:
+        parsed_t = time.perf_counter()
+        result = chunk_fn(chunk, shared)
+        done_t = time.perf_counter()
+        counts["chunks"] += 1
+        counts["rows_in"] += len(chunk)
+        counts["parse_s"] += parsed_t - start_t
+        counts["filter_s"] += done_t - parsed_t
+        yield result
+        start_t = time.perf_counter()
+
+
+def _read_range(path, start, end, columns, usecols, chunksize, chunk_fn, shared, prefilter=None):
+    # Return: (chunk_fn results, counts for stage_metrics.observe)
+    counts = {"chunks": 0, "rows_in": 0, "bytes_read": end - start, "parse_s": 0.0, "filter_s": 0.0}
+    with io.BufferedReader(_RangeFile(path, start, end)) as fin:
+        reader = read_rrf(fin, columns, usecols=usecols, chunksize=chunksize, prefilter=prefilter, counts=counts)
+        results = list(_timed_chunks(reader, chunk_fn, shared, counts))
+    return results, counts
+
+
+def _scan_range(task):
+    return _read_range(*task, *_SHARED)
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def scan_rrf(path, columns, chunk_fn, shared=None, usecols=None, n_workers=1,
+             chunksize=CHUNKSIZE, cui_filter=None, prefilter=None, metrics=None):
+    """
+    Apply chunk_fn(chunk, shared) to every chunk of an RRF file and yield the results in file order.
+    :param chunk_fn: module-level function (it has to be picklable for the worker processes)
+    :param shared: read-only state for chunk_fn, e.g. a frozenset of CUIs
+    :param n_workers: 1 = scan in this process; Parquet datasets and compressed sources are always scanned here
+    :param cui_filter: passed on to read_rrf (Parquet pruning hint)
+    :param prefilter: passed on to read_rrf (byte-level CUI prefilter of raw RRF input); it must keep every
+                      line chunk_fn can select
+    :param metrics: stage_metrics record that receives the scan counts, or None
+    """
+    if n_workers <= 1 or is_parquet_source(path) or is_stream_source(path):
+        counts = dict.fromkeys(["chunks", "rows_in", "rows_skipped", "parse_s", "filter_s"], 0)
+        reader = read_rrf(path, columns, usecols=usecols, chunksize=chunksize, cui_filter=cui_filter,
+                          prefilter=prefilter, counts=counts)
+        for result in _timed_chunks(reader, chunk_fn, shared, counts):
+            observe(metrics, **counts)
+            # Reset in place, _timed_chunks and read_rrf keep adding to this dict
+            counts.update(dict.fromkeys(counts, 0))
+            yield result
+        # Lines the prefilter dropped after the last chunk
+        observe(metrics, **counts)
+        # read_rrf reads the path itself (faster than through a Python file object), so the bytes
+        # of a serial scan are only known at the end (stored bytes for a compressed source)
+        if not is_parquet_source(path):
+            observe(metrics, bytes_read=source_size(path))
+        return
+
+    for _, results in scan_rrf_ranges(path, columns, chunk_fn, shared=shared, usecols=usecols,
+                                      n_workers=n_workers, chunksize=chunksize, prefilter=prefilter,
+                                      metrics=metrics):
+        yield from results
+
+
+def scan_rrf_ranges(path, columns, chunk_fn, shared=None, usecols=None, n_workers=1,
+                    chunksize=CHUNKSIZE, start=0, range_bytes=None, prefilter=None, metrics=None):
+    """
+    Like scan_rrf for bytes [start, size) of a raw RRF file, but grouped by byte range:
+    yields (range_end, [chunk_fn results of the range]) in file order, so a caller can record
+    range_end as a restart offset once it has consumed a range.
+    :param range_bytes: upper bound on the size of one range (default: n_workers * RANGES_PER_WORKER ranges)
+    n_workers <= 1 reads the ranges in this process.
+    :param prefilter: byte-level CUI prefilter, see scan_rrf
+    :param metrics: stage_metrics record that receives the scan counts of every range, or None
+    """
+    if is_stream_source(path):
+        raise ValueError(f"{path} is compressed or archived and has no byte ranges, scan it with scan_rrf")
+    n_parts = max(n_workers, 1) * RANGES_PER_WORKER
+    if range_bytes:
+        n_parts = max(n_parts, -(-(os.path.getsize(path) - start) // range_bytes))
+    ranges = split_byte_ranges(path, n_parts, start=start)
+    if n_workers <= 1:
+        for range_start, range_end in ranges:
+            results, counts = _read_range(path, range_start, range_end, columns, usecols, chunksize, chunk_fn,
+                                          shared, prefilter)
+            observe(metrics, **counts)
+            yield range_end, results
+        return
+
+    tasks = [(path, range_start, range_end, columns, usecols, chunksize, chunk_fn) for range_start, range_end in ranges]
+    method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    with mp.get_context(method).Pool(n_workers, initializer=_init_worker, initargs=(shared, prefilter)) as pool:
+        # imap keeps task order, so the output order equals the serial scan
+        for (_, range_end), (results, counts) in zip(ranges, pool.imap(_scan_range, tasks)):
+            observe(metrics, **counts)
+            yield range_end, results
@@ -0,0 +1,111 @@
+"""
+Convert the RRF files of a UMLS release (MRREL / MRCONSO / MRSTY) into compressed Parquet datasets once,
+so the filter stages no longer re-parse raw RRF text on every run.
+
+Layout of each dataset (e.g. <parquet_dir>/MRCONSO):
+    bucket=<k>/part-0.parquet   - rows whose first CUI column falls into CUI range k (see cui_bucket),
+                                  sorted by that CUI, zstd compressed, with row-group min/max statistics
+Any path accepted by read_rrf / filter_mrconso / filter_mrsty / filter_rel_by_cuis can be such a dataset.
+"""
+
+import os
+import shutil
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from scripts.umls.rrf_reader import (
+    BUCKET_COLUMN, COL_CONSO, COL_REL, COL_STY, PARQUET_BUCKETS, cui_bucket, read_rrf
+)
+
+# Rows per Parquet row group; smaller groups prune better, larger ones compress better
+ROW_GROUP_SIZE = 128_000
+
+# Table name -> column list, i.e. <META>/<name>.RRF
+RRF_TABLES = {
+    "MRREL": COL_REL,
+    "MRCONSO": COL_CONSO,
+    "MRSTY": COL_STY,
+}
+
+
+def convert_rrf(rrf_path, columns, dataset_dir):
+    """
+    Stream one RRF file into a CUI-bucketed Parquet dataset at dataset_dir.
+    Pass 1 appends every chunk to per-bucket staging files, pass 2 sorts each bucket by CUI.
+    Return: number of rows written
+    """
+    start_t = time.time()
+    schema = pa.schema([(col, pa.string()) for col in columns])
+    cui_col = columns[0]
+    staging_dir = dataset_dir + ".staging"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    # Pass 1: route rows into their CUI bucket
+    writers = {}
+    total_rows = 0
+    try:
+        for chunk in read_rrf(rrf_path, columns):
+            total_rows += len(chunk)
+            chunk = chunk.astype(object)
+            buckets = cui_bucket(chunk[cui_col]).to_numpy()
+            for bucket, part in chunk.groupby(buckets, sort=False):
+                writer = writers.get(bucket)
+                if writer is None:
+                    writer = writers[bucket] = pq.ParquetWriter(
+                        os.path.join(staging_dir, f"{bucket}.parquet"), schema, compression="lz4")
+                writer.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Pass 2: sort each bucket by CUI and write the final, compressed files
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    for bucket in sorted(writers):
+        table = pq.read_table(os.path.join(staging_dir, f"{bucket}.parquet"))
+        table = table.sort_by([(cui_col, "ascending")])
+        out_dir = os.path.join(dataset_dir, f"{BUCKET_COLUMN}={bucket}")
+        os.makedirs(out_dir)
+        pq.write_table(table, os.path.join(out_dir, "part-0.parquet"),
+                       compression="zstd",
+                       row_group_size=ROW_GROUP_SIZE,
+                       write_statistics=True)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    end_t = time.time()
+    print(f"[convert_rrf] {rrf_path} -> {dataset_dir}, rows={total_rows}, "
+          f"buckets={len(writers)}/{PARQUET_BUCKETS}, cost={end_t - start_t:.2f}s")
+    return total_rows
+
+
+def convert_release(meta_dir, parquet_dir, tables=("MRREL", "MRCONSO", "MRSTY")):
+    """
+    Convert <meta_dir>/<table>.RRF into <parquet_dir>/<table> for every table in tables.
+    Return: {table: dataset_dir}
+    """
+    os.makedirs(parquet_dir, exist_ok=True)
+    datasets = {}
+    for table in tables:
+        dataset_dir = os.path.join(parquet_dir, table)
+        convert_rrf(os.path.join(meta_dir, table + ".RRF"), RRF_TABLES[table], dataset_dir)
+        datasets[table] = dataset_dir
+    return datasets
+
+
+def main():
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    parquet_dir = os.path.join(base_dir, "data", "umls_parquet")
+
+    # Absolute path
+    meta_dir = "E:\\Data\\2024AB\\META"
+
+    datasets = convert_release(meta_dir, parquet_dir)
+    print("\nAll done! Parquet datasets:")
+    for table, dataset_dir in datasets.items():
+        print(f"  {table} -> {dataset_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Byte-level CUI prefilter for raw RRF files.
+
+The selective scans (PD neighbors, BFS hops, filter_rel_by_cuis, MRCONSO / MRSTY by CUI set) throw away
+almost every row, yet the CSV parser used to tokenize every line into all columns first. The prefilter
+reads the raw bytes in blocks, finds the CUI field(s) of every line by pipe offset, interns them
+("C0030567" -> 30567, see cui_intern) and looks them up in a bitmap over the CUI range; only the lines
+that can match go on to read_rrf's parser.
+
+Very small sets (the PD direct-neighbor pass) skip the per-line work: bytes.find looks for the digits of
+each CUI, and only the lines around the hits get the field check.
+
+It only ever drops lines that cannot match: a line whose CUI field is empty or a well-formed CUI not in
+the set. Anything the field check cannot judge (missing field, odd CUI format) is passed on, so the
+caller's own mask still decides and the output is the same as without the prefilter. (The find path
+assumes CUIs are written as "C" + 7 digits, as in every UMLS release.)
+"""
+
+import numpy as np
+
+from scripts.umls.cui_intern import cui_bitmap, make_cui_ids
+
+NEWLINE = ord("\n")
+PIPE = ord("|")
+
+# "C" + 7 digits
+CUI_WIDTH = 8
+
+# Bytes read per prefilter block
+PREFILTER_BLOCK_SIZE = 16 << 20
+
+# CUI sets up to this size are searched with bytes.find instead of decoding the CUI field of every line
+FIND_MAX_CUIS = 4
+
+# Once a block keeps more than this share of its lines the set is not selective for this file,
+# and the rest of the file is handed to the parser unfiltered (the prefilter would only add work)
+MAX_KEEP_RATIO = 0.5
+
+
+def cui_prefilter(cui_ids, columns, match="any"):
+    """
+    Prefilter spec for read_rrf / scan_rrf: keep lines whose CUI in any (or all) of columns is in cui_ids.
+    :param cui_ids: CUI strings or a CUI id array
+    :param columns: CUI columns to test, e.g. ["CUI"] or ["CUI1", "CUI2"]
+    :param match: "any" (BFS frontier: either end) or "all" (filter_rel_by_cuis: both ends)
+    """
+    if match not in ("any", "all"):
+        raise ValueError(f"cui_prefilter match must be 'any' or 'all', not {match!r}")
+    return {"cui_ids": make_cui_ids(cui_ids), "columns": list(columns), "match": match}
+
+
+def _cui_numbers_at(buf, starts):
+    # CUI number of the field starting at every position; -1 = empty field, -2 = not a plain "C" + 7 digits.
+    # The 8 bytes "C0030567" of every field are gathered as one little-endian uint64 and decoded in-register.
+    if len(buf) <= CUI_WIDTH:
+        return np.full(len(starts), -2, dtype=np.int64)
+    words = np.ndarray((len(buf) - 7,), dtype="<u8", buffer=buf, strides=(1,))
+    in_block = starts + CUI_WIDTH < len(buf)
+    starts = np.where(in_block, starts, 0)
+    word = words[starts]
+    first = (word & np.uint64(0xFF)).astype(np.uint8)
+    # "C" -> "0", then all 8 bytes have to be ASCII digits
+    digits = (word & np.uint64(0xFFFFFFFFFFFFFF00)) | np.uint64(ord("0"))
+    not_digit = (digits + np.uint64(0x4646464646464646)) | (digits - np.uint64(0x3030303030303030))
+    plain = (in_block & ((first | 0x20) == ord("c")) & (buf[starts + CUI_WIDTH] == PIPE)
+             & ((not_digit & np.uint64(0x8080808080808080)) == 0))
+    # Pairwise digit merge: 8 x 1 digit -> 4 x 2 -> 2 x 4 -> 1 x 8
+    value = digits - np.uint64(0x3030303030303030)
+    value = (value * np.uint64(10) + (value >> np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    value = (value * np.uint64(100) + (value >> np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    value = (value * np.uint64(10000) + (value >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+    numbers = value.astype(np.int64)
+    numbers[~plain] = -2
+    numbers[first == PIPE] = -1
+    return numbers
+
+
+def _field_starts(buf, starts, ends, field_positions):
+    # Start of every field in field_positions (0 = line start) per line, and whether the line has that field
+    if max(field_positions) == 0:
+        return {0: (starts, ends > starts)}
+    pipes = np.flatnonzero(buf == PIPE)
+    n_lines = len(starts)
+    per_line = len(pipes) // n_lines
+    out = {}
+    if per_line * n_lines == len(pipes) and per_line >= max(field_positions):
+        rows = pipes.reshape(n_lines, per_line)
+        # RRF lines all have the same number of pipes; then pipe k of line i is rows[i, k]
+        if (rows[:, 0] >= starts).all() and (rows[:, -1] < ends).all():
+            for field in field_positions:
+                out[field] = (starts, ends > starts) if field == 0 else (rows[:, field - 1] + 1, None)
+            return out
+    first_pipe = np.searchsorted(pipes, starts)
+    n_pipes = np.searchsorted(pipes, ends) - first_pipe
+    for field in field_positions:
+        if field == 0:
+            out[field] = (starts, ends > starts)
+        elif len(pipes) == 0:
+            out[field] = (starts, np.zeros(n_lines, dtype=bool))
+        else:
+            out[field] = (pipes[np.minimum(first_pipe + field - 1, len(pipes) - 1)] + 1, n_pipes >= field)
+    return out
+
+
+def prefilter_block(block, field_positions, bitmap, match="any"):
+    """
+    Keep the lines of block (whole lines, the last one may lack its newline) that can match.
+    :param field_positions: 0-based field numbers of the CUI columns
+    :param bitmap: cui_bitmap of the CUI set
+    Return: (bytes of the kept lines, number of lines, number of kept lines)
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    if len(buf) == 0:
+        return b"", 0, 0
+    ends = np.flatnonzero(buf == NEWLINE)
+    if len(ends) == 0 or ends[-1] != len(buf) - 1:
+        ends = np.append(ends, len(buf))
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    hits = []
+    for field_starts, present in _field_starts(buf, starts, ends, field_positions).values():
+        numbers = _cui_numbers_at(buf, field_starts)
+        known = numbers >= 0
+        hit = numbers == -2
+        hit[known] = bitmap[numbers[known]]
+        if present is not None:
+            # A line without this field cannot be judged here, the parser gets it
+            hit |= ~present
+        hits.append(hit)
+    keep = np.logical_or.reduce(hits) if match == "any" else np.logical_and.reduce(hits)
+
+    n_kept = int(keep.sum())
+    if n_kept * 8 < len(keep):
+        # Very selective: copy the few kept lines
+        kept = b"".join(block[start:end + 1] for start, end in zip(starts[keep].tolist(), ends[keep].tolist()))
+    else:
+        kept = buf[np.repeat(keep, np.diff(np.append(starts, len(buf))))].tobytes()
+    return kept, len(keep), n_kept
+
+
+def find_block(block, patterns, field_positions, bitmap, match="any"):
+    """
+    prefilter_block for very small CUI sets: the lines containing one of patterns (the 7 CUI digits + "|")
+    are cut out with bytes.find, then checked field by field.
+    Return: (bytes of the kept lines, number of lines, number of kept lines)
+    """
+    n_lines = int(np.count_nonzero(np.frombuffer(block, dtype=np.uint8) == NEWLINE))
+    if block and not block.endswith(b"\n"):
+        n_lines += 1
+    spans = set()
+    for pattern in patterns:
+        pos = block.find(pattern)
+        while pos != -1:
+            start = block.rfind(b"\n", 0, pos) + 1
+            end = block.find(b"\n", pos)
+            end = len(block) if end == -1 else end + 1
+            spans.add((start, end))
+            pos = block.find(pattern, end)
+    candidates = b"".join(block[start:end] for start, end in sorted(spans))
+    kept, _, n_kept = prefilter_block(candidates, field_positions, bitmap, match)
+    return kept, n_lines, n_kept
+
+
+def prefiltered_blocks(fin, columns, prefilter, block_size=PREFILTER_BLOCK_SIZE):
+    """
+    Read a binary RRF file object to its end in blocks of whole lines and prefilter every block
+    (until a block shows the set is not selective, see MAX_KEEP_RATIO).
+    :param columns: full column list of the file (COL_REL / COL_CONSO / COL_STY)
+    :param prefilter: cui_prefilter spec
+    Yields: (bytes of the kept lines, number of lines, number of kept lines) per block
+    """
+    field_positions = [columns.index(col) for col in prefilter["columns"]]
+    cui_ids = prefilter["cui_ids"]
+    bitmap = cui_bitmap(cui_ids)
+    if len(cui_ids) <= FIND_MAX_CUIS:
+        # Digits only, so "C" and "c" CUIs are both found
+        patterns = [f"{number:07d}|".encode("ascii") for number in cui_ids.tolist()]
+
+        def check(block):
+            return find_block(bytes(block), patterns, field_positions, bitmap, prefilter["match"])
+    else:
+        def check(block):
+            return prefilter_block(block, field_positions, bitmap, prefilter["match"])
+
+    def passthrough(block):
+        n_lines = int(np.count_nonzero(np.frombuffer(block, dtype=np.uint8) == NEWLINE))
+        if block[-1:] != b"\n":
+            n_lines += 1
+        return bytes(block), n_lines, n_lines
+
+    rest = b""
+    while True:
+        data = fin.read(block_size)
+        if not data:
+            break
+        data = rest + data
+        cut = data.rfind(b"\n") + 1
+        if cut == 0:
+            rest = data
+            continue
+        rest = data[cut:]
+        kept, n_lines, n_kept = check(memoryview(data)[:cut])
+        if n_kept > MAX_KEEP_RATIO * n_lines:
+            check = passthrough
+        yield kept, n_lines, n_kept
+    if rest:
+        yield check(rest)
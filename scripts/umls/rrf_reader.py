@@ -0,0 +1,291 @@
+"""
+Shared reader for UMLS RRF files (MRREL / MRCONSO / MRSTY).
+
+- Uses the pyarrow CSV reader when pyarrow is installed, otherwise the pandas C engine
+  (never the slow python engine).
+- Only the requested columns are parsed (usecols projection).
+- Identifier / code columns (CUI, REL, SAB, ...) come back as pandas categoricals instead of
+  Python object strings, so isin / == only touch the (small) category table.
+- A Parquet dataset written by rrf_parquet.convert_release can be passed instead of the RRF file;
+  then cui_filter prunes CUI buckets and row groups before anything is decoded.
+- On raw RRF input a prefilter (rrf_prefilter.cui_prefilter) drops lines by their CUI bytes, so only
+  lines that can match are tokenized at all.
+- .gz / .zst files, zip members ("release.zip!2024AB/META/MRREL.RRF") and split .aa/.ab parts are
+  decompressed on the fly (rrf_source); a missing "MRREL.RRF" resolves to such a copy next to it.
+"""
+
+import csv
+import io
+import os
+import numpy as np
+import pandas as pd
+
+# CUI interning helpers used to live here; re-exported for existing imports
+from scripts.umls.cui_intern import cui_isin, cui_numbers, cui_strings, make_cui_ids
+from scripts.umls.rrf_prefilter import prefiltered_blocks
+from scripts.umls.rrf_source import is_stream_source, open_rrf_stream
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Set the block size, depending on the memory can be adjusted to large/small
+CHUNKSIZE = 100_000
+
+# Bytes per pyarrow block, roughly CHUNKSIZE MRREL lines
+BLOCK_SIZE = 16 << 20
+
+# Parquet datasets are hive-partitioned into CUI ranges on the first column (CUI / CUI1)
+PARQUET_BUCKETS = 64
+BUCKET_COLUMN = "bucket"
+
+# Column name definition: Refer to the UMLS Reference Manual
+COL_CONSO = [
+    "CUI", "LAT", "TS", "LUI", "STT", "SUI", "ISPREF", "AUI", "SAUI", "SCUI", "SDUI",
+    "SAB", "TTY", "CODE", "STR", "SRL", "SUPPRESS", "CVF"
+]
+
+COL_REL = [
+    "CUI1", "AUI1", "STYPE1", "REL", "CUI2", "AUI2", "STYPE2", "RELA", "RUI", "SRUI",
+    "SAB", "SL", "RG", "DIR", "SUPPRESS", "CVF"
+]
+
+COL_STY = [
+    "CUI", "TUI", "STN", "STY", "ATUI", "CVF"
+]
+
+COL_DOC = [
+    "DOCKEY", "VALUE", "TYPE", "EXPL"
+]
+
+# MRREL columns that a traversal filter can restrict, e.g. {"REL_DENY": ["SIB"], "SAB_ALLOW": ["MSH"]}
+REL_FILTER_COLUMNS = ["REL", "RELA", "SAB", "SUPPRESS"]
+
+# Clinical-only traversal: drop generic sibling/"other" edges, the inverse hierarchy and suppressed rows
+CLINICAL_REL_FILTER = {
+    "REL_DENY": ["SIB", "RO", "RQ", "AQ", "QB"],
+    "RELA_DENY": ["inverse_isa"],
+    "SUPPRESS_DENY": ["O", "E", "Y"],
+}
+
+
+def rel_filter_columns(rel_filter):
+    """
+    MRREL columns needed to evaluate rel_filter
+    """
+    if not rel_filter:
+        return []
+    return [col for col in REL_FILTER_COLUMNS
+            if rel_filter.get(col + "_ALLOW") is not None or rel_filter.get(col + "_DENY")]
+
+
+def rel_filter_mask(chunk, rel_filter):
+    """
+    Row mask for a MRREL chunk according to rel_filter.
+    rel_filter keys are <COL>_ALLOW / <COL>_DENY for COL in REL_FILTER_COLUMNS;
+    an ALLOW list keeps only those values (use "" for blank), a DENY list drops them.
+    """
+    mask = pd.Series(True, index=chunk.index)
+    for col in rel_filter_columns(rel_filter):
+        values = chunk[col]
+        # Blank fields arrive as missing values; they match "" in the lists
+        blank = values.isna() | (values == "")
+        allow = rel_filter.get(col + "_ALLOW")
+        deny = rel_filter.get(col + "_DENY")
+        if allow is not None:
+            mask &= values.isin(allow) | (blank & ("" in allow))
+        if deny:
+            mask &= ~(values.isin(deny) | (blank & ("" in deny)))
+    return mask
+
+
+# Low-cardinality columns that are read as categoricals
+CATEGORICAL_COLUMNS = {
+    "CUI", "CUI1", "CUI2", "REL", "RELA", "STYPE1", "STYPE2", "SAB", "SL", "DIR", "SUPPRESS",
+    "LAT", "TS", "STT", "ISPREF", "TTY", "SRL", "TUI", "STN", "STY"
+}
+
+# Columns holding CUIs, normalized to upper case
+CUI_COLUMNS = {"CUI", "CUI1", "CUI2"}
+
+
+def normalize_cui(series):
+    """
+    Upper-case a CUI column and replace missing values by "".
+    On a categorical this only touches the categories, not every row.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        upper = categories.str.upper()
+        if not upper.equals(categories):
+            if upper.is_unique:
+                series = series.cat.rename_categories(upper)
+            else:
+                series = series.astype(str).str.upper().astype("category")
+        if series.isna().any():
+            if "" not in series.cat.categories:
+                series = series.cat.add_categories([""])
+            series = series.fillna("")
+        return series
+    return series.str.upper().fillna("")
+
+
+def _finish_chunk(chunk):
+    for col in chunk.columns:
+        if col in CUI_COLUMNS:
+            chunk[col] = normalize_cui(chunk[col])
+    return chunk
+
+
+def cui_bucket(cuis):
+    """
+    Parquet partition of each CUI: the 7-digit CUI number split into PARQUET_BUCKETS equal ranges.
+    Malformed / empty CUIs go to bucket 0.
+    """
+    numbers = pd.Series(cui_numbers(cuis)).clip(lower=0)
+    return (numbers * PARQUET_BUCKETS // 10_000_000).clip(0, PARQUET_BUCKETS - 1).astype("int32")
+
+
+def is_parquet_source(path):
+    """
+    True for a Parquet dataset directory / file, False for a raw RRF file (or an open file object)
+    """
+    if not isinstance(path, (str, os.PathLike)):
+        return False
+    return os.path.isdir(path) or str(path).endswith(".parquet")
+
+
+def _read_parquet(parquet_path, columns, usecols, chunksize, cui_filter):
+    if not HAS_PYARROW:
+        raise ImportError("Reading Parquet RRF datasets requires the pyarrow package")
+    dataset = pa_ds.dataset(parquet_path, format="parquet", partitioning="hive")
+
+    expr = None
+    for col, cuis in (cui_filter or {}).items():
+        if isinstance(cuis, np.ndarray) and cuis.dtype.kind in "iu":
+            cuis = cui_strings(cuis)
+        cuis = sorted({c.upper() for c in cuis})
+        cond = pa_ds.field(col).isin(cuis)
+        # Only the partition column can skip whole buckets; the rest relies on row-group statistics
+        if col == columns[0] and BUCKET_COLUMN in dataset.schema.names:
+            buckets = sorted(set(cui_bucket(cuis).tolist()))
+            cond = pa_ds.field(BUCKET_COLUMN).isin(buckets) & cond
+        expr = cond if expr is None else expr & cond
+
+    scanner = dataset.scanner(columns=list(usecols), filter=expr, batch_size=chunksize)
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        chunk = batch.to_pandas()
+        for col in chunk.columns:
+            if col in CATEGORICAL_COLUMNS:
+                chunk[col] = chunk[col].astype("category")
+        yield _finish_chunk(chunk)
+
+
+def _read_pandas(rrf_path, columns, usecols, chunksize):
+    positions = [columns.index(col) for col in usecols]
+    reader = pd.read_csv(rrf_path,
+                         sep="|",
+                         header=None,
+                         dtype={pos: ("category" if columns[pos] in CATEGORICAL_COLUMNS else str)
+                                for pos in positions},
+                         chunksize=chunksize,
+                         quoting=csv.QUOTE_NONE,
+                         usecols=positions,
+                         na_filter=True,
+                         keep_default_na=False,
+                         na_values=[""])
+    for chunk in reader:
+        # Keep the requested column order and names
+        chunk = chunk[positions]
+        chunk.columns = usecols
+        yield _finish_chunk(chunk)
+
+
+def _read_pyarrow(rrf_path, columns, usecols, block_size):
+    # RRF lines end with "|", which shows up as one extra empty column
+    names = list(columns) + ["_TRAILING"]
+    column_types = {col: (pa.dictionary(pa.int32(), pa.string()) if col in CATEGORICAL_COLUMNS else pa.string())
+                    for col in usecols}
+    reader = pa_csv.open_csv(
+        rrf_path,
+        read_options=pa_csv.ReadOptions(column_names=names, block_size=block_size),
+        parse_options=pa_csv.ParseOptions(delimiter="|", quote_char=False, double_quote=False),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(usecols),
+                                              column_types=column_types,
+                                              strings_can_be_null=True,
+                                              null_values=[""],
+                                              quoted_strings_can_be_null=False),
+    )
+    for batch in reader:
+        if batch.num_rows == 0:
+            continue
+        yield _finish_chunk(batch.to_pandas())
+
+
+def _read_prefiltered(rrf_path, columns, usecols, chunksize, engine, prefilter, counts):
+    # Parse only the lines kept by the prefilter, batched into about BLOCK_SIZE bytes per parser call
+    fin = rrf_path if hasattr(rrf_path, "read") else open(rrf_path, "rb")
+    try:
+        pending, pending_bytes = [], 0
+        for kept, n_lines, n_kept in prefiltered_blocks(fin, columns, prefilter):
+            if counts is not None:
+                # Skipped lines never reach a chunk, so they are counted here
+                counts["rows_in"] = counts.get("rows_in", 0) + n_lines - n_kept
+                counts["rows_skipped"] = counts.get("rows_skipped", 0) + n_lines - n_kept
+            if n_kept:
+                pending.append(kept)
+                pending_bytes += len(kept)
+            if pending_bytes >= BLOCK_SIZE:
+                yield from read_rrf(io.BytesIO(b"".join(pending)), columns, usecols, chunksize, engine)
+                pending, pending_bytes = [], 0
+        if pending:
+            yield from read_rrf(io.BytesIO(b"".join(pending)), columns, usecols, chunksize, engine)
+    finally:
+        if fin is not rrf_path:
+            fin.close()
+
+
+def _read_stream(rrf_path, columns, usecols, chunksize, engine, prefilter, counts):
+    # Parse the decompressed bytes while the rrf_source thread inflates the next blocks
+    with open_rrf_stream(rrf_path) as fin:
+        yield from read_rrf(fin, columns, usecols, chunksize, engine, prefilter=prefilter, counts=counts)
+
+
+def read_rrf(rrf_path, columns, usecols=None, chunksize=CHUNKSIZE, engine="auto", cui_filter=None,
+             prefilter=None, counts=None):
+    """
+    Iterate over an RRF file (or its Parquet dataset, or a compressed / archived copy, see rrf_source)
+    in DataFrame chunks.
+    :param columns: full column list of the file (COL_REL / COL_CONSO / COL_STY)
+    :param usecols: column names to materialize (default: all of columns)
+    :param engine: "pyarrow", "c" or "auto" (pyarrow if installed); ignored for Parquet
+    :param cui_filter: {column: CUIs} pushed down into Parquet scans (all conditions AND-ed).
+                       A hint only: raw RRF input ignores it, so callers still apply their own mask.
+    :param prefilter: rrf_prefilter.cui_prefilter spec for raw RRF input (Parquet ignores it): lines that
+                      cannot match are dropped before parsing. Also a hint, callers keep their own mask.
+    :param counts: dict that receives rows_in / rows_skipped for the lines the prefilter drops
+    Missing values are None/NaN, except CUI columns which are upper-cased with missing -> "".
+    """
+    usecols = list(columns) if usecols is None else list(usecols)
+    if is_parquet_source(rrf_path):
+        return _read_parquet(rrf_path, columns, usecols, chunksize, cui_filter)
+    if is_stream_source(rrf_path):
+        return _read_stream(rrf_path, columns, usecols, chunksize, engine, prefilter, counts)
+    if prefilter is not None:
+        return _read_prefiltered(rrf_path, columns, usecols, chunksize, engine, prefilter, counts)
+    if engine == "auto":
+        engine = "pyarrow" if HAS_PYARROW else "c"
+    if engine == "pyarrow":
+        if not HAS_PYARROW:
+            raise ImportError("engine='pyarrow' requires the pyarrow package")
+        # Keep roughly the same number of rows per chunk as the pandas path
+        return _read_pyarrow(rrf_path, columns, usecols, max(1 << 20, BLOCK_SIZE * chunksize // CHUNKSIZE))
+    if engine == "c":
+        return _read_pandas(rrf_path, columns, usecols, chunksize)
+    raise ValueError(f"Unknown RRF reader engine: {engine}")
@@ -0,0 +1,207 @@
+"""
+Compressed / archived RRF sources.
+
+read_rrf (and so every filter and BFS entry point) accepts, next to a plain MRREL.RRF:
+    - a gzip or zstd file:           .../META/MRREL.RRF.gz, .../META/MRREL.RRF.zst
+    - a member of a zip archive:     .../umls-2024AB-full.zip!2024AB/META/MRREL.RRF
+    - the split parts NLM ships:     .../META/MRCONSO.RRF.aa, MRCONSO.RRF.ab, ... (each optionally .gz / .zst)
+A path that does not exist as given is resolved in that order of preference, so the hard-coded
+".../META/MRREL.RRF" of the main() functions also finds MRREL.RRF.gz or the MRCONSO.RRF.a? parts next to it,
+and "release.zip!2024AB/META" works as a meta_dir.
+
+open_rrf_stream decompresses in a background thread into a small queue of blocks, so the parser works on
+one block while the next one is inflated (zlib and the pyarrow codecs release the GIL while they run).
+gzip / zstd use the pyarrow codecs (pyarrow is needed for zstd, gzip falls back to the gzip module).
+A stream has no byte offsets, so multi-process and resumable scans read it serially from the start.
+"""
+
+import gzip
+import io
+import os
+import queue
+import re
+import threading
+import zipfile
+
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Separates the archive from the member path: "release.zip!2024AB/META/MRREL.RRF"
+ZIP_MEMBER_SEP = "!"
+
+CODEC_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+# Split parts are named <file>.aa, <file>.ab, ... (split(1) suffixes)
+SPLIT_PART = r"\.[a-z]{2}"
+
+# Decompressed bytes per queued block, and blocks the decompression thread may run ahead of the parser
+STREAM_BLOCK_SIZE = 4 << 20
+STREAM_QUEUE_BLOCKS = 8
+
+
+def _codec(name):
+    for suffix, codec in CODEC_SUFFIXES.items():
+        if name.endswith(suffix):
+            return codec
+    return None
+
+
+def _split_zip(path):
+    # ("release.zip", "2024AB/META/MRREL.RRF") or (path, None)
+    path = str(path)
+    archive, sep, member = path.partition(".zip" + ZIP_MEMBER_SEP)
+    if not sep:
+        return path, None
+    return archive + ".zip", member.replace("\\", "/").strip("/")
+
+
+def _pick(base, names):
+    # Names that make up base, in order of preference: itself, a compressed copy, its split parts
+    if base in names:
+        return [base]
+    for suffix in CODEC_SUFFIXES:
+        if base + suffix in names:
+            return [base + suffix]
+    pattern = re.compile(re.escape(base) + SPLIT_PART + "(" + "|".join(map(re.escape, CODEC_SUFFIXES)) + ")?$")
+    return sorted(name for name in names if pattern.match(name))
+
+
+def source_parts(path):
+    """
+    Resolve an RRF path to the pieces that are concatenated to read it.
+    Return: list of {"file", "member" (zip member or None), "codec" ("gzip" / "zstd" / None),
+            "size" (stored bytes), "crc" (zip members only)}
+    """
+    archive, member = _split_zip(path)
+    if member is not None:
+        with zipfile.ZipFile(archive) as zf:
+            infos = {info.filename: info for info in zf.infolist()}
+            names = _pick(member, infos)
+            if not names:
+                raise FileNotFoundError(f"{member} is not in {archive}")
+            return [{"file": archive, "member": name, "codec": _codec(name),
+                     "size": infos[name].compress_size, "crc": infos[name].CRC} for name in names]
+
+    if os.path.isfile(archive):
+        names = [archive]
+    else:
+        folder, base = os.path.split(archive)
+        listing = set(os.listdir(folder or ".")) if os.path.isdir(folder or ".") else set()
+        names = [os.path.join(folder, name) for name in _pick(base, listing)]
+        if not names:
+            raise FileNotFoundError(f"No RRF file, compressed copy or split parts found for {path}")
+    return [{"file": name, "member": None, "codec": _codec(name), "size": os.path.getsize(name)}
+            for name in names]
+
+
+def is_stream_source(path):
+    """
+    True for a path that read_rrf has to decompress / join (see source_parts); False for a plain RRF
+    file, a Parquet dataset or an open file object
+    """
+    if not isinstance(path, (str, os.PathLike)):
+        return False
+    path = str(path)
+    if os.path.isdir(path) or path.endswith(".parquet"):
+        return False
+    return not os.path.isfile(path) or _codec(path) is not None
+
+
+def source_size(path):
+    """
+    Stored (compressed) bytes of an RRF source
+    """
+    if not is_stream_source(path):
+        return os.path.getsize(path)
+    return sum(part["size"] for part in source_parts(path))
+
+
+def _open_part(part):
+    # Binary file object with the decompressed bytes of one part
+    raw = zipfile.ZipFile(part["file"]).open(part["member"]) if part["member"] else open(part["file"], "rb")
+    if part["codec"] is None:
+        return raw
+    if HAS_PYARROW:
+        return pa.CompressedInputStream(pa.PythonFile(raw, mode="r"), part["codec"])
+    if part["codec"] == "gzip":
+        return gzip.GzipFile(fileobj=raw)
+    raw.close()
+    raise ImportError(f"Reading {part['codec']} compressed RRF files requires the pyarrow package")
+
+
+class _StreamFile(io.RawIOBase):
+    """
+    Read-only file object over the decompressed, concatenated parts of an RRF source.
+    A background thread fills a bounded queue of blocks; its errors are raised in the reader.
+    """
+
+    def __init__(self, parts, block_size=STREAM_BLOCK_SIZE, queue_blocks=STREAM_QUEUE_BLOCKS):
+        self._blocks = queue.Queue(maxsize=queue_blocks)
+        self._stop = threading.Event()
+        self._block = memoryview(b"")
+        self._done = False
+        self._thread = threading.Thread(target=self._fill, args=(parts, block_size), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        # Give up once the reader is closed, so the thread never blocks on a queue nobody drains
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self, parts, block_size):
+        try:
+            for part in parts:
+                fin = _open_part(part)
+                try:
+                    while True:
+                        block = fin.read(block_size)
+                        if not block:
+                            break
+                        if not self._put(bytes(block)):
+                            return
+                finally:
+                    fin.close()
+            self._put(None)
+        except BaseException as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._done:
+                return 0
+            item = self._blocks.get()
+            if item is None:
+                self._done = True
+                return 0
+            if isinstance(item, BaseException):
+                self._done = True
+                raise item
+            self._block = memoryview(item)
+        n = min(len(buffer), len(self._block))
+        memoryview(buffer)[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def open_rrf_stream(path, block_size=STREAM_BLOCK_SIZE):
+    """
+    Open the decompressed bytes of an RRF source (see source_parts) as a buffered binary file object
+    """
+    return io.BufferedReader(_StreamFile(source_parts(path), block_size=block_size), buffer_size=block_size)
@@ -0,0 +1,252 @@
+"""
+Content-addressed cache of pipeline stage outputs.
+
+A stage (e.g. "filter MRREL to the n-hop CUIs") is keyed by
+    - the identity of its input files / directories: size + SHA-1 of sampled blocks
+      (small files are hashed completely)
+    - its parameters (anything JSON-serializable: seeds, max_hops, rel_filter, ...)
+    - the code version: source of the modules that implement it and of the project modules they import
+On a hit the stored outputs are copied back (skipped if the file on disk already matches), so a rerun
+with unchanged MRREL / seeds / MAX_HOPS costs a few file hashes. On a miss the stage runs and its outputs
+are stored. The cache directory is kept under max_bytes by evicting the least recently used entries.
+
+Layout: cache_dir/<stage>-<key[:20]>/manifest.json + one stored copy per output (file or directory).
+mtime is not part of the key, so an identical file that was restored or recomputed still hits downstream.
+"""
+
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import sys
+import time
+
+from scripts.umls.rrf_source import is_stream_source, source_parts
+
+CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "data", "stage_cache"))
+
+# Evict least recently used entries beyond this size
+MAX_CACHE_BYTES = 50 << 30
+
+# Files up to this size are hashed completely, larger ones through SAMPLE_BLOCKS blocks of SAMPLE_BYTES
+FULL_HASH_BYTES = 64 << 20
+SAMPLE_BLOCKS = 32
+SAMPLE_BYTES = 1 << 20
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_identity(path):
+    """
+    Return: {"size": ..., "sha1": ...} for a file, or {"files": {relative path: identity}} for a directory
+    (e.g. a Parquet dataset or an index directory), or {"parts": [...]} for a compressed / archived RRF source
+    (a zip member by its stored CRC, the archive itself is not hashed)
+    """
+    path = str(path)
+    if is_stream_source(path) and not os.path.isfile(path):
+        return {"parts": [{"member": part["member"], "size": part["size"], "crc": part["crc"]} if part["member"]
+                          else {"name": os.path.basename(part["file"]), **file_identity(part["file"])}
+                          for part in source_parts(path)]}
+    if os.path.isdir(path):
+        files = {}
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                full = os.path.join(root, name)
+                files[os.path.relpath(full, path).replace(os.sep, "/")] = file_identity(full)
+        return {"files": files}
+
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, "rb") as fin:
+        if size <= FULL_HASH_BYTES:
+            for block in iter(lambda: fin.read(SAMPLE_BYTES), b""):
+                digest.update(block)
+        else:
+            # First and last block plus evenly spaced ones in between
+            for i in range(SAMPLE_BLOCKS):
+                fin.seek((size - SAMPLE_BYTES) * i // (SAMPLE_BLOCKS - 1))
+                digest.update(fin.read(SAMPLE_BYTES))
+    return {"size": size, "sha1": digest.hexdigest()}
+
+
+def _module_path(name):
+    # Source file of a module, None for names that are not modules (from module import function)
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    return spec.origin if spec is not None and spec.origin and spec.origin.endswith(".py") else None
+
+
+def _imported_modules(path, package):
+    # Names of the package modules a source file imports (anywhere in the file, also inside functions)
+    with open(path, "rb") as fin:
+        tree = ast.parse(fin.read(), filename=path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+            # from package import module
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return {name for name in names if name.split(".")[0] == package}
+
+
+def code_version(*objects):
+    """
+    SHA-1 over the source files of the modules that define objects (functions / classes / modules) and of every
+    project module (scripts.*) they import, transitively: a change in a shared scan module (rrf_reader,
+    rrf_parallel, rrf_checkpoint, cui_intern, ...) invalidates every stage built on it.
+    """
+    package = __name__.split(".")[0]
+    digest = hashlib.sha1()
+    paths = set()
+    queue = []
+    for obj in objects:
+        module = obj if inspect.ismodule(obj) else sys.modules[obj.__module__]
+        queue.append(inspect.getsourcefile(module))
+    while queue:
+        path = queue.pop()
+        if path in paths:
+            continue
+        paths.add(path)
+        for name in _imported_modules(path, package):
+            module_path = _module_path(name)
+            if module_path is not None and module_path not in paths:
+                queue.append(module_path)
+    for path in sorted(paths):
+        with open(path, "rb") as fin:
+            digest.update(fin.read())
+    return digest.hexdigest()
+
+
+def stage_key(stage, inputs, params=None, code=None):
+    """
+    Return: hex key of a stage run (inputs: list of file / directory paths)
+    """
+    payload = {
+        "stage": stage,
+        "inputs": [file_identity(path) for path in inputs],
+        "params": params,
+        "code": code,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _path_bytes(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def _copy(src, dst):
+    if os.path.isdir(src):
+        tmp_dst = dst + ".tmp"
+        shutil.rmtree(tmp_dst, ignore_errors=True)
+        shutil.copytree(src, tmp_dst)
+        shutil.rmtree(dst, ignore_errors=True)
+        os.replace(tmp_dst, dst)
+    else:
+        tmp_dst = dst + ".tmp"
+        shutil.copyfile(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+
+
+def _restore(entry_dir, manifest, outputs):
+    for i, (path, identity) in enumerate(zip(outputs, manifest["outputs"])):
+        path = str(path)
+        if os.path.exists(path) and file_identity(path) == identity:
+            continue
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        _copy(os.path.join(entry_dir, f"{i}_{os.path.basename(path)}"), path)
+
+
+def _store(cache_dir, entry_dir, stage, key, outputs, result):
+    tmp_dir = entry_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for i, path in enumerate(outputs):
+        _copy(str(path), os.path.join(tmp_dir, f"{i}_{os.path.basename(str(path))}"))
+    manifest = {
+        "stage": stage,
+        "key": key,
+        "outputs": [file_identity(path) for path in outputs],
+        "result": result,
+        "created": time.time(),
+        "last_used": time.time(),
+    }
+    manifest["bytes"] = _path_bytes(tmp_dir)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as fout:
+        json.dump(manifest, fout, indent=2)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def cached_stage(stage, fn, inputs, outputs, params=None, code=None, cache_dir=CACHE_DIR,
+                 max_bytes=MAX_CACHE_BYTES, enabled=True):
+    """
+    Run fn() (which writes outputs) unless a cached run with the same stage key exists.
+    :param inputs: files / directories the stage reads
+    :param outputs: files / directories fn writes (restored from the cache on a hit)
+    :param params: JSON-serializable parameters of the stage
+    :param code: code_version(...) of the stage implementation
+    :param enabled: False runs fn() without touching the cache
+    Return: what fn() returned (stored as JSON, so it should be JSON-serializable)
+    """
+    if not enabled:
+        return fn()
+
+    start_t = time.time()
+    key = stage_key(stage, inputs, params=params, code=code)
+    entry_dir = os.path.join(cache_dir, f"{stage}-{key[:20]}")
+    manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as fin:
+            manifest = json.load(fin)
+        if manifest.get("key") == key and len(manifest["outputs"]) == len(outputs):
+            _restore(entry_dir, manifest, outputs)
+            manifest["last_used"] = time.time()
+            with open(manifest_path, "w", encoding="utf-8") as fout:
+                json.dump(manifest, fout, indent=2)
+            print(f"[cached_stage] {stage}: cache hit ({entry_dir}), cost={time.time() - start_t:.2f}s")
+            return manifest["result"]
+
+    print(f"[cached_stage] {stage}: cache miss, running")
+    result = fn()
+    os.makedirs(cache_dir, exist_ok=True)
+    _store(cache_dir, entry_dir, stage, key, outputs, result)
+    evict(cache_dir, max_bytes=max_bytes)
+    return result
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, max_entries=None):
+    """
+    Delete least recently used entries until the cache is within max_bytes (and max_entries, if given).
+    Return: number of entries removed
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = []
+    for name in os.listdir(cache_dir):
+        manifest_path = os.path.join(cache_dir, name, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path, "r", encoding="utf-8") as fin:
+            manifest = json.load(fin)
+        entries.append((manifest.get("last_used", 0), manifest.get("bytes", 0), os.path.join(cache_dir, name)))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    while entries and (total > max_bytes or (max_entries is not None and len(entries) > max_entries)):
+        _, size, entry_dir = entries.pop(0)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+        removed += 1
+    if removed:
+        print(f"[evict] removed {removed} cache entries, {total / (1 << 20):.1f} MB left in {cache_dir}")
+    return removed
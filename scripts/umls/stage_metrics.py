@@ -0,0 +1,321 @@
+"""
+Structured progress and timing of the RRF scan and BFS stages.
+
+A stage (filter_mrconso, bfs_node_only, ...) keeps one record (stage_metrics) that the scanners add
+counts to (observe):
+    chunks, rows_in, bytes_read   - what was read
+    rows_skipped                  - lines of rows_in dropped by the byte-level CUI prefilter unparsed
+    parse_s, filter_s             - time in read_rrf vs in the chunk function (summed over scan workers)
+    rows_out, write_s             - what the stage kept and the time spent writing it
+Events are dicts handed to every registered sink:
+    stage_start, progress (at most every PROGRESS_SECONDS), hop (bfs_node_only), stage_end
+Sinks are plain callables: logging_sink (the default), jsonl_sink, prometheus_sink (node-exporter textfile).
+Per chunk only a few dict additions happen; events are built and formatted only when one is due.
+
+sampling_profiler is an opt-in stack sampler (a background thread) that writes folded stacks
+(flamegraph.pl / speedscope) with the running stage as the root frame.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LOGGER_NAME = "umls"
+
+# Minimum time between two progress events of a stage
+PROGRESS_SECONDS = 10.0
+
+# Seconds between two stack samples of sampling_profiler
+PROFILE_INTERVAL = 0.01
+
+# Counters summed by observe
+COUNTERS = ("chunks", "rows_in", "rows_skipped", "bytes_read", "rows_out", "parse_s", "filter_s", "write_s")
+
+# Names of the running stages (innermost last), the root frame of profiler samples
+_STAGE_STACK = []
+
+
+def rss_bytes():
+    """
+    Current resident set size of this process (peak RSS where the current one is not available), or None
+    """
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm", "r", encoding="utf-8") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+#############################
+# Sinks
+#############################
+
+def format_event(event):
+    """
+    One-line text form of an event: "[stage] event key=value, ..."
+    """
+    skip = {"event", "stage", "ts"}
+    fields = []
+    for key, value in event.items():
+        if key in skip or value is None:
+            continue
+        if key.endswith("_bytes") and key != "bytes_read":
+            key, value = key[:-len("_bytes")] + "_mb", value / (1 << 20)
+        if isinstance(value, float):
+            value = f"{value:.2f}" if abs(value) >= 0.01 or value == 0 else f"{value:.2e}"
+        fields.append(f"{key}={value}")
+    return f"[{event['stage']}] {event['event']} " + ", ".join(fields)
+
+
+def logging_sink(logger_name=LOGGER_NAME, level=logging.INFO):
+    """
+    Sink writing format_event lines to a logger. Without handlers of its own the logger prints to stdout,
+    so scripts show progress without any logging configuration.
+    """
+    logger = logging.getLogger(logger_name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    def sink(event):
+        if logger.isEnabledFor(level):
+            logger.log(level, format_event(event))
+    return sink
+
+
+def jsonl_sink(path):
+    """
+    Sink appending every event as one JSON line to path
+    """
+    def sink(event):
+        with open(path, "a", encoding="utf-8") as fout:
+            fout.write(json.dumps(event, default=str) + "\n")
+    return sink
+
+
+def prometheus_sink(path, prefix=LOGGER_NAME):
+    """
+    Sink keeping the last numeric values of every stage in a Prometheus text file (node-exporter
+    textfile collector format), rewritten atomically on every event:
+        umls_stage_rows_in{stage="filter_mrconso"} 123456
+        umls_stage_parse_seconds{stage="filter_mrconso"} 12.5
+        umls_stage_running{stage="filter_mrconso"} 0
+    """
+    values = {}
+
+    def sink(event):
+        stage = values.setdefault(event["stage"], {})
+        stage["running"] = 0 if event["event"] == "stage_end" else 1
+        for key, value in event.items():
+            if key != "ts" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                stage[key[:-2] + "_seconds" if key.endswith("_s") else key] = value
+
+        lines = []
+        for name in sorted({name for stage_values in values.values() for name in stage_values}):
+            lines.append(f"# TYPE {prefix}_stage_{name} gauge")
+            for stage_name, stage_values in sorted(values.items()):
+                if name in stage_values:
+                    lines.append(f'{prefix}_stage_{name}{{stage="{stage_name}"}} {stage_values[name]}')
+        tmp_path = str(path) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+    return sink
+
+
+_SINKS = [logging_sink()]
+
+
+def add_sink(sink):
+    _SINKS.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _SINKS:
+        _SINKS.remove(sink)
+
+
+def set_sinks(sinks):
+    """
+    Replace all sinks (an empty list turns instrumentation output off)
+    """
+    _SINKS[:] = list(sinks)
+
+
+def emit(event):
+    for sink in _SINKS:
+        sink(event)
+
+
+#############################
+# Stage records
+#############################
+
+def stage_metrics(stage, progress_seconds=None, **labels):
+    """
+    Start a stage: emits stage_start with labels (source file, number of CUIs, ...).
+    progress_seconds: minimum time between progress events (default PROGRESS_SECONDS)
+    Return: the record to pass to observe / timed / emit_event / finish_stage
+    """
+    now = time.perf_counter()
+    record = {"stage": stage, "labels": labels, "start": now, "last_emit": now,
+              "progress_seconds": PROGRESS_SECONDS if progress_seconds is None else progress_seconds, "counts": dict.fromkeys(COUNTERS, 0)}
+    _STAGE_STACK.append(stage)
+    emit(dict({"event": "stage_start", "stage": stage, "ts": time.time()}, **labels))
+    return record
+
+
+def _event(record, event, fields):
+    # Event-specific fields first, then the running totals of the stage
+    elapsed = time.perf_counter() - record["start"]
+    counts = record["counts"]
+    out = dict({"event": event, "stage": record["stage"], "ts": time.time()}, **fields)
+    out["elapsed_s"] = elapsed
+    out.update(counts)
+    out["rows_per_s"] = counts["rows_in"] / elapsed if elapsed > 0 else None
+    out["mb_per_s"] = counts["bytes_read"] / (1 << 20) / elapsed if elapsed > 0 and counts["bytes_read"] else None
+    out["match_ratio"] = counts["rows_out"] / counts["rows_in"] if counts["rows_in"] else None
+    out["rss_bytes"] = rss_bytes()
+    return out
+
+
+def observe(record, **counts):
+    """
+    Add counts (COUNTERS or any other numbers) to a stage record; emits a progress event when one is due.
+    record=None is a no-op, so scanners can take an optional record.
+    """
+    if record is None:
+        return
+    totals = record["counts"]
+    for key, value in counts.items():
+        totals[key] = totals.get(key, 0) + value
+    now = time.perf_counter()
+    if now - record["last_emit"] >= record["progress_seconds"]:
+        record["last_emit"] = now
+        emit(_event(record, "progress", {}))
+
+
+@contextmanager
+def timed(record, key):
+    """
+    with timed(record, "write_s"): ...  adds the time spent in the block to record[key]
+    """
+    start_t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(record, **{key: time.perf_counter() - start_t})
+
+
+def emit_event(record, event, **fields):
+    """
+    Stage-specific event (e.g. "hop" of bfs_node_only) with the current totals of the record
+    """
+    emit(_event(record, event, fields))
+
+
+def finish_stage(record, **fields):
+    """
+    Emit stage_end with the totals of the record.
+    Return: the stage_end event
+    """
+    event = _event(record, "stage_end", fields)
+    if _STAGE_STACK and _STAGE_STACK[-1] == record["stage"]:
+        _STAGE_STACK.pop()
+    emit(event)
+    return event
+
+
+#############################
+# Sampling profiler
+#############################
+
+def _folded_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def start_sampling_profiler(path, interval=PROFILE_INTERVAL, thread_id=None):
+    """
+    Sample the stack of a thread (default: the calling one) every interval seconds in a background thread.
+    Return: stop() which ends sampling and writes folded stacks "stage;file:function;... count" to path
+    """
+    thread_id = thread_id or threading.get_ident()
+    samples = {}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = (_STAGE_STACK[-1] if _STAGE_STACK else "main") + ";" + _folded_stack(frame)
+            samples[stack] = samples.get(stack, 0) + 1
+
+    sampler = threading.Thread(target=sample, name="sampling_profiler", daemon=True)
+    sampler.start()
+
+    def stop():
+        done.set()
+        sampler.join()
+        with open(path, "w", encoding="utf-8") as fout:
+            for stack, count in sorted(samples.items()):
+                fout.write(f"{stack} {count}\n")
+        logging.getLogger(LOGGER_NAME).info(f"[sampling_profiler] {sum(samples.values())} samples -> {path}")
+    return stop
+
+
+@contextmanager
+def sampling_profiler(path, interval=PROFILE_INTERVAL):
+    stop = start_sampling_profiler(path, interval)
+    try:
+        yield
+    finally:
+        stop()
+
+
+#############################
+# Command line
+#############################
+
+def add_metrics_args(parser):
+    """
+    --metrics-jsonl / --metrics-prom / --profile / --log-level options of the pipeline scripts
+    """
+    parser.add_argument("--metrics-jsonl", help="append stage events as JSON lines to this file")
+    parser.add_argument("--metrics-prom", help="keep stage metrics in this Prometheus text file")
+    parser.add_argument("--profile", help="sample stacks while running, folded stacks are written here")
+    parser.add_argument("--log-level", default="INFO", help="level of the progress log (WARNING = quiet)")
+
+
+def configure_metrics(args):
+    """
+    Set up sinks and the profiler from add_metrics_args options; the profile is written at exit
+    """
+    logging.getLogger(LOGGER_NAME).setLevel(args.log_level.upper())
+    if args.metrics_jsonl:
+        add_sink(jsonl_sink(args.metrics_jsonl))
+    if args.metrics_prom:
+        add_sink(prometheus_sink(args.metrics_prom))
+    if args.profile:
+        atexit.register(start_sampling_profiler(args.profile))
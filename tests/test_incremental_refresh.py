@@ -0,0 +1,286 @@
+"""
+incremental_refresh.refresh() against a full rebuild of the new release (pd_bfs_nhop + filter_pd_labels stages).
+Run from the project root: python -m pytest -q tests
+"""
+
+import gzip
+import os
+import random
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.kg_builder import incremental_refresh
+from scripts.kg_builder.incremental_refresh import index_from_state, refresh, repair_distances, snapshot_release
+from scripts.kg_builder.mrrel_index import (
+    bfs_multi_seed, build_adjacency_index, load_adjacency_index, write_bfs_result
+)
+from scripts.kg_builder.pd_bfs_nhop import PD_CUI, filter_rel_by_cuis
+from scripts.umls.chunk_extract_example import filter_mrconso, filter_mrsty
+from scripts.umls.cui_intern import load_cui_ids
+
+MAX_HOPS = 2
+# Two seeds, so the refreshed _seeds.npy has ties to get right
+SEED_CUIS = [PD_CUI, "C0000006"]
+OUTPUTS = ["pd_nhop_cuis.txt", "pd_nhop_rel.csv", "pd_nhop_conso.csv", "pd_nhop_sty.csv"]
+BFS_ARRAYS = ["pd_nhop_cuis_hops.npy", "pd_nhop_cuis_seeds.npy"]
+
+# (CUI1, REL, CUI2, RELA, RUI); every relation is written in both directions, like MRREL
+OLD_RELATIONS = [
+    (PD_CUI, "RO", "C0000001", "may_treat", "R0000001"),
+    ("C0000001", "CHD", "C0000002", "", "R0000003"),
+    ("C0000002", "RN", "C0000003", "", "R0000005"),
+    (PD_CUI, "SIB", "C0000004", "", "R0000007"),
+    ("C0000005", "RO", "C0000006", "", "R0000009"),
+]
+NEW_RELATIONS = [
+    (PD_CUI, "RO", "C0000001", "may_treat", "R0000001"),
+    ("C0000002", "RN", "C0000003", "", "R0000005"),
+    (PD_CUI, "SIB", "C0000004", "", "R0000007"),
+    ("C0000005", "RO", "C0000006", "", "R0000009"),
+    (PD_CUI, "RO", "C0000003", "", "R0000011"),
+    ("C0000004", "RQ", "C0000005", "", "R0000013"),
+]
+INVERSE_REL = {"RO": "RO", "CHD": "PAR", "RN": "RB", "SIB": "SIB", "RQ": "RQ"}
+INVERSE_RELA = {"": "", "may_treat": "may_be_treated_by"}
+
+# (CUI, LAT, AUI, STR); STRs with double quotes are written quoted by to_csv
+OLD_ATOMS = [
+    (PD_CUI, "ENG", "A0000001", "Parkinson's disease"),
+    (PD_CUI, "ENG", "A0000002", 'Parkinson "shaking palsy"'),
+    (PD_CUI, "ENG", "A0000003", '"Paralysis" agitans'),
+    (PD_CUI, "SPA", "A0000004", "enfermedad de Parkinson"),
+    ("C0000001", "ENG", "A0000005", "Levodopa"),
+    ("C0000002", "ENG", "A0000006", "Carbidopa"),
+    ("C0000003", "ENG", "A0000007", "Tremor"),
+    ("C0000004", "ENG", "A0000008", 'Lewy body "dementia"'),
+    ("C0000005", "ENG", "A0000009", "Rigidity"),
+    ("C0000006", "ENG", "A0000010", "Bradykinesia"),
+]
+NEW_ATOMS = [atom for atom in OLD_ATOMS if atom[2] != "A0000002"] + [
+    ("C0000005", "ENG", "A0000011", 'Muscle "cogwheel" rigidity'),
+]
+
+# (CUI, TUI, STY, ATUI)
+OLD_TYPES = [
+    (PD_CUI, "T047", "Disease or Syndrome", "AT0000001"),
+    ("C0000001", "T121", "Pharmacologic Substance", "AT0000002"),
+    ("C0000002", "T121", "Pharmacologic Substance", "AT0000003"),
+    ("C0000003", "T184", "Sign or Symptom", "AT0000004"),
+    ("C0000004", "T047", "Disease or Syndrome", "AT0000005"),
+    ("C0000005", "T184", "Sign or Symptom", "AT0000006"),
+    ("C0000006", "T184", "Sign or Symptom", "AT0000007"),
+]
+NEW_TYPES = [row if row[0] != "C0000004" else ("C0000004", "T048", "Mental or Behavioral Dysfunction", "AT0000005")
+             for row in OLD_TYPES]
+
+
+def _write_rrf(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as fout:
+        for row in rows:
+            fout.write("|".join(row) + "|\n")
+
+
+def write_release(meta_dir, relations, atoms, types):
+    os.makedirs(meta_dir, exist_ok=True)
+    rel_rows = []
+    for cui1, rel, cui2, rela, rui in relations:
+        inverse_rui = f"R{int(rui[1:]) + 1:07d}"
+        rel_rows.append([cui1, "", "CUI", rel, cui2, "", "CUI", rela, rui, "", "MSH", "MSH", "", "", "N", ""])
+        rel_rows.append([cui2, "", "CUI", INVERSE_REL[rel], cui1, "", "CUI", INVERSE_RELA[rela], inverse_rui, "",
+                         "MSH", "MSH", "", "", "N", ""])
+    _write_rrf(os.path.join(meta_dir, "MRREL.RRF"), rel_rows)
+    _write_rrf(os.path.join(meta_dir, "MRCONSO.RRF"),
+               [[cui, lat, "P", "L0000001", "PF", "S" + aui[1:], "Y", aui, "", "", "", "MSH", "PT", "D000001", name,
+                 "0", "N", ""] for cui, lat, aui, name in sorted(atoms)])
+    _write_rrf(os.path.join(meta_dir, "MRSTY.RRF"),
+               [[cui, tui, "B2.2.1.2.1", sty, atui, ""] for cui, tui, sty, atui in sorted(types)])
+
+
+def build_outputs(meta_dir, out_dir):
+    """
+    Full pipeline run: adjacency index + BFS (pd_bfs_nhop), REL filter, CONSO / STY filters (filter_pd_labels)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    mrrel_path = os.path.join(meta_dir, "MRREL.RRF")
+    cui_txt = os.path.join(out_dir, "pd_nhop_cuis.txt")
+    index_dir = os.path.join(out_dir, "mrrel_index")
+    build_adjacency_index(mrrel_path, index_dir)
+    index = load_adjacency_index(index_dir)
+    hops, seeds = bfs_multi_seed(index, seed_cuis=SEED_CUIS, max_hops=MAX_HOPS)
+    write_bfs_result(index, SEED_CUIS, hops, seeds, cui_txt)
+
+    nodes = load_cui_ids(cui_txt)
+    filter_rel_by_cuis(mrrel_path, nodes, os.path.join(out_dir, "pd_nhop_rel.csv"))
+    filter_mrconso(os.path.join(meta_dir, "MRCONSO.RRF"), nodes, os.path.join(out_dir, "pd_nhop_conso.csv"))
+    filter_mrsty(os.path.join(meta_dir, "MRSTY.RRF"), nodes, os.path.join(out_dir, "pd_nhop_sty.csv"))
+
+
+def read_output(path):
+    # Rows as the later stages read them, in a fixed order (refresh appends instead of keeping RRF order)
+    if path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as fin:
+            return sorted(line.strip() for line in fin if line.strip())
+    frame = pd.read_csv(path, sep="|", dtype=str, keep_default_na=False, na_values=[])
+    return sorted(frame.itertuples(index=False, name=None))
+
+
+def _release_pair(tmp_path):
+    old_meta, new_meta = str(tmp_path / "old_meta"), str(tmp_path / "new_meta")
+    write_release(old_meta, OLD_RELATIONS, OLD_ATOMS, OLD_TYPES)
+    write_release(new_meta, NEW_RELATIONS, NEW_ATOMS, NEW_TYPES)
+    return old_meta, new_meta
+
+
+def test_refresh_matches_full_rebuild(tmp_path):
+    old_meta, new_meta = _release_pair(tmp_path)
+    out_dir, state_dir = str(tmp_path / "out"), str(tmp_path / "state")
+    build_outputs(old_meta, out_dir)
+    snapshot_release(old_meta, state_dir)
+
+    manifest = refresh(new_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+
+    rebuilt_dir = str(tmp_path / "rebuilt")
+    build_outputs(new_meta, rebuilt_dir)
+    for name in OUTPUTS:
+        assert read_output(os.path.join(out_dir, name)) == read_output(os.path.join(rebuilt_dir, name)), name
+    # Aligned with the (equal) CUI lists
+    for name in BFS_ARRAYS:
+        assert np.load(os.path.join(out_dir, name)).tolist() == np.load(os.path.join(rebuilt_dir, name)).tolist(), name
+    names = [row[14] for row in read_output(os.path.join(out_dir, "pd_nhop_conso.csv"))]
+    assert 'Parkinson "shaking palsy"' not in names
+    assert '"Paralysis" agitans' in names
+    assert manifest["tables"]["MRCONSO"]["output_rows_dropped"] == 1
+
+
+def test_refresh_to_same_release_keeps_outputs(tmp_path):
+    # Kept rows are read back and rewritten: quoted STRs must not gain a quoting layer per refresh
+    old_meta, _ = _release_pair(tmp_path)
+    out_dir, state_dir = str(tmp_path / "out"), str(tmp_path / "state")
+    build_outputs(old_meta, out_dir)
+    snapshot_release(old_meta, state_dir)
+    before = {name: read_output(os.path.join(out_dir, name)) for name in OUTPUTS}
+
+    for _ in range(2):
+        manifest = refresh(old_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+        assert all(counts["output_rows_dropped"] == counts["output_rows_added"] == 0
+                   for counts in manifest["tables"].values())
+        assert {name: read_output(os.path.join(out_dir, name)) for name in OUTPUTS} == before
+
+
+def _assert_matches_rebuild(out_dir, new_meta, rebuilt_dir):
+    build_outputs(new_meta, rebuilt_dir)
+    for name in OUTPUTS:
+        assert read_output(os.path.join(out_dir, name)) == read_output(os.path.join(rebuilt_dir, name)), name
+
+
+def test_refresh_reads_only_the_appended_lines(tmp_path, monkeypatch):
+    # Blocks of a few lines, so line offsets cross block boundaries; after the snapshot pass no RRF is read by path
+    monkeypatch.setattr(incremental_refresh, "BLOCK_SIZE", 100)
+    old_meta, new_meta = _release_pair(tmp_path)
+    out_dir, state_dir = str(tmp_path / "out"), str(tmp_path / "state")
+    build_outputs(old_meta, out_dir)
+    snapshot_release(old_meta, state_dir)
+
+    read_rrf = incremental_refresh.read_rrf
+    paths = []
+    monkeypatch.setattr(incremental_refresh, "read_rrf",
+                        lambda source, *args, **kwargs: paths.append(source) or read_rrf(source, *args, **kwargs))
+    refresh(new_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+    assert not [source for source in paths if isinstance(source, (str, os.PathLike))]
+    _assert_matches_rebuild(out_dir, new_meta, str(tmp_path / "rebuilt"))
+
+
+def test_refresh_from_compressed_release(tmp_path):
+    # A gzip release has no byte offsets: the appended rows come from one more scan
+    old_meta, new_meta = _release_pair(tmp_path)
+    out_dir, state_dir = str(tmp_path / "out"), str(tmp_path / "state")
+    build_outputs(old_meta, out_dir)
+    snapshot_release(old_meta, state_dir)
+    gz_meta = str(tmp_path / "gz_meta")
+    os.makedirs(gz_meta)
+    for table in ("MRREL", "MRCONSO", "MRSTY"):
+        with open(os.path.join(new_meta, table + ".RRF"), "rb") as fin, \
+                gzip.open(os.path.join(gz_meta, table + ".RRF.gz"), "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+
+    refresh(gz_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+    assert "offsets" not in np.load(os.path.join(state_dir, "MRREL.npz"))
+    _assert_matches_rebuild(out_dir, new_meta, str(tmp_path / "rebuilt"))
+
+
+def _fail_on_call(monkeypatch, owner, name, call):
+    # owner.name raises on its call-th call
+    func, calls = getattr(owner, name), []
+
+    def failing(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == call:
+            raise OSError(f"{name} interrupted")
+        return func(*args, **kwargs)
+    monkeypatch.setattr(owner, name, failing)
+
+
+@pytest.mark.parametrize("step", ["staging", "commit"])
+def test_rerun_after_interrupted_refresh(tmp_path, monkeypatch, step):
+    # Cut short while the outputs are staged (second table) or while they are moved in (second move)
+    old_meta, new_meta = _release_pair(tmp_path)
+    out_dir, state_dir = str(tmp_path / "out"), str(tmp_path / "state")
+    build_outputs(old_meta, out_dir)
+    snapshot_release(old_meta, state_dir)
+    before = {name: read_output(os.path.join(out_dir, name)) for name in OUTPUTS}
+
+    with monkeypatch.context() as patch:
+        if step == "staging":
+            _fail_on_call(patch, incremental_refresh, "_patch_output", 2)
+        else:
+            # The first os.replace publishes the commit list
+            _fail_on_call(patch, incremental_refresh.os, "replace", 3)
+        with pytest.raises(OSError):
+            refresh(new_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+    if step == "staging":
+        assert {name: read_output(os.path.join(out_dir, name)) for name in OUTPUTS} == before
+
+    manifest = refresh(new_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+    assert manifest["tables"]["MRCONSO"]["output_rows_dropped"] == 1
+    assert not os.path.exists(os.path.join(out_dir, "pd_nhop_refresh.staging"))
+    assert not os.path.exists(state_dir + ".new")
+    _assert_matches_rebuild(out_dir, new_meta, str(tmp_path / "rebuilt"))
+    # The stored state is the new release: refreshing to it again changes nothing
+    manifest = refresh(new_meta, state_dir, out_dir, max_hops=MAX_HOPS)
+    assert all(counts["release_rows_removed"] == counts["release_rows_added"] == 0
+               for counts in manifest["tables"].values())
+
+
+def _bfs_on(edges, index_dir, seed_cuis, max_hops):
+    # Index of an edge list of CUI numbers (as index_from_state builds it) and its full bfs_multi_seed result
+    c1, c2 = np.array([edge[0] for edge in edges], dtype=np.int64), np.array([edge[1] for edge in edges], dtype=np.int64)
+    index = index_from_state({"CUI1": c1, "CUI2": c2}, index_dir)
+    hops, seeds = bfs_multi_seed(index, seed_cuis=seed_cuis, max_hops=max_hops)
+    return index, hops, seeds
+
+
+def test_repair_distances_matches_bfs_multi_seed(tmp_path):
+    # Random edits of random graphs with several seeds: hops and seeds (first listed seed wins ties) as in a rebuild
+    rng = random.Random(0)
+    for trial in range(150):
+        n_nodes, max_hops = rng.randint(8, 40), rng.randint(1, 5)
+        old_edges = {tuple(rng.sample(range(1, n_nodes + 1), 2)) for _ in range(rng.randint(n_nodes, 3 * n_nodes))}
+        removed = set(rng.sample(sorted(old_edges), rng.randint(0, len(old_edges) // 3)))
+        added = {tuple(rng.sample(range(1, n_nodes + 1), 2)) for _ in range(rng.randint(0, n_nodes // 2))}
+        new_edges = (old_edges - removed) | added
+        seed_cuis = [f"C{n:07d}" for n in rng.sample(range(1, n_nodes + 1), rng.randint(1, 4))]
+
+        old_index, old_hops, old_seeds = _bfs_on(sorted(old_edges), str(tmp_path / f"old{trial}"), seed_cuis,
+                                                 max_hops)
+        reached = np.flatnonzero(old_hops >= 0)
+        old_cuis = [old_index["cuis"][i] for i in reached]
+        changed_cuis = sorted({f"C{n:07d}" for edge in removed ^ added for n in edge})
+
+        index, hops, seeds = _bfs_on(sorted(new_edges), str(tmp_path / f"new{trial}"), seed_cuis, max_hops)
+        repaired_hops, repaired_seeds = repair_distances(index, old_cuis, old_hops[reached], old_seeds[reached],
+                                                         seed_cuis, changed_cuis, max_hops)
+        assert repaired_hops.tolist() == hops.tolist(), trial
+        assert repaired_seeds.tolist() == seeds.tolist(), trial
@@ -0,0 +1,45 @@
+"""
+name_index.search: a token match needs one atom that holds every query token.
+Run from the project root: python -m pytest -q tests
+"""
+
+from scripts.kg_builder.name_index import build_name_index, load_name_index, search, seed_cuis
+
+COLUMNS = ["CUI", "LAT", "TS", "ISPREF", "SAB", "TTY", "STR", "SUPPRESS"]
+
+# (CUI, TTY, STR); C0000001 has "acute" and "cerebral" only in different atoms
+ATOMS = [
+    ("C0000001", "PT", "Acute disease"),
+    ("C0000001", "SY", "Cerebral disorder"),
+    ("C0000002", "SY", "Acute cerebral infarction"),
+    ("C0000003", "ET", "Cerebral, acute"),
+    ("C0000003", "PT", "Stroke"),
+    ("C0000004", "PT", "Acute cerebral"),
+]
+
+
+def _index(tmp_path):
+    conso_csv = tmp_path / "conso.csv"
+    with open(conso_csv, "w", encoding="utf-8") as fout:
+        fout.write("|".join(COLUMNS) + "\n")
+        for cui, tty, name in ATOMS:
+            fout.write("|".join([cui, "ENG", "P", "Y", "MSH", tty, name, "N"]) + "\n")
+    build_name_index(str(conso_csv), str(tmp_path / "name_index"))
+    return load_name_index(str(tmp_path / "name_index"))
+
+
+def test_tokens_must_share_an_atom(tmp_path):
+    index = _index(tmp_path)
+    hits = search(index, "acute cerebral", limit=10)
+    assert [(hit["cui"], hit["match"]) for hit in hits] == [
+        ("C0000004", "exact"), ("C0000002", "tokens"), ("C0000003", "tokens")]
+    # The rank is the one of the atom that holds both tokens (SY / ET), not of the CUI's best atom (PT)
+    assert hits[1]["rank"] < hits[2]["rank"]
+    assert [hit["cui"] for hit in search(index, "acute cer", limit=10, prefix=True)] == [
+        "C0000004", "C0000002", "C0000003"]
+    assert search(index, "acute disorder") == []
+
+
+def test_seed_cuis_take_the_best_atom_match(tmp_path):
+    index = _index(tmp_path)
+    assert seed_cuis(index, ["cerebral acute infarction", "acute disease"]) == ["C0000002", "C0000001"]
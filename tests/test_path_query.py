@@ -0,0 +1,89 @@
+"""
+path_query.shortest_path / find_paths: hub handling with max_degree, and a cross-check against networkx.
+Run from the project root: python -m pytest -q tests
+"""
+
+import random
+
+import pytest
+
+from scripts.kg_builder.path_query import build_path_index, find_paths, load_path_index, shortest_path
+
+nx = pytest.importorskip("networkx")
+
+RELATIONS = [("RO", ""), ("CHD", "isa"), ("RN", ""), ("RQ", "")]
+
+
+def _cui(number):
+    return f"C{number:07d}"
+
+
+def _index(tmp_path, edges):
+    # edges: (CUI1 number, CUI2 number, relation position) -> one MRREL row each
+    mrrel_path = tmp_path / "MRREL.RRF"
+    with open(mrrel_path, "w", encoding="utf-8") as fout:
+        for rui, (cui1, cui2, relation) in enumerate(edges):
+            rel, rela = RELATIONS[relation]
+            fout.write("|".join([_cui(cui1), "", "CUI", rel, _cui(cui2), "", "CUI", rela, f"R{rui:08d}", "",
+                                 "MSH", "MSH", "", "", "N", ""]) + "|\n")
+    build_path_index(str(mrrel_path), str(tmp_path / "path_index"))
+    return load_path_index(str(tmp_path / "path_index"))
+
+
+def _hub_edges(extra=()):
+    # 0 - H - 2 with hub H (number 1) of degree 12
+    return [(0, 1, 0), (1, 2, 0)] + [(1, 100 + i, 0) for i in range(10)] + list(extra)
+
+
+@pytest.mark.parametrize("extra", [(), ((0, 3, 0),)])
+def test_hub_is_never_inside_a_path(tmp_path, extra):
+    # The unrelated edge 0 - 3 changes which side is expanded first; the answer must not change
+    index = _index(tmp_path, _hub_edges(extra))
+    assert shortest_path(index, _cui(0), _cui(2), max_degree=3) is None
+    assert find_paths(index, _cui(0), _cui(2), max_degree=3) == []
+    assert shortest_path(index, _cui(0), _cui(2))["cuis"] == [_cui(0), _cui(1), _cui(2)]
+    assert [path["cuis"] for path in find_paths(index, _cui(0), _cui(2))] == [[_cui(0), _cui(1), _cui(2)]]
+    # A hub as an end point is fine
+    assert shortest_path(index, _cui(0), _cui(1), max_degree=3)["length"] == 1
+
+
+def _random_edges(rng, n_nodes, n_edges, n_hubs):
+    edges = [(rng.randrange(n_nodes), rng.randrange(n_nodes), rng.randrange(len(RELATIONS)))
+             for _ in range(n_edges)]
+    for hub in range(n_hubs):
+        edges += [(hub, rng.randrange(n_nodes), 0) for _ in range(12)]
+    return [(cui1, cui2, relation) for cui1, cui2, relation in edges if cui1 != cui2]
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_matches_networkx(tmp_path, seed):
+    rng = random.Random(seed)
+    edges = _random_edges(rng, 40, 60, 3)
+    index = _index(tmp_path, edges)
+    max_degree = 8
+    hubs = {cui for cui, node in index["cui_to_id"].items() if index["degrees"][node] > max_degree}
+    cuis = sorted(index["cui_to_id"])
+
+    for directed in (False, True):
+        graph = nx.DiGraph() if directed else nx.Graph()
+        graph.add_edges_from((_cui(cui1), _cui(cui2)) for cui1, cui2, _ in edges)
+        for _ in range(25):
+            source, target = rng.sample(cuis, 2)
+            for degree in (None, max_degree):
+                sub = graph if degree is None else graph.subgraph(
+                    [cui for cui in graph if cui not in hubs or cui in (source, target)])
+                try:
+                    expected = nx.shortest_path_length(sub, source, target)
+                except nx.NetworkXNoPath:
+                    expected = None
+                found = shortest_path(index, source, target, max_hops=6, directed=directed, max_degree=degree)
+                if expected is None or expected > 6:
+                    assert found is None
+                else:
+                    assert found["length"] == expected
+                    assert all(sub.has_edge(u, v) for u, v in zip(found["cuis"], found["cuis"][1:]))
+
+                paths = [path["cuis"] for path in find_paths(index, source, target, max_length=4, directed=directed,
+                                                             max_degree=degree)]
+                assert sorted(paths) == sorted(nx.all_simple_paths(sub, source, target, cutoff=4))
+                assert [len(path) for path in paths] == sorted(len(path) for path in paths)